@@ -0,0 +1,129 @@
+"""
+Declarative cleaning rules applied by load_from_kaggle.py before anything is written.
+
+These are the rules of Phase-3/clean_data.py, moved in front of the load so rejected
+rows never reach Postgres. Each rule is a name, a description and a vectorized check
+that returns a boolean mask of the rows it rejects. A row is charged to the first rule
+that rejects it, so the per-rule counts add up to the rows removed.
+
+Rejected rows are not thrown away: `Quarantine` writes them, with the rule that
+rejected them, to one Parquet file per input file and keeps the running counts.
+"""
+
+import json
+import os
+
+import pandas as pd
+
+# Columns the loader casts to int, plus the timestamps the Time table is built from.
+# Other columns (store_and_fwd_flag, congestion_surcharge, Airport_fee) may stay NULL.
+REQUIRED_COLUMNS = ['tpep_pickup_datetime', 'tpep_dropoff_datetime', 'passenger_count', 'improvement_surcharge',
+                    'VendorID', 'payment_type', 'RatecodeID', 'PULocationID', 'DOLocationID']
+
+LOCATION_RULES = [
+    {
+        "name": "null_borough_or_zone",
+        "description": "Location has no Borough or Zone",
+        "reject": lambda df, context: df['Borough'].isna() | df['Zone'].isna()
+    },
+    {
+        # Trips of the duplicate are remapped onto the kept ID with location_remap
+        "name": "duplicate_borough_zone",
+        "description": "Borough/Zone pair already has a location with a lower ID",
+        "reject": lambda df, context: df['ID'].isin(list(location_remap(df)))
+    }
+]
+
+TRIP_RULES = [
+    {
+        "name": "missing_required",
+        "description": "A column needed by the Trip or Time table is NULL",
+        "reject": lambda df, context: df[[c for c in REQUIRED_COLUMNS if c in df.columns]].isna().any(axis=1)
+    },
+    {
+        "name": "invalid_dropoff",
+        "description": "Drop-off is before pick-up",
+        "reject": lambda df, context: df['tpep_dropoff_datetime'] < df['tpep_pickup_datetime']
+    },
+    {
+        "name": "invalid_passenger_count",
+        "description": "PassengerCount < 1",
+        "reject": lambda df, context: df['passenger_count'] < 1
+    },
+    {
+        "name": "negative_distance_or_fare",
+        "description": "TripDistance < 0 or FareAmount < 0",
+        "reject": lambda df, context: (df['trip_distance'] < 0) | (df['fare_amount'] < 0)
+    },
+    {
+        "name": "unknown_location",
+        "description": "Pick-up or drop-off zone is not a kept Location",
+        "reject": lambda df, context: ~(df['PULocationID'].isin(context['location_ids']) &
+                                        df['DOLocationID'].isin(context['location_ids']))
+    }
+]
+
+
+def apply_rules(df, rules, context=None):
+    """
+    Split a frame into the rows that pass every rule and the rows that do not
+    :param df: batch to check
+    :param rules: list of rule dicts
+    :param context: extra values the rules need, e.g. the kept location IDs
+    :return: (kept frame, rejected frame with a RejectRule column, dict of rule name -> rows rejected)
+    """
+    rejected_by = pd.Series(None, index=df.index, dtype=object)
+    counts = {}
+    for rule in rules:
+        # Only rows no earlier rule rejected can be charged to this one
+        mask = rule['reject'](df, context).fillna(False).astype(bool) & rejected_by.isna()
+        rejected_by[mask] = rule['name']
+        counts[rule['name']] = int(mask.sum())
+
+    is_rejected = rejected_by.notna()
+    rejected = df[is_rejected].assign(RejectRule=rejected_by[is_rejected])
+    return df[~is_rejected], rejected, counts
+
+
+def location_remap(location_df):
+    """
+    Map every duplicate Borough/Zone location onto the lowest ID of its pair
+    :param location_df: locations with ID, Borough and Zone columns
+    :return: dict of duplicate ID -> kept ID
+    """
+    located = location_df.dropna(subset=['Borough', 'Zone'])
+    keep_id = located.groupby(['Borough', 'Zone'])['ID'].transform('min')
+    duplicate = located['ID'] != keep_id
+    return dict(zip(located.loc[duplicate, 'ID'], keep_id[duplicate]))
+
+
+class Quarantine:
+    def __init__(self, directory):
+        """
+        Collects the rejected rows of each input file and the per-rule counts
+        :param directory: folder for the quarantine Parquet files and the counts summary
+        """
+        self.directory = directory
+        self.counts = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, name, rejected, counts):
+        """
+        Write one input file's rejected rows and add its counts to the totals
+        :param name: name of the input, used for the Parquet file name
+        :param rejected: rejected rows from apply_rules
+        :param counts: per-rule counts from apply_rules
+        :return: None
+        """
+        for rule, rows in counts.items():
+            self.counts[rule] = self.counts.get(rule, 0) + rows
+            if rows:
+                print(f"  rejected {rows} rows: {rule}")
+
+        if len(rejected):
+            rejected.to_parquet(os.path.join(self.directory, f"{name}.parquet"), index=False)
+
+    def write_summary(self, filename='rule_counts.json'):
+        with open(os.path.join(self.directory, filename), 'w') as f:
+            json.dump(self.counts, f, indent=2)
+        print("Rows rejected per rule: ", self.counts)
@@ -1,67 +1,92 @@
+import os
+import sys
+
 import pandas as pd
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.instrumentation import stage, start_run, write_report  # noqa: E402
+from cleaning_rules import LOCATION_RULES, REQUIRED_COLUMNS, TRIP_RULES, Quarantine, apply_rules, location_remap
+from tlc_reader import file_month, read_trips
+
 pd.set_option('display.max_columns', None)
 pd.options.mode.chained_assignment = None 
 
-borough_info = "raw_data\\taxi_zone_lookup.csv"
-data_2024_01 = "raw_data\\yellow_tripdata_2024-01.parquet"
-data_2024_02 = "raw_data\\yellow_tripdata_2024-02.parquet"
-data_2024_03 = "raw_data\\yellow_tripdata_2024-03.parquet"
-data_2024_04 = "raw_data\\yellow_tripdata_2024-04.parquet"
-data_2024_05 = "raw_data\\yellow_tripdata_2024-05.parquet"
-data_2024_06 = "raw_data\\yellow_tripdata_2024-06.parquet"
-data_2024_07 = "raw_data\\yellow_tripdata_2024-07.parquet"
-
-data_2023_01 = "raw_data\\yellow_tripdata_2023-01.parquet"
-data_2023_02 = "raw_data\\yellow_tripdata_2023-02.parquet"
-data_2023_03 = "raw_data\\yellow_tripdata_2023-03.parquet"
-data_2023_04 = "raw_data\\yellow_tripdata_2023-04.parquet"
-data_2023_05 = "raw_data\\yellow_tripdata_2023-05.parquet"
-data_2023_06 = "raw_data\\yellow_tripdata_2023-06.parquet"
-data_2023_07 = "raw_data\\yellow_tripdata_2023-07.parquet"
-data_2023_08 = "raw_data\\yellow_tripdata_2023-08.parquet"
-data_2023_09 = "raw_data\\yellow_tripdata_2023-09.parquet"
-data_2023_10 = "raw_data\\yellow_tripdata_2023-10.parquet"
-data_2023_11 = "raw_data\\yellow_tripdata_2023-11.parquet"
-data_2023_12 = "raw_data\\yellow_tripdata_2023-12.parquet"
+# Raw TLC files; set TLC_RAW_DATA to use the output of synthetic_tlc.py instead
+raw_data = os.environ.get('TLC_RAW_DATA', 'raw_data')
+borough_info = os.path.join(raw_data, 'taxi_zone_lookup.csv')
+data_2024_01 = os.path.join(raw_data, 'yellow_tripdata_2024-01.parquet')
+data_2024_02 = os.path.join(raw_data, 'yellow_tripdata_2024-02.parquet')
+data_2024_03 = os.path.join(raw_data, 'yellow_tripdata_2024-03.parquet')
+data_2024_04 = os.path.join(raw_data, 'yellow_tripdata_2024-04.parquet')
+data_2024_05 = os.path.join(raw_data, 'yellow_tripdata_2024-05.parquet')
+data_2024_06 = os.path.join(raw_data, 'yellow_tripdata_2024-06.parquet')
+data_2024_07 = os.path.join(raw_data, 'yellow_tripdata_2024-07.parquet')
+
+data_2023_01 = os.path.join(raw_data, 'yellow_tripdata_2023-01.parquet')
+data_2023_02 = os.path.join(raw_data, 'yellow_tripdata_2023-02.parquet')
+data_2023_03 = os.path.join(raw_data, 'yellow_tripdata_2023-03.parquet')
+data_2023_04 = os.path.join(raw_data, 'yellow_tripdata_2023-04.parquet')
+data_2023_05 = os.path.join(raw_data, 'yellow_tripdata_2023-05.parquet')
+data_2023_06 = os.path.join(raw_data, 'yellow_tripdata_2023-06.parquet')
+data_2023_07 = os.path.join(raw_data, 'yellow_tripdata_2023-07.parquet')
+data_2023_08 = os.path.join(raw_data, 'yellow_tripdata_2023-08.parquet')
+data_2023_09 = os.path.join(raw_data, 'yellow_tripdata_2023-09.parquet')
+data_2023_10 = os.path.join(raw_data, 'yellow_tripdata_2023-10.parquet')
+data_2023_11 = os.path.join(raw_data, 'yellow_tripdata_2023-11.parquet')
+data_2023_12 = os.path.join(raw_data, 'yellow_tripdata_2023-12.parquet')
+
+processed_data = os.environ.get('TLC_PROCESSED_DATA', 'C:\\Sem4\\CSCI620\\Project\\processed_data')
+
+# Write one time/trip CSV pair per pickup month (time_info_YYYY_MM.csv, trip_info_YYYY_MM.csv)
+# so DataReader/partition_loader.py can load each month into its own partition
+PARTITION_BY_MONTH = False
 
 trips_data = [
     # data_2024_01, data_2024_02, data_2024_03, data_2024_04, data_2024_05, data_2024_06, data_2024_07,
               data_2023_01, data_2023_02, data_2023_03, data_2023_04, data_2023_05, data_2023_06, data_2023_07,
               data_2023_08, data_2023_09, data_2023_10, data_2023_11, data_2023_12]
 
+start_run('load_from_kaggle')
+
+# Rows rejected by the cleaning rules, with per-rule counts
+quarantine = Quarantine(os.path.join(processed_data, 'quarantine'))
+
 # boroguh
 borough_df = pd.read_csv(borough_info)
 
 # Location table requires ID, Borough, Zone, save new csv
 borough_df.rename(columns={'LocationID': 'ID'}, inplace=True)
-borough_df[['ID', 'Borough', 'Zone']].to_csv('C:\\Sem4\\CSCI620\\Project\\processed_data\\borough_info.csv', index=False)
+# Trips of a duplicate location are moved onto the kept one before the trip rules run
+remap = location_remap(borough_df)
+borough_df, rejected, counts = apply_rules(borough_df, LOCATION_RULES)
+quarantine.add('taxi_zone_lookup', rejected, counts)
+borough_df[['ID', 'Borough', 'Zone']].to_csv(os.path.join(processed_data, 'borough_info.csv'), index=False)
 
 # RateCode table requires columns: ID and description
 ratecode_df = pd.DataFrame({
     'ID': [1, 2, 3, 4, 5, 6],
     'description': ['Standard rate', 'JFK', 'Newark', 'Nassau or Westchester', 'Negotiated fare', 'Group ride']
 })
-ratecode_df.to_csv('C:\\Sem4\\CSCI620\\Project\\processed_data\\ratecode_info.csv', index=False)
+ratecode_df.to_csv(os.path.join(processed_data, 'ratecode_info.csv'), index=False)
 
 # Payment table requires columns: ID and description
 payment_df = pd.DataFrame({
     'ID': [1, 2, 3, 4, 5, 6],
     'description': ['Credit card', 'Cash', 'No charge', 'Dispute', 'Unknown', 'Voided trip']
 })
-payment_df.to_csv('C:\\Sem4\\CSCI620\\Project\\processed_data\\payment_info.csv', index=False)
+payment_df.to_csv(os.path.join(processed_data, 'payment_info.csv'), index=False)
 
 # Vendor table requires columns: ID and description
 vendor_df = pd.DataFrame({
     'ID': [1, 2],
     'description': ['Creative Mobile Technologies, LLC', 'VeriFone Inc.']
 })
-vendor_df.to_csv('C:\\Sem4\\CSCI620\\Project\\processed_data\\vendor_info.csv', index=False)
+vendor_df.to_csv(os.path.join(processed_data, 'vendor_info.csv'), index=False)
 
 
 # clear the time_info.csv and trip_info.csv
-open('C:\\Sem4\\CSCI620\\Project\\processed_data\\time_info.csv', 'w').close()
-open('C:\\Sem4\\CSCI620\\Project\\processed_data\\trip_info.csv', 'w').close()
+open(os.path.join(processed_data, 'time_info.csv'), 'w').close()
+open(os.path.join(processed_data, 'trip_info.csv'), 'w').close()
 
 count = 0
 next_id_start = 0
@@ -77,71 +102,96 @@ for trip in trips_data:
     print("Loading file ", count, " of ", len(trips_data))
         
 
-    # Load the Parquet file
-    data_df = pd.read_parquet(trip)
-    data_df['TripID'] = data_df.index
-    data_df.dropna(inplace=True)
-
-    # Time table requires TripID, PickUpDate, PickUpTime, DropOffDate, DropOffTime, DayOfWeek, IsWeekend
-    # Create a new DataFrame with the desired columns
-    time_df = data_df[['TripID', 'tpep_pickup_datetime', 'tpep_dropoff_datetime']]
-
-    # Convert datetime to appropriate formats
-    time_df['PickUpDate'] = time_df['tpep_pickup_datetime'].dt.date
-    time_df['PickUpTime'] = time_df['tpep_pickup_datetime'].dt.time
-    time_df['DropOffDate'] = time_df['tpep_dropoff_datetime'].dt.date
-    time_df['DropOffTime'] = time_df['tpep_dropoff_datetime'].dt.time
-
-    # Calculate DayOfWeek and IsWeekend
-    time_df['DayOfWeek'] = time_df['tpep_pickup_datetime'].dt.dayofweek
-    time_df['IsWeekend'] = time_df['DayOfWeek'].isin([5, 6])
-
-    # Drop unnecessary columns
-    time_df.drop(columns=['tpep_pickup_datetime', 'tpep_dropoff_datetime'], inplace=True)
-
-    # Save the time DataFrame to a CSV file
-    time_df.to_csv('C:\\Sem4\\CSCI620\\Project\\processed_data\\time_info.csv', mode='a', header=header_bool, index=False)
-
-    # Trip table requires columns: TripID, PassengerCount, TripDistance, StoreAndFwdFlag, FareAmount, Extra, MTATax, 
-    # ImprovementSurcharge, TipAmount, TollsAmount, TOtalAmount, CongestionSurcharge, AirportFee, Vendor, PaymentType, 
-    # Ratecode, PickUpLocation, DropOffLocation
-
-    desired_columns = ['TripID', 'passenger_count', 'trip_distance', 'store_and_fwd_flag', 'fare_amount', 'extra', 'mta_tax', 'improvement_surcharge',
-                    'tip_amount', 'tolls_amount', 'total_amount', 'congestion_surcharge', 'Airport_fee', 'VendorID', 'payment_type', 'RatecodeID',
-                    'PULocationID', 'DOLocationID']
-
-    existing_columns = [col for col in desired_columns if col in data_df.columns]
-    # existing_columns = [col if col in data_df.columns else None for col in desired_columns]
-
-    trip_df = data_df[existing_columns].rename(columns={
-                                                            'TripID': 'ID',
-                                                            'passenger_count': 'PassengerCount',
-                                                            'trip_distance': 'TripDistance',
-                                                            'store_and_fwd_flag': 'StoreAndFwdFlag',
-                                                            'fare_amount': 'FareAmount',
-                                                            'mta_tax': 'MTATax',
-                                                            'improvement_surcharge': 'ImprovementSurcharge',
-                                                            'tip_amount': 'TipAmount',
-                                                            'tolls_amount': 'TollsAmount',
-                                                            'total_amount': 'TotalAmount',
-                                                            'congestion_surcharge': 'CongestionSurcharge',
-                                                            'Airport_fee': 'AirportFee',
-                                                            'VendorID': 'Vendor',
-                                                            'payment_type': 'PaymentType',
-                                                            'RatecodeID': 'Ratecode',
-                                                            'PULocationID': 'PickUpLocation',
-                                                            'DOLocationID': 'DropOffLocation'
-                                                        }, errors= 'ignore')
-    trip_df['ID'] = trip_df['ID'] + next_id_start
-    next_id_start = trip_df['ID'].max() + 1
-    trip_df['PassengerCount'] = trip_df['PassengerCount'].astype(int)
-    trip_df['ImprovementSurcharge'] = trip_df['ImprovementSurcharge'].astype(int)
-    trip_df['Vendor'] = trip_df['Vendor'].astype(int)
-    trip_df['PaymentType'] = trip_df['PaymentType'].astype(int)
-    trip_df['Ratecode'] = trip_df['Ratecode'].astype(int)
-    trip_df['PickUpLocation'] = trip_df['PickUpLocation'].astype(int)
-    trip_df['DropOffLocation'] = trip_df['DropOffLocation'].astype(int)
-    trip_df.to_csv('C:\\Sem4\\CSCI620\\Project\\processed_data\\trip_info.csv', float_format='%.0f', mode='a', header=header_bool, index=False)
-
-
-
+    with stage(os.path.basename(trip)) as file_stage:
+        # Scan only the columns of the target schema, unified across years, and leave out the rows
+        # with NULL keys (and, per month partition, pickups outside the month) in the scan itself
+        data_df, scan = read_trips(trip, required=REQUIRED_COLUMNS,
+                                   month=file_month(trip) if PARTITION_BY_MONTH else None)
+        file_stage.rows = scan['rows_in_file']
+        # Offset the IDs here so Time.TripID and Trip.ID agree across files
+        data_df['TripID'] = data_df.index + next_id_start
+        # Reject invalid rows here, before they are written, instead of deleting them after the load
+        location_columns = ['PULocationID', 'DOLocationID']
+        data_df[location_columns] = data_df[location_columns].replace(remap)
+        data_df, rejected, counts = apply_rules(data_df, TRIP_RULES, {'location_ids': borough_df['ID']})
+        counts['missing_required'] += scan['null_rows']
+        quarantine.add(os.path.splitext(os.path.basename(trip))[0], rejected, counts)
+        file_stage.meta['rows_kept'] = len(data_df)
+
+        if PARTITION_BY_MONTH:
+            # A monthly partition only accepts pickups inside its month; read_trips dropped the others
+            start = file_month(trip)
+            year, month = f'{start.year}', f'{start.month:02d}'
+            print("Dropping ", scan['outside_month'], " trips picked up outside ", year, "-", month)
+
+            time_path = os.path.join(processed_data, f'time_info_{year}_{month}.csv')
+            trip_path = os.path.join(processed_data, f'trip_info_{year}_{month}.csv')
+            write_mode, header_bool = 'w', True
+        else:
+            time_path = os.path.join(processed_data, 'time_info.csv')
+            trip_path = os.path.join(processed_data, 'trip_info.csv')
+            write_mode = 'a'
+
+        # Time table requires TripID, PickUpDate, PickUpTime, DropOffDate, DropOffTime, DayOfWeek, IsWeekend
+        # Create a new DataFrame with the desired columns
+        time_df = data_df[['TripID', 'tpep_pickup_datetime', 'tpep_dropoff_datetime']]
+
+        # Convert datetime to appropriate formats
+        time_df['PickUpDate'] = time_df['tpep_pickup_datetime'].dt.date
+        time_df['PickUpTime'] = time_df['tpep_pickup_datetime'].dt.time
+        time_df['DropOffDate'] = time_df['tpep_dropoff_datetime'].dt.date
+        time_df['DropOffTime'] = time_df['tpep_dropoff_datetime'].dt.time
+
+        # Calculate DayOfWeek and IsWeekend
+        time_df['DayOfWeek'] = time_df['tpep_pickup_datetime'].dt.dayofweek
+        time_df['IsWeekend'] = time_df['DayOfWeek'].isin([5, 6])
+
+        # Drop unnecessary columns
+        time_df.drop(columns=['tpep_pickup_datetime', 'tpep_dropoff_datetime'], inplace=True)
+
+        # Save the time DataFrame to a CSV file
+        time_df.to_csv(time_path, mode=write_mode, header=header_bool, index=False)
+
+        # Trip table requires columns: TripID, PassengerCount, TripDistance, StoreAndFwdFlag, FareAmount, Extra, MTATax, 
+        # ImprovementSurcharge, TipAmount, TollsAmount, TOtalAmount, CongestionSurcharge, AirportFee, Vendor, PaymentType, 
+        # Ratecode, PickUpLocation, DropOffLocation
+
+        desired_columns = ['TripID', 'passenger_count', 'trip_distance', 'store_and_fwd_flag', 'fare_amount', 'extra', 'mta_tax', 'improvement_surcharge',
+                        'tip_amount', 'tolls_amount', 'total_amount', 'congestion_surcharge', 'Airport_fee', 'VendorID', 'payment_type', 'RatecodeID',
+                        'PULocationID', 'DOLocationID']
+
+        # The scan unified the schema, so every desired column exists (NULL if the file lacks it)
+        trip_df = data_df[desired_columns].rename(columns={
+                                                                'TripID': 'ID',
+                                                                'passenger_count': 'PassengerCount',
+                                                                'trip_distance': 'TripDistance',
+                                                                'store_and_fwd_flag': 'StoreAndFwdFlag',
+                                                                'fare_amount': 'FareAmount',
+                                                                'mta_tax': 'MTATax',
+                                                                'improvement_surcharge': 'ImprovementSurcharge',
+                                                                'tip_amount': 'TipAmount',
+                                                                'tolls_amount': 'TollsAmount',
+                                                                'total_amount': 'TotalAmount',
+                                                                'congestion_surcharge': 'CongestionSurcharge',
+                                                                'Airport_fee': 'AirportFee',
+                                                                'VendorID': 'Vendor',
+                                                                'payment_type': 'PaymentType',
+                                                                'RatecodeID': 'Ratecode',
+                                                                'PULocationID': 'PickUpLocation',
+                                                                'DOLocationID': 'DropOffLocation'
+                                                            }, errors= 'ignore')
+        next_id_start = trip_df['ID'].max() + 1
+        trip_df['PassengerCount'] = trip_df['PassengerCount'].astype(int)
+        trip_df['ImprovementSurcharge'] = trip_df['ImprovementSurcharge'].astype(int)
+        trip_df['Vendor'] = trip_df['Vendor'].astype(int)
+        trip_df['PaymentType'] = trip_df['PaymentType'].astype(int)
+        trip_df['Ratecode'] = trip_df['Ratecode'].astype(int)
+        trip_df['PickUpLocation'] = trip_df['PickUpLocation'].astype(int)
+        trip_df['DropOffLocation'] = trip_df['DropOffLocation'].astype(int)
+        if PARTITION_BY_MONTH:
+            # Partition key of the time-partitioned Trip table
+            trip_df['PickUpDate'] = data_df['tpep_pickup_datetime'].dt.date
+        trip_df.to_csv(trip_path, float_format='%.0f', mode=write_mode, header=header_bool, index=False)
+
+quarantine.write_summary()
+write_report()
@@ -0,0 +1,118 @@
+"""
+Loads the monthly time_info_YYYY_MM.csv / trip_info_YYYY_MM.csv files written by
+load_from_kaggle.py (with PARTITION_BY_MONTH = True) into the time-partitioned
+schema of table_creation_partitioned.sql.
+
+Each month is copied into a standalone table first, so the COPY does not touch the
+partitioned parent and the indexes are built once, after the data is in. A CHECK
+constraint matching the partition bounds lets ATTACH PARTITION skip its validation
+scan. Adding a month later only needs this script and its two CSV files.
+"""
+
+import glob
+import os
+import re
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import db  # noqa: E402
+
+processed_data = os.environ.get('TLC_PROCESSED_DATA', 'C:\\Sem4\\CSCI620\\Project\\processed_data')
+
+
+def month_bounds(year, month):
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
+
+
+def find_months(directory=processed_data):
+    """
+    List the months that have a trip CSV waiting to be loaded
+    :param directory: folder holding the per-month CSV files
+    :return: sorted list of (year, month)
+    """
+    months = []
+    for path in glob.glob(os.path.join(directory, 'trip_info_*_*.csv')):
+        match = re.search(r'trip_info_(\d{4})_(\d{2})\.csv$', path)
+        if match:
+            months.append((int(match.group(1)), int(match.group(2))))
+    return sorted(months)
+
+
+def is_attached(cursor, partition):
+    cursor.execute("""
+        SELECT EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(%s));
+    """, (partition,))
+    return cursor.fetchone()[0]
+
+
+def load_partition(conn, parent, year, month, csv_path, indexes):
+    """
+    Copy one month into its own table, index it and attach it to the parent
+    :param conn: database connection
+    :param parent: partitioned table, 'trip' or 'time'
+    :param year: pickup year of the partition
+    :param month: pickup month of the partition
+    :param csv_path: CSV file with a header row, columns in the parent's order
+    :param indexes: index/key statements to run before attaching, with {partition} as a placeholder
+    :return: None
+    """
+    partition = f"{parent}_y{year}m{month:02d}"
+    start, end = month_bounds(year, month)
+
+    with conn.cursor() as cur:
+        if is_attached(cur, partition):
+            print(f"{partition} is already attached, skipping")
+            return
+
+        cur.execute(f"DROP TABLE IF EXISTS {partition};")
+        cur.execute(f"CREATE TABLE {partition} (LIKE {parent} INCLUDING DEFAULTS);")
+
+        with open(csv_path) as f:
+            cur.copy_expert(f"COPY {partition} FROM STDIN WITH (FORMAT csv, HEADER true)", f)
+
+        # Matching CHECK constraint: ATTACH PARTITION then trusts it instead of scanning the rows
+        cur.execute(f"""
+            ALTER TABLE {partition} ADD CONSTRAINT {partition}_bounds
+            CHECK (PickUpDate IS NOT NULL AND PickUpDate >= %s AND PickUpDate < %s);
+        """, (start, end))
+
+        # Indexes matching the parent's are adopted by ATTACH PARTITION instead of being rebuilt
+        for statement in indexes:
+            cur.execute(statement.format(partition=partition))
+
+        cur.execute(f"""
+            ALTER TABLE {parent} ATTACH PARTITION {partition}
+            FOR VALUES FROM (%s) TO (%s);
+        """, (start, end))
+
+        # The partition bound now enforces the same rule
+        cur.execute(f"ALTER TABLE {partition} DROP CONSTRAINT {partition}_bounds;")
+        cur.execute(f"ANALYZE {partition};")
+    conn.commit()
+    print(f"Attached {partition}")
+
+
+def main():
+    conn = db.connect(tuning=db.BULK)
+    try:
+        for year, month in find_months():
+            suffix = f"{year}_{month:02d}"
+
+            # Trip first: attaching a Time partition validates its foreign key against Trip
+            load_partition(conn, 'trip', year, month,
+                           os.path.join(processed_data, f'trip_info_{suffix}.csv'),
+                           ['ALTER TABLE {partition} ADD PRIMARY KEY (ID, PickUpDate);',
+                            'CREATE INDEX {partition}_pickupdate_brin ON {partition} USING BRIN (PickUpDate);'])
+            load_partition(conn, 'time', year, month,
+                           os.path.join(processed_data, f'time_info_{suffix}.csv'),
+                           ['CREATE INDEX {partition}_pickupdate_brin ON {partition} USING BRIN (PickUpDate);',
+                            'CREATE INDEX {partition}_tripid_pickupdate_idx ON {partition} (TripID, PickUpDate);'])
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
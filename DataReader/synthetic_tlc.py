@@ -0,0 +1,345 @@
+"""
+Synthetic NYC Yellow Taxi trip data at a chosen scale factor.
+
+Writes monthly `yellow_tripdata_YYYY-MM.parquet` files with the column names and
+types of the TLC files that `load_from_kaggle.py` reads, plus a matching
+`taxi_zone_lookup.csv`. The output is reproducible from the seed, so the loader,
+cleaning, mining and FD discovery can be benchmarked at 1M, 10M or 44M rows on a
+machine without the real dataset.
+
+Main features:
+    - Zone lookup: 265 zones with the real borough sizes, the airports at their
+      real IDs, and the quirks the cleaning rules handle (duplicate Borough/Zone
+      pairs at 56/57 and 103-105, an "N/A" borough at 265).
+    - Skewed origin/destination matrix: zone popularity is heavy-tailed, Manhattan
+      and the airports dominate, and most trips stay inside their borough.
+    - Rush-hour timing: pickup hours follow a weekday or weekend profile, and
+      trips are slower in the rush hours.
+    - Fares follow the distance and duration, with flat JFK fares; tips depend on
+      the payment type, and the surcharges follow the 2023 rules.
+    - A small share of rows is dirty like the real files: NULL passenger and
+      ratecode fields, drop-off before pick-up, zero passengers, negative fares.
+    - Vectorized with numpy and written in row groups of `chunk_size` rows, so
+      memory stays flat whatever the scale.
+
+Requirements:
+- `numpy`, `pandas` and `pyarrow`.
+
+HOW TO RUN:
+1) Pick the scale (1.0 = 1M trips), year and output folder in `main`.
+2) Run this File, then run load_from_kaggle.py with TLC_RAW_DATA set to the output folder.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.instrumentation import stage, start_run, write_report  # noqa: E402
+
+ROWS_PER_SCALE = 1_000_000
+
+# Column names and types of the 2023 TLC Yellow Taxi files
+TLC_SCHEMA = pa.schema([
+    ('VendorID', pa.int32()),
+    ('tpep_pickup_datetime', pa.timestamp('us')),
+    ('tpep_dropoff_datetime', pa.timestamp('us')),
+    ('passenger_count', pa.float64()),
+    ('trip_distance', pa.float64()),
+    ('RatecodeID', pa.float64()),
+    ('store_and_fwd_flag', pa.string()),
+    ('PULocationID', pa.int32()),
+    ('DOLocationID', pa.int32()),
+    ('payment_type', pa.int64()),
+    ('fare_amount', pa.float64()),
+    ('extra', pa.float64()),
+    ('mta_tax', pa.float64()),
+    ('tip_amount', pa.float64()),
+    ('tolls_amount', pa.float64()),
+    ('improvement_surcharge', pa.float64()),
+    ('total_amount', pa.float64()),
+    ('congestion_surcharge', pa.float64()),
+    ('Airport_fee', pa.float64())
+])
+
+# Zones per borough in the real lookup (IDs 1-263); 264 and 265 are the unknown zones
+BOROUGH_SIZES = {'EWR': 1, 'Queens': 69, 'Bronx': 43, 'Manhattan': 69, 'Staten Island': 20, 'Brooklyn': 61}
+# Rough borough centres in miles, used to place zones and derive trip distances
+BOROUGH_CENTRES = {'EWR': (-9.0, -3.0), 'Queens': (8.0, 1.0), 'Bronx': (4.0, 9.0), 'Manhattan': (0.0, 3.0),
+                   'Staten Island': (-6.0, -10.0), 'Brooklyn': (3.0, -5.0), 'Unknown': (0.0, 0.0), 'N/A': (0.0, 0.0)}
+# Relative pickup popularity of a borough's zones
+BOROUGH_WEIGHTS = {'EWR': 0.05, 'Queens': 0.6, 'Bronx': 0.15, 'Manhattan': 8.0, 'Staten Island': 0.02,
+                   'Brooklyn': 0.5, 'Unknown': 0.3, 'N/A': 0.05}
+
+EWR, JFK, LGA = 1, 132, 138
+AIRPORT_WEIGHT = 40.0
+# Share of trips that end in the borough they started in
+SAME_BOROUGH = 0.75
+
+# Pickups per hour of day, weekday and weekend
+WEEKDAY_HOURS = np.array([2.0, 1.2, 0.8, 0.5, 0.5, 0.9, 2.2, 3.8, 4.6, 4.4, 4.2, 4.3,
+                          4.6, 4.6, 4.9, 5.0, 5.2, 6.0, 6.4, 5.8, 5.2, 5.0, 4.4, 3.2])
+WEEKEND_HOURS = np.array([3.6, 3.0, 2.3, 1.5, 0.9, 0.7, 0.8, 1.2, 1.9, 2.8, 3.6, 4.2,
+                          4.6, 4.7, 4.8, 4.8, 4.9, 5.0, 5.1, 4.8, 4.5, 4.5, 4.4, 4.0])
+RUSH_HOURS = [7, 8, 9, 16, 17, 18, 19]
+
+PASSENGER_COUNTS = ([1, 2, 3, 4, 5, 6], [0.74, 0.15, 0.04, 0.02, 0.03, 0.02])
+PAYMENT_TYPES = ([1, 2, 3, 4], [0.79, 0.18, 0.015, 0.015])
+VENDORS = ([1, 2], [0.27, 0.73])
+
+JFK_FLAT_FARE = 70.0
+NEWARK_SURCHARGE = 20.0
+TOLL = 6.94
+
+
+def zone_lookup(seed=0):
+    """
+    Build the synthetic taxi zone lookup
+    :param seed: seed of the borough assignment and zone placement
+    :return: DataFrame with LocationID, Borough, Zone, service_zone and the
+             x, y coordinates and popularity weight used by the generator
+    """
+    rng = np.random.default_rng(seed)
+    boroughs = [b for b, size in BOROUGH_SIZES.items() if b != 'EWR' for _ in range(size)]
+    boroughs = ['EWR'] + list(rng.permutation(boroughs)) + ['Unknown', 'N/A']
+    # Airports are in Queens, and the duplicate pairs share a borough as in the real file
+    for location_id, borough in ((JFK, 'Queens'), (LGA, 'Queens'), (103, 'Manhattan'), (104, 'Manhattan'),
+                                 (105, 'Manhattan')):
+        boroughs[location_id - 1] = borough
+    boroughs[56] = boroughs[55]
+
+    lookup = pd.DataFrame({'LocationID': np.arange(1, len(boroughs) + 1), 'Borough': boroughs})
+    lookup['Zone'] = lookup['Borough'] + ' Zone ' + lookup['LocationID'].astype(str)
+    lookup['service_zone'] = np.where(lookup['Borough'] == 'Manhattan', 'Yellow Zone', 'Boro Zone')
+
+    special = {EWR: ('Newark Airport', 'EWR'), JFK: ('JFK Airport', 'Airports'), LGA: ('LaGuardia Airport', 'Airports'),
+               264: ('N/A', 'N/A'), 265: ('Outside of NYC', 'N/A')}
+    for location_id, (zone, service_zone) in special.items():
+        lookup.loc[lookup['LocationID'] == location_id, ['Zone', 'service_zone']] = [zone, service_zone]
+    lookup.loc[lookup['LocationID'] == 57, 'Zone'] = lookup.loc[lookup['LocationID'] == 56, 'Zone'].iloc[0]
+    lookup.loc[lookup['LocationID'].isin([104, 105]), 'Zone'] = lookup.loc[lookup['LocationID'] == 103, 'Zone'].iloc[0]
+
+    centres = np.array([BOROUGH_CENTRES[b] for b in boroughs])
+    lookup['x'] = centres[:, 0] + rng.normal(0, 1.5, len(lookup))
+    lookup['y'] = centres[:, 1] + rng.normal(0, 1.5, len(lookup))
+    # Heavy-tailed popularity within each borough
+    weights = np.array([BOROUGH_WEIGHTS[b] for b in boroughs]) * rng.lognormal(0, 1.2, len(lookup))
+    weights[[JFK - 1, LGA - 1]] = AIRPORT_WEIGHT
+    lookup['weight'] = weights / weights.sum()
+    return lookup
+
+
+class TripGenerator:
+    def __init__(self, lookup, seed=42, dirty_fraction=0.01):
+        """
+        Vectorized generator of TLC trip batches
+        :param lookup: zone lookup from zone_lookup()
+        :param seed: base seed; each (year, month, chunk) gets its own stream
+        :param dirty_fraction: share of rows given one of the defects of the real files
+        """
+        self.seed = seed
+        self.dirty_fraction = dirty_fraction
+        self.zone_ids = lookup['LocationID'].to_numpy()
+        self.x = lookup['x'].to_numpy()
+        self.y = lookup['y'].to_numpy()
+        self.weights = lookup['weight'].to_numpy()
+        self.manhattan = (lookup['Borough'] == 'Manhattan').to_numpy()
+
+        # Destination choice inside each borough, by zone popularity
+        boroughs = lookup['Borough'].to_numpy()
+        self.borough_codes, self.borough_of_zone = np.unique(boroughs, return_inverse=True)
+        self.borough_zones = [np.flatnonzero(self.borough_of_zone == code) for code in range(len(self.borough_codes))]
+        self.borough_weights = [self.weights[zones] / self.weights[zones].sum() for zones in self.borough_zones]
+
+    def destinations(self, rng, origins):
+        """
+        Pick a destination zone index per origin: same borough with probability SAME_BOROUGH
+        """
+        destinations = rng.choice(len(self.weights), size=len(origins), p=self.weights)
+        stay = rng.random(len(origins)) < SAME_BOROUGH
+        origin_boroughs = self.borough_of_zone[origins]
+        for code, zones in enumerate(self.borough_zones):
+            rows = np.flatnonzero(stay & (origin_boroughs == code))
+            if len(rows):
+                destinations[rows] = rng.choice(zones, size=len(rows), p=self.borough_weights[code])
+        return destinations
+
+    def pickup_times(self, rng, rows, year, month):
+        """
+        Pickup timestamps in microseconds, with the weekday or weekend hourly profile
+        """
+        month_start = pd.Timestamp(year, month, 1)
+        days = month_start.days_in_month
+        day = rng.integers(0, days, rows)
+        weekend = ((month_start.dayofweek + day) % 7) >= 5
+
+        hour = np.empty(rows, dtype=np.int64)
+        for is_weekend, profile in ((False, WEEKDAY_HOURS), (True, WEEKEND_HOURS)):
+            selected = np.flatnonzero(weekend == is_weekend)
+            hour[selected] = rng.choice(24, size=len(selected), p=profile / profile.sum())
+
+        seconds = day * 86400 + hour * 3600 + rng.integers(0, 3600, rows)
+        return month_start.value // 1000 + seconds * 1_000_000, hour
+
+    def batch(self, rows, year, month, chunk=0):
+        """
+        Generate one batch of trips picked up in the given month
+        :param rows: number of trips
+        :param year: pickup year
+        :param month: pickup month
+        :param chunk: index of the batch within the month, part of the seed
+        :return: pyarrow Table with TLC_SCHEMA
+        """
+        rng = np.random.default_rng([self.seed, year, month, chunk])
+
+        origins = rng.choice(len(self.weights), size=rows, p=self.weights)
+        destinations = self.destinations(rng, origins)
+        pickup_ids, dropoff_ids = self.zone_ids[origins], self.zone_ids[destinations]
+
+        # Road distance: 1.3x the straight line, or a short hop inside one zone
+        straight = np.hypot(self.x[origins] - self.x[destinations], self.y[origins] - self.y[destinations])
+        distance = np.where(origins == destinations, rng.lognormal(-0.2, 0.6, rows),
+                            straight * 1.3 * rng.lognormal(0, 0.2, rows))
+        distance = np.round(distance, 2)
+
+        pickup, hour = self.pickup_times(rng, rows, year, month)
+        rush = np.isin(hour, RUSH_HOURS)
+        overnight = (hour >= 20) | (hour < 6)
+        mph = np.where(rush, 8.0, np.where(overnight, 18.0, 12.0)) * rng.lognormal(0, 0.25, rows)
+        minutes = distance / mph * 60 + rng.uniform(1, 4, rows)
+        # The TLC files record whole seconds
+        dropoff = pickup + (minutes * 60).astype(np.int64) * 1_000_000
+
+        jfk = (pickup_ids == JFK) | (dropoff_ids == JFK)
+        newark = dropoff_ids == EWR
+        ratecode = np.where(jfk & (rng.random(rows) < 0.6), 2, np.where(newark, 3, 1)).astype(float)
+        ratecode[rng.random(rows) < 0.002] = 5
+
+        fare = np.where(ratecode == 2, JFK_FLAT_FARE, 3.0 + 3.5 * distance + 0.7 * minutes * (mph < 10))
+        fare = np.round(fare + np.where(newark, NEWARK_SURCHARGE, 0), 2)
+
+        payment_type = rng.choice(PAYMENT_TYPES[0], size=rows, p=PAYMENT_TYPES[1])
+        tip_rate = rng.choice([0.0, 0.15, 0.2, 0.25, 0.3], size=rows, p=[0.2, 0.15, 0.4, 0.15, 0.1])
+        tip = np.where(payment_type == 1, np.round(fare * tip_rate, 2), 0.0)
+
+        extra = np.where(overnight, 1.0, np.where(rush & ~overnight, 2.5, 0.0))
+        mta_tax = np.full(rows, 0.5)
+        improvement = np.full(rows, 1.0)
+        congestion = np.where(self.manhattan[origins] | self.manhattan[destinations], 2.5, 0.0)
+        airport_fee = np.where(np.isin(pickup_ids, [JFK, LGA]), 1.75, 0.0)
+        crosses = self.borough_of_zone[origins] != self.borough_of_zone[destinations]
+        tolls = np.where(crosses & (rng.random(rows) < 0.35), TOLL, 0.0)
+        total = np.round(fare + extra + mta_tax + tip + tolls + improvement + congestion + airport_fee, 2)
+
+        passengers = rng.choice(PASSENGER_COUNTS[0], size=rows, p=PASSENGER_COUNTS[1]).astype(float)
+        store_and_fwd = np.where(rng.random(rows) < 0.005, 'Y', 'N').astype(object)
+
+        columns = {
+            'VendorID': rng.choice(VENDORS[0], size=rows, p=VENDORS[1]).astype(np.int32),
+            'tpep_pickup_datetime': pickup,
+            'tpep_dropoff_datetime': dropoff,
+            'passenger_count': passengers,
+            'trip_distance': distance,
+            'RatecodeID': ratecode,
+            'store_and_fwd_flag': store_and_fwd,
+            'PULocationID': pickup_ids.astype(np.int32),
+            'DOLocationID': dropoff_ids.astype(np.int32),
+            'payment_type': payment_type.astype(np.int64),
+            'fare_amount': fare,
+            'extra': extra,
+            'mta_tax': mta_tax,
+            'tip_amount': tip,
+            'tolls_amount': tolls,
+            'improvement_surcharge': improvement,
+            'total_amount': total,
+            'congestion_surcharge': congestion,
+            'Airport_fee': airport_fee
+        }
+        nulls = self.add_defects(rng, rows, columns)
+
+        return pa.Table.from_arrays(
+            [pa.array(columns[field.name], type=field.type, mask=nulls.get(field.name)) for field in TLC_SCHEMA],
+            schema=TLC_SCHEMA)
+
+    def add_defects(self, rng, rows, columns):
+        """
+        Give dirty_fraction of the rows one defect each, as found in the real files
+        :return: dict of column name -> null mask
+        """
+        defect = np.where(rng.random(rows) < self.dirty_fraction, rng.integers(1, 5, rows), 0)
+
+        # 1: unreported trip, the passenger, ratecode and surcharge fields are NULL and payment_type is 0
+        missing = defect == 1
+        columns['payment_type'][missing] = 0
+        nulls = {name: missing for name in ('passenger_count', 'RatecodeID', 'store_and_fwd_flag',
+                                            'congestion_surcharge', 'Airport_fee')}
+        # 2: drop-off recorded before pick-up
+        swapped = defect == 2
+        columns['tpep_dropoff_datetime'][swapped] = (columns['tpep_pickup_datetime'][swapped]
+                                                     - rng.integers(60, 3600, swapped.sum()) * 1_000_000)
+        # 3: zero passengers
+        columns['passenger_count'][defect == 3] = 0
+        # 4: refund, every amount is negated
+        refund = defect == 4
+        for name in ('fare_amount', 'extra', 'mta_tax', 'tip_amount', 'tolls_amount', 'improvement_surcharge',
+                     'total_amount', 'congestion_surcharge', 'Airport_fee'):
+            columns[name][refund] = -columns[name][refund]
+        return nulls
+
+
+def month_rows(total_rows, year, months):
+    """
+    Split the trips over the months in proportion to their days
+    :return: dict of month -> rows
+    """
+    days = np.array([pd.Timestamp(year, month, 1).days_in_month for month in months])
+    rows = np.floor(total_rows * days / days.sum()).astype(int)
+    rows[-1] += total_rows - rows.sum()
+    return dict(zip(months, rows.tolist()))
+
+
+def generate(output_dir, scale=1.0, year=2023, months=range(1, 13), seed=42, dirty_fraction=0.01,
+             chunk_size=1_000_000):
+    """
+    Write the zone lookup and one Parquet file per month
+    :param output_dir: folder for taxi_zone_lookup.csv and the yellow_tripdata files
+    :param scale: scale factor; 1.0 is ROWS_PER_SCALE trips in total
+    :param year: year of the pickups
+    :param months: months to write
+    :param seed: seed of the whole dataset
+    :param dirty_fraction: share of rows with a defect
+    :param chunk_size: rows per generated batch and Parquet row group
+    :return: list of written Parquet paths
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    lookup = zone_lookup(seed)
+    lookup[['LocationID', 'Borough', 'Zone', 'service_zone']].to_csv(
+        os.path.join(output_dir, 'taxi_zone_lookup.csv'), index=False)
+
+    generator = TripGenerator(lookup, seed, dirty_fraction)
+    paths = []
+    for month, rows in month_rows(int(scale * ROWS_PER_SCALE), year, list(months)).items():
+        path = os.path.join(output_dir, f'yellow_tripdata_{year}-{month:02d}.parquet')
+        with stage(os.path.basename(path)) as month_stage, pq.ParquetWriter(path, TLC_SCHEMA) as writer:
+            for chunk, start in enumerate(range(0, rows, chunk_size)):
+                writer.write_table(generator.batch(min(chunk_size, rows - start), year, month, chunk))
+            month_stage.rows = rows
+        paths.append(path)
+        print(f"Wrote {rows} trips to {path}")
+    return paths
+
+
+def main(output_dir='raw_data', scale=1.0, year=2023, seed=42):
+    start_run('synthetic_tlc')
+    try:
+        generate(output_dir, scale=scale, year=year, seed=seed)
+    finally:
+        write_report()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,13 @@
+-- Rebuilds the schema from scratch, so the file can be re-run after a fresh load.
+-- The CSV folder is the psql variable processed_data, e.g.
+--   psql -v processed_data=/path/to/processed_data -f DataReader/table_creation.sql
+\if :{?processed_data}
+\else
+  \set processed_data 'C:\\Sem4\\CSCI620\\Project\\processed_data'
+\endif
+
+DROP TABLE IF EXISTS Time, Trip, Location, RateCode, Payment, Vendor CASCADE;
+
 -- Location table creation
 CREATE TABLE Location (
   ID INT PRIMARY KEY,
@@ -58,23 +68,26 @@ CREATE TABLE Trip (
 
 -- Loading data....
 
+-- \copy paths are relative to the CSV folder
+\cd :processed_data
+
 -- Load data into Location table
-\copy location FROM C:\Sem4\CSCI620\Project\processed_data\borough_info.csv CSV DELIMITER ',' HEADER;
+\copy location FROM borough_info.csv CSV DELIMITER ',' HEADER;
 
 -- Load data into RateCode table
-\copy ratecode FROM C:\Sem4\CSCI620\Project\processed_data\ratecode_info.csv CSV DELIMITER ',' HEADER;
+\copy ratecode FROM ratecode_info.csv CSV DELIMITER ',' HEADER;
 
 -- Load data into Payment table
-\copy payment FROM C:\Sem4\CSCI620\Project\processed_data\payment_info.csv CSV DELIMITER ',' HEADER;
+\copy payment FROM payment_info.csv CSV DELIMITER ',' HEADER;
 
 -- Load data into Vendor table
-\copy vendor FROM C:\Sem4\CSCI620\Project\processed_data\vendor_info.csv CSV DELIMITER ',' HEADER;
+\copy vendor FROM vendor_info.csv CSV DELIMITER ',' HEADER;
 
 -- Load data into Time table
-\copy time FROM C:\Sem4\CSCI620\Project\processed_data\time_info.csv CSV DELIMITER ',' HEADER;
+\copy time FROM time_info.csv CSV DELIMITER ',' HEADER;
 
 -- Load data into Trip table
-\copy trip FROM C:\Sem4\CSCI620\Project\processed_data\trip_info.csv CSV DELIMITER ',' HEADER;
+\copy trip FROM trip_info.csv CSV DELIMITER ',' HEADER;
 
 -- Add in foreign keys
 
@@ -0,0 +1,131 @@
+-- Time-partitioned variant of table_creation.sql.
+-- Trip and Time are range-partitioned by pickup month, so date-bounded queries only touch the
+-- relevant partitions. Trip carries PickUpDate as its partition key; filter on
+-- trip.pickupdate as well as time.pickupdate to prune both sides of a join.
+-- Monthly partitions are loaded and attached by DataReader/partition_loader.py.
+-- Like table_creation.sql, it rebuilds the schema from scratch and reads the CSVs from the
+-- psql variable processed_data, e.g.
+--   psql -v processed_data=/path/to/processed_data -f DataReader/table_creation_partitioned.sql
+\if :{?processed_data}
+\else
+  \set processed_data 'C:\\Sem4\\CSCI620\\Project\\processed_data'
+\endif
+
+DROP TABLE IF EXISTS Time, Trip, Location, RateCode, Payment, Vendor CASCADE;
+
+-- Location table creation
+CREATE TABLE Location (
+  ID INT PRIMARY KEY,
+  Borough VARCHAR,
+  Zone VARCHAR
+);
+
+-- RateCode table creation
+CREATE TABLE RateCode (
+  ID INT PRIMARY KEY,
+  Description VARCHAR
+);
+
+-- Payment table creation
+CREATE TABLE Payment (
+  ID INT PRIMARY KEY,
+  Description VARCHAR
+);
+
+-- Vendor table creation
+CREATE TABLE Vendor (
+  ID INT PRIMARY KEY,
+  Name VARCHAR
+);
+
+-- Trip table creation, partitioned by pickup month
+CREATE TABLE Trip (
+  ID INT,
+  PassengerCount INT,
+  TripDistance NUMERIC,
+  StoreAndFwdFlag VARCHAR,
+  FareAmount NUMERIC,
+  Extra NUMERIC,
+  MTATax NUMERIC,
+  ImprovementSurcharge INT,
+  TipAmount NUMERIC,
+  TollsAmount NUMERIC,
+  TotalAmount NUMERIC,
+  CongestionSurcharge NUMERIC,
+  AirportFee NUMERIC,
+  Vendor INT,
+  PaymentType INT,
+  Ratecode INT,
+  PickUpLocation INT,
+  DropOffLocation INT,
+  PickUpDate DATE NOT NULL,
+  -- The partition key has to be part of the primary key
+  PRIMARY KEY (ID, PickUpDate)
+) PARTITION BY RANGE (PickUpDate);
+
+-- Time table creation, partitioned by pickup month
+CREATE TABLE Time (
+  TripID INT,
+  PickUpDate DATE NOT NULL,
+  PickUpTime TIME,
+  DropOffDate DATE,
+  DropOffTime TIME,
+  DayOfWeek INT,
+  IsWeekend BOOLEAN
+) PARTITION BY RANGE (PickUpDate);
+
+-- Partitioned indexes; every attached partition gets (or reuses) its own copy.
+-- BRIN suits pickup dates because rows are loaded in pickup order within a month.
+CREATE INDEX trip_pickupdate_brin ON Trip USING BRIN (PickUpDate);
+CREATE INDEX time_pickupdate_brin ON Time USING BRIN (PickUpDate);
+CREATE INDEX time_tripid_pickupdate_idx ON Time (TripID, PickUpDate);
+
+-- Loading data....
+
+-- \copy paths are relative to the CSV folder
+\cd :processed_data
+
+-- Load data into Location table
+\copy location FROM borough_info.csv CSV DELIMITER ',' HEADER;
+
+-- Load data into RateCode table
+\copy ratecode FROM ratecode_info.csv CSV DELIMITER ',' HEADER;
+
+-- Load data into Payment table
+\copy payment FROM payment_info.csv CSV DELIMITER ',' HEADER;
+
+-- Load data into Vendor table
+\copy vendor FROM vendor_info.csv CSV DELIMITER ',' HEADER;
+
+-- Time and Trip are loaded month by month with: python3 DataReader/partition_loader.py
+
+-- Add in foreign keys
+
+-- Time rows reference their trip through the full partitioned key
+ALTER TABLE time
+ADD CONSTRAINT fk_tripID
+FOREIGN KEY (TripID, PickUpDate) REFERENCES trip(ID, PickUpDate);
+
+-- Add foreign keys to Trip table
+ALTER TABLE trip
+ADD CONSTRAINT fk_pickup_location
+FOREIGN KEY (PickUpLocation) REFERENCES location(ID);
+
+ALTER TABLE trip
+ADD CONSTRAINT fk_dropoff_location
+FOREIGN KEY (DropOffLocation) REFERENCES location(ID);
+
+-- alter ratecode due to unkown code
+INSERT INTO ratecode (id, description) VALUES (99, 'unknown');
+
+ALTER TABLE trip
+ADD CONSTRAINT fk_ratecode
+FOREIGN KEY (Ratecode) REFERENCES ratecode(ID);
+
+ALTER TABLE trip
+ADD CONSTRAINT fk_paymenttype
+FOREIGN KEY (PaymentType) REFERENCES payment(id);
+
+ALTER TABLE trip
+ADD CONSTRAINT fk_vendor
+FOREIGN KEY (Vendor) REFERENCES vendor(id);
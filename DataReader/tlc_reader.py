@@ -0,0 +1,112 @@
+"""
+Reads the monthly TLC Parquet files into a declared target schema, decoding only what the load keeps.
+
+`pd.read_parquet` decodes every column of a file and leaves schema drift to the caller:
+the fee column is `Airport_fee` in some years and `airport_fee` in others, and column
+types change between releases (e.g. passenger_count as double or int64). Here each file
+is scanned with pyarrow.dataset:
+    - only the columns of the target schema are read; a file column matches a target
+      column case-insensitively and is cast to the target type at scan time, and a
+      column the file lacks comes back as NULLs;
+    - rows with a NULL in a required column are filtered in the scan, as are pickups
+      outside the file's month when a month is given, so row groups whose statistics
+      exclude the filter are never decoded.
+The number of rows each filter removed is returned, so the loader can charge the NULL
+rows to the `missing_required` cleaning rule. Their contents are not quarantined, because
+they are never decoded.
+"""
+
+import re
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+# Every column the Trip and Time tables are built from, in the loader's naming
+TARGET_SCHEMA = pa.schema([
+    ('VendorID', pa.int32()),
+    ('tpep_pickup_datetime', pa.timestamp('us')),
+    ('tpep_dropoff_datetime', pa.timestamp('us')),
+    ('passenger_count', pa.float64()),
+    ('trip_distance', pa.float64()),
+    ('RatecodeID', pa.float64()),
+    ('store_and_fwd_flag', pa.string()),
+    ('PULocationID', pa.int32()),
+    ('DOLocationID', pa.int32()),
+    ('payment_type', pa.int64()),
+    ('fare_amount', pa.float64()),
+    ('extra', pa.float64()),
+    ('mta_tax', pa.float64()),
+    ('tip_amount', pa.float64()),
+    ('tolls_amount', pa.float64()),
+    ('improvement_surcharge', pa.float64()),
+    ('total_amount', pa.float64()),
+    ('congestion_surcharge', pa.float64()),
+    ('Airport_fee', pa.float64())
+])
+
+
+def file_month(path):
+    """
+    :return: first day of the month in a yellow_tripdata_YYYY-MM.parquet file name
+    """
+    year, month = re.search(r'(\d{4})-(\d{2})\.parquet$', path).groups()
+    return pd.Timestamp(int(year), int(month), 1)
+
+
+def projection(file_schema, schema):
+    """
+    Map each target column onto the file's column of the same name, ignoring case
+    :param file_schema: pyarrow schema of the file
+    :param schema: target schema
+    :return: (dict of target name -> scan expression, dict of target name -> file column name)
+    """
+    file_columns = {name.lower(): name for name in file_schema.names}
+    columns, sources = {}, {}
+    for target in schema:
+        source = file_columns.get(target.name.lower())
+        if source is None:
+            columns[target.name] = ds.scalar(pa.scalar(None, type=target.type))
+        else:
+            columns[target.name] = ds.field(source).cast(target.type)
+            sources[target.name] = source
+    return columns, sources
+
+
+def read_trips(path, schema=TARGET_SCHEMA, required=(), month=None):
+    """
+    Scan one TLC Parquet file into the target schema
+    :param path: Parquet file
+    :param schema: target schema; columns outside it are never decoded
+    :param required: target columns whose NULL rows are filtered in the scan
+    :param month: pd.Timestamp of a month start; if set, pickups outside that month are filtered too
+    :return: (DataFrame with the schema's columns, dict with rows_in_file, null_rows and outside_month)
+    """
+    dataset = ds.dataset(path, format='parquet')
+    columns, sources = projection(dataset.schema, schema)
+
+    not_null = None
+    for name in required:
+        if name in sources:
+            valid = ds.field(sources[name]).is_valid()
+            not_null = valid if not_null is None else not_null & valid
+
+    row_filter = not_null
+    if month is not None:
+        pickup = ds.field(sources['tpep_pickup_datetime'])
+        bounds = [pa.scalar(ts.to_pydatetime(), type=pa.timestamp('us'))
+                  for ts in (month, month + pd.DateOffset(months=1))]
+        in_month = (pickup >= bounds[0]) & (pickup < bounds[1])
+        row_filter = in_month if row_filter is None else row_filter & in_month
+
+    table = dataset.scanner(columns=columns, filter=row_filter).to_table()
+
+    # The file's row count comes from the footer. With both filters, telling them apart takes
+    # a second count that decodes only the required columns
+    rows_in_file = dataset.count_rows()
+    null_rows = rows_in_file - table.num_rows
+    if month is not None:
+        null_rows = rows_in_file - dataset.count_rows(filter=not_null) if not_null is not None else 0
+    stats = {'rows_in_file': rows_in_file, 'null_rows': null_rows,
+             'outside_month': rows_in_file - null_rows - table.num_rows}
+    return table.to_pandas(), stats
@@ -0,0 +1,54 @@
+-- Denormalized, join-free fact table for the OLAP queries.
+-- Run after table_creation.sql (or table_creation_partitioned.sql); the normalized tables stay the
+-- source of truth and this table can be dropped and rebuilt from them at any time.
+--
+-- Every trip carries its pickup/dropoff date, day of week and zone/borough codes inline, in
+-- compact types: smallint codes, dates, and times as int4 seconds since midnight. Rows are
+-- written in pickup date order and indexed with BRIN, so date ranges read only their blocks.
+-- The queries in phase-2/fact_queries.sql aggregate this table alone and decode zone and
+-- borough names on the aggregated rows.
+-- Assumes one Time row per trip, which holds for data loaded by the current load_from_kaggle.py.
+
+-- Borough dimension for the inline borough codes
+DROP TABLE IF EXISTS borough;
+CREATE TABLE borough AS
+SELECT (ROW_NUMBER() OVER (ORDER BY name))::smallint AS id, name
+FROM (SELECT DISTINCT borough AS name FROM location) b;
+ALTER TABLE borough ADD PRIMARY KEY (id);
+
+DROP TABLE IF EXISTS trip_fact;
+CREATE TABLE trip_fact AS
+SELECT tr.id AS tripid,
+       t.pickupdate,
+       EXTRACT(EPOCH FROM t.pickuptime)::int4 AS pickupseconds,
+       t.dropoffdate,
+       EXTRACT(EPOCH FROM t.dropofftime)::int4 AS dropoffseconds,
+       t.dayofweek::smallint AS dayofweek,
+       t.isweekend,
+       tr.pickuplocation::smallint AS pickupzone,
+       pb.id AS pickupborough,
+       tr.dropofflocation::smallint AS dropoffzone,
+       db.id AS dropoffborough,
+       tr.vendor::smallint AS vendor,
+       tr.paymenttype::smallint AS paymenttype,
+       tr.ratecode::smallint AS ratecode,
+       tr.passengercount::smallint AS passengercount,
+       tr.tripdistance::numeric(10, 2) AS tripdistance,
+       tr.fareamount::numeric(10, 2) AS fareamount,
+       tr.tipamount::numeric(10, 2) AS tipamount,
+       tr.tollsamount::numeric(10, 2) AS tollsamount,
+       tr.totalamount::numeric(10, 2) AS totalamount,
+       tr.congestionsurcharge::numeric(10, 2) AS congestionsurcharge,
+       tr.airportfee::numeric(10, 2) AS airportfee
+FROM trip tr
+LEFT JOIN time t ON t.tripid = tr.id
+LEFT JOIN location pl ON pl.id = tr.pickuplocation
+LEFT JOIN borough pb ON pb.name IS NOT DISTINCT FROM pl.borough
+LEFT JOIN location dl ON dl.id = tr.dropofflocation
+LEFT JOIN borough db ON db.name IS NOT DISTINCT FROM dl.borough
+ORDER BY t.pickupdate, t.pickuptime;
+
+-- Rows are already in pickup order, so BRIN ranges on the date are tight
+CREATE INDEX trip_fact_pickupdate_brin ON trip_fact USING BRIN (pickupdate);
+ALTER TABLE trip_fact ADD PRIMARY KEY (tripid);
+ANALYZE trip_fact;
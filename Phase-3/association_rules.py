@@ -1,26 +1,39 @@
 import itertools
+import json
+import os
+import sys
 
-import psycopg2 as pg
+from itemset_mining import PROFILE, SampledAprioriLattice
 
-conn_params = {
-    'dbname': 'project_v3',
-    'user': 'postgres',
-    'password': '1234',
-    'host': 'localhost',
-    'port': '5432'
-}
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import db  # noqa: E402
+from common.instrumentation import stage, start_run, write_report  # noqa: E402
 
 
 class AssociationRules:
     """
     Association rules implementation using the Apriori algorithm.
     """
-    def __init__(self, transactions, min_support, min_confidence, db_connection):
+    def __init__(self, transactions, min_support, min_confidence, db_connection, items_table='items',
+                 table_prefix='', tid_count=None):
+        """
+        :param transactions: denominator of the supports
+        :param min_support: minimum support of a rule's itemset
+        :param min_confidence: minimum confidence of a rule
+        :param db_connection: connection to the mining database
+        :param items_table: table holding the (tid, item) transactions
+        :param table_prefix: prefix of the L{k} tables
+        :param tid_count: number of distinct transactions, for the lift of each rule
+        """
         self.conn = db_connection
+        self.tid_count = tid_count
+        self.items_table = items_table
+        self.table_prefix = table_prefix
         self.transactions = transactions
         self.min_support = min_support
         self.min_confidence = min_confidence
         self.rules = []
+        self.rule_metrics = []
         self.item_support_dict = {}
         self.item_count_dict = self.get_item_count()
         self.l2 = self.get_itemsets(2)
@@ -30,7 +43,7 @@ class AssociationRules:
     def get_item_count(self):
         cursor = self.conn.cursor()
 
-        cursor.execute('select item, count(*) from items group by item')
+        cursor.execute(f'select item, count(*) from {self.items_table} group by item')
         rows = cursor.fetchall()
 
         item_count_dict = {}
@@ -42,7 +55,7 @@ class AssociationRules:
     def get_all_transactions(self):
         cursor = self.conn.cursor()
 
-        cursor.execute('select * from items')
+        cursor.execute(f'select * from {self.items_table}')
         rows = cursor.fetchall()
 
         return rows
@@ -95,6 +108,19 @@ class AssociationRules:
 
         return confidence, support_xy
 
+    def calculate_lift(self, confidence, consequent_str):
+        """
+        Lift of a rule: its confidence over the fraction of transactions holding the consequent
+        :param confidence: confidence of the rule
+        :param consequent_str: comma-separated consequent items
+        :return: lift, or None without tid_count
+        """
+        if not self.tid_count:
+            return None
+        # Supports are counts over `transactions`, which need not be the number of transactions
+        consequent_fraction = self.calculate_support(consequent_str) * self.transactions / self.tid_count
+        return confidence / consequent_fraction if consequent_fraction > 0 else None
+
     def get_itemsets(self, level):
         """
         Get the itemsets for a given level
@@ -103,7 +129,7 @@ class AssociationRules:
         """
         cursor = self.conn.cursor()
 
-        cursor.execute(f'select * from L{level}')
+        cursor.execute(f'select * from {self.table_prefix}L{level}')
         rows = cursor.fetchall()
 
         rows = {",".join(row[:-1]): row[-1] for row in rows}
@@ -120,7 +146,7 @@ class AssociationRules:
 
         cursor = self.conn.cursor()
 
-        cursor.execute(f'select * from L{level}')
+        cursor.execute(f'select * from {self.table_prefix}L{level}')
         rows = cursor.fetchall()
 
         # Get itemsets for the specified level
@@ -147,43 +173,78 @@ class AssociationRules:
                     # Check if rule meets minimum confidence and minimum support threshold
                     if confidence >= self.min_confidence and support >= self.min_support:
                         rules.append(rule)
+                        self.rule_metrics.append({
+                            "antecedent": sorted(antecedent),
+                            "consequent": sorted(consequent),
+                            "support": support,
+                            "confidence": confidence,
+                            "lift": self.calculate_lift(confidence, consequent_str)
+                        })
 
         self.rules.extend(rules)
 
     def print_rules(self, level):
         """
-        Print the association rules to a file
+        Print the association rules to a file, and the rules with their metrics to rules_{level}.json
+        for the rule store (rule_store.py)
         :param level: level of itemsets to generate rules from
         :return: None
         """
-        self.get_rules(level)
-
-        with open(f'rules_{level}.txt', 'w') as f:
-            for rule in self.rules:
-                f.write(f"{rule}\n")
+        with stage(f"rules_{level}", level=level) as rules_stage:
+            self.get_rules(level)
 
-def main():
-    with pg.connect(**conn_params) as conn:
-        cursor = conn.cursor()
-        cursor.execute(f'select count(*) from items')
-        transactions = cursor.fetchone()[0]
+            with open(f'rules_{level}.txt', 'w') as f:
+                for rule in self.rules:
+                    f.write(f"{rule}\n")
+            with open(f'rules_{level}.json', 'w') as f:
+                json.dump(self.rule_metrics, f, indent=1)
+            rules_stage.rows = len(self.rules)
 
+def main(min_sup=None, min_conf=None, sample_fraction=None, min_support=1000):
+    """
+    Write the rules of levels 2-4 to rules_{level}.txt
+    :param min_sup: minimum support per level, defaults to the tuned thresholds
+    :param min_conf: minimum confidence per level, defaults to the tuned thresholds
+    :param sample_fraction: if set, mine a transaction sample instead of the full lattice
+                            to explore thresholds quickly; supports are then estimates
+    :param min_support: absolute support threshold for the sampled lattice
+    """
+    if min_conf is None:
         min_conf = {
             2: 0.8,
             3: 0.8,
             4: 0.9
         }
 
+    if min_sup is None:
         min_sup = {
             2: 0.08,
             3: 0.08,
             4: 0.085
         }
 
+    start_run('association_rules')
+    with db.connect(PROFILE) as conn:
+        items_table, table_prefix = 'items', ''
+
+        if sample_fraction:
+            lattice = SampledAprioriLattice(conn, min_support=min_support, sample_fraction=sample_fraction,
+                                            verify=False)
+            lattice.generate_all_levels()
+            items_table, table_prefix = lattice.items_table, lattice.table_prefix
+            print(f"Rule supports are sample estimates within +/-{lattice.error_bound:.4f} "
+                  f"(probability {1 - lattice.delta:.2f})")
+
+        cursor = conn.cursor()
+        cursor.execute(f'select count(*), count(distinct tid) from {items_table}')
+        transactions, tid_count = cursor.fetchone()
+
         for i in range(2, 5):
-            ar = AssociationRules(transactions, min_sup[i], min_conf[i], conn)
+            ar = AssociationRules(transactions, min_sup[i], min_conf[i], conn, items_table, table_prefix, tid_count)
             ar.print_rules(i)
 
+    write_report()
+
 if __name__ == '__main__':
     main()
 
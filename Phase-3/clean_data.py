@@ -6,73 +6,146 @@ It includes utility classes for managing database connections and automating FD
 
 Main Features:
 
-1. Class `DatabaseConnection`:
-   - Provides a wrapper for PostgreSQL connection management.
+1. Class `CleaningConnection`:
+   - Extends the shared `DatabaseConnection` of common/db.py, which handles connecting
+     and the bulk session settings (asynchronous commit, larger work_mem).
    - Includes methods to:
-       - `connect`: Establish a database connection.
-       - `disconnect`: Close the database connection and cursor.
-       - `drop_constraints`: Temporarily drop foreign key constraints for cleaning.
-       - `reapply_constraints`: Reinstate foreign key constraints with `ON DELETE CASCADE` as needed.
-       - `clean_data`: Executes cleaning queries, logging affected rows.
+       - `drop_constraints`: Temporarily drop foreign key constraints for cleaning, keeping
+         their definitions as read from the catalog.
+       - `reapply_constraints`: Reinstate those foreign key constraints with `ON DELETE CASCADE` as needed,
+         optionally `NOT VALID` so existing rows are not checked while the constraint is added.
+       - `validate_constraints`: Validate the constraints without blocking reads or writes.
+
+2. Class `CleaningEngine`:
+   - Evaluates every rule in `CLEANING_RULES` for a table in one scan and stores the
+     (tableoid, ctid) of the rows to drop, with the first matching rule, in a temp table.
+     Rows of a partitioned table are then deleted from their leaf partitions.
+   - Duplicate Borough/Zone locations keep their lowest ID; trips are remapped onto it
+     instead of every copy being deleted.
+   - Trips of removed locations and time rows of removed trips are dropped too, as the
+     `ON DELETE CASCADE` foreign keys would.
+   - `mode="batch"` deletes in committed batches of `batch_size` rows, so no transaction
+     or lock lasts for the whole table. `mode="rebuild"` copies the surviving rows into a
+     `LIKE ... INCLUDING ALL` copy and swaps it in, which suits removing a large share of a table.
+     Partitioned tables, partitions, inheritance children and tables read by views are cleaned
+     in batches instead.
 
 3. Main Method:
-   - Connects to the database using the `DatabaseConnection` class.
+   - Connects to the database using the `CleaningConnection` class.
    - Drops foreign key constraints temporarily for data cleaning.
-   - Executes a series of cleaning queries to remove invalid or redundant rows.
-   - Outputs the total number of rows deleted across all queries.
-   - Ensures reconnection or rollback in case of errors.
+   - Runs the `CleaningEngine` to remove invalid or redundant rows.
+   - Outputs the total number of rows deleted across all tables.
+   - Re-adds the foreign keys `NOT VALID`, then validates them.
 
 Requirements:
 psycopg2: Used for PostgreSQL database interaction.
 
 HOW TO RUN:
-1. Update database credentials in the `main` method (e.g., `database`, `user`, `password`).
-2. Modify or add hardcoded table names and queries in the `cleaning_queries` list as needed.
+1. Set the database credentials in db.ini or the environment (see common/db.py).
+2. Modify or add rules in the `CLEANING_RULES` dict as needed; pick the mode in `main`.
 3. Execute this script from the command line
    """
 
+import os
+import sys
+
 import psycopg2
-class DatabaseConnection:
-    def __init__(self, database, user, password, host, port):
-        self.database = database
-        self.user = user
-        self.password = password
-        self.host = host
-        self.port = port
-        self.connection = None
-        self.cursor = None
-
-    def connect(self):
-        try:
-            self.connection = psycopg2.connect(
-                database=self.database,
-                user=self.user,
-                password=self.password,
-                host=self.host,
-                port=self.port
-            )
-            self.cursor = self.connection.cursor()
-            print("Connected to the database")
-        except psycopg2.Error as e:
-            print(f"Error connecting to the database: {e}")
 
-    def disconnect(self):
-        if self.cursor:
-            self.cursor.close()
-        if self.connection:
-            self.connection.close()
-        print("Disconnected from the database")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.db import BULK, DatabaseConnection  # noqa: E402
+
+# Foreign keys dropped while cleaning. Their definitions are read from the catalog before the drop,
+# so the composite (TripID, PickUpDate) key of the partitioned schema comes back as it was
+FOREIGN_KEYS = [
+    ("public.Time", "fk_tripid"),
+    ("public.Trip", "fk_pickup_location"),
+    ("public.Trip", "fk_dropoff_location")
+]
+
+# Rules per table, evaluated together in one scan. Tables are cleaned parents first, so the
+# "removed_*" rules can carry the ON DELETE CASCADE of FOREIGN_KEYS down to the children.
+CLEANING_RULES = {
+    "location": {
+        "key": "ID",
+        "rules": [
+            {
+                "name": "null_borough_or_zone",
+                "predicate": "Borough IS NULL OR Zone IS NULL",
+                "description": "Remove rows with NULL Borough or Zone from Location table"
+            },
+            {
+                # location_remap holds every copy of a Borough/Zone pair except the lowest ID
+                "name": "duplicate_borough_zone",
+                "predicate": "ID IN (SELECT id FROM location_remap)",
+                "description": "Remove duplicate Borough and Zone combinations from Location table"
+            }
+        ]
+    },
+    "trip": {
+        "key": "ID",
+        "rules": [
+            {
+                "name": "invalid_amounts",
+                "predicate": "PassengerCount < 1 OR TripDistance < 0 OR FareAmount < 0",
+                "description": "Remove rows with invalid PassengerCount, TripDistance, or FareAmount from Trip table"
+            },
+            {
+                "name": "removed_location",
+                "predicate": "PickUpLocation IN (SELECT key FROM drop_location) "
+                             "OR DropOffLocation IN (SELECT key FROM drop_location)",
+                "description": "Remove trips whose pickup or dropoff location was removed"
+            }
+        ]
+    },
+    "time": {
+        "key": "TripID",
+        "rules": [
+            {
+                "name": "invalid_dropoff",
+                "predicate": "DropOffDate < PickUpDate "
+                             "OR (DropOffDate = PickUpDate AND DropOffTime < PickUpTime)",
+                "description": "Remove rows with invalid DropOffDate/DropOffTime from Time table"
+            },
+            {
+                "name": "removed_trip",
+                "predicate": "TripID IN (SELECT key FROM drop_trip)",
+                "description": "Remove time rows of removed trips"
+            }
+        ]
+    }
+}
+
+
+class CleaningConnection(DatabaseConnection):
+    def __init__(self, profile="default"):
+        super().__init__(profile, tuning=BULK)
+        # (table, name, definition, partitioned) of the constraints drop_constraints removed
+        self.foreign_keys = []
 
     def drop_constraints(self):
         try:
             print("Dropping foreign key constraints...")
 
+            self.foreign_keys = []
+            for table, name in FOREIGN_KEYS:
+                self.cursor.execute("""
+                    SELECT pg_get_constraintdef(c.oid), r.relkind = 'p'
+                    FROM pg_constraint c JOIN pg_class r ON r.oid = c.conrelid
+                    WHERE c.conrelid = to_regclass(%s) AND c.conname = %s AND c.contype = 'f';
+                """, (table, name))
+                row = self.cursor.fetchone()
+                if row is None:
+                    print(f"Constraint {name} not found on {table}; it is not re-added")
+                    continue
+                definition, partitioned = row
+                # Cleaning relies on ON DELETE CASCADE; a key without an ON DELETE action gets it
+                if "ON DELETE" not in definition:
+                    definition += " ON DELETE CASCADE"
+                self.foreign_keys.append((table, name, definition, partitioned))
+
             # Drop the constraints temporarily
-            self.cursor.execute("""
-                ALTER TABLE public.Time DROP CONSTRAINT IF EXISTS fk_tripid;
-                ALTER TABLE public.Trip DROP CONSTRAINT IF EXISTS fk_pickup_location;
-                ALTER TABLE public.Trip DROP CONSTRAINT IF EXISTS fk_dropoff_location;
-            """)
+            for table, name, _, _ in self.foreign_keys:
+                self.cursor.execute(f"ALTER TABLE {table} DROP CONSTRAINT {name};")
 
             # Commit changes to ensure constraints are dropped
             self.connection.commit()
@@ -81,120 +154,296 @@ class DatabaseConnection:
             print(f"Error dropping constraints: {e}")
             self.connection.rollback()
 
-    def reapply_constraints(self):
+    def reapply_constraints(self, not_valid=False):
         try:
             print("Reapplying foreign key constraints...")
             # Reapply the constraints with ON DELETE CASCADE
-            self.cursor.execute("""
-                ALTER TABLE public.Time
-                ADD CONSTRAINT fk_tripid
-                FOREIGN KEY (TripID)
-                REFERENCES public.Trip (ID)
-                ON DELETE CASCADE;
-
-                ALTER TABLE public.Trip
-                ADD CONSTRAINT fk_pickup_location
-                FOREIGN KEY (PickUpLocation)
-                REFERENCES public.Location (ID)
-                ON DELETE CASCADE;
-
-                ALTER TABLE public.Trip
-                ADD CONSTRAINT fk_dropoff_location
-                FOREIGN KEY (DropOffLocation)
-                REFERENCES public.Location (ID)
-                ON DELETE CASCADE;
-            """)
+            # NOT VALID skips checking the existing rows; validate_constraints does that later.
+            # Partitioned tables do not take NOT VALID foreign keys, so theirs are checked right away
+            for table, name, definition, partitioned in self.foreign_keys:
+                self.cursor.execute(f"""
+                    ALTER TABLE {table}
+                    ADD CONSTRAINT {name}
+                    {definition}{' NOT VALID' if not_valid and not partitioned else ''};
+                """)
             self.connection.commit()
             print("Constraints reapplied successfully.")
         except psycopg2.Error as e:
             print(f"Error reapplying constraints: {e}")
             self.connection.rollback()
 
-    def clean_data(self, query, description):
+    def validate_constraints(self):
         try:
-            print(f"Executing cleaning query: {description}")
-            self.cursor.execute(query)
+            # VALIDATE only takes a SHARE UPDATE EXCLUSIVE lock, so reads and writes keep going
+            for table, name, _, _ in self.foreign_keys:
+                print(f"Validating constraint {name}...")
+                self.cursor.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {name};")
+                self.connection.commit()
+            print("Constraints validated successfully.")
+        except psycopg2.Error as e:
+            print(f"Error validating constraints: {e}")
+            self.connection.rollback()
 
-            # Log the number of rows affected
-            rows_deleted = self.cursor.rowcount
-            print(f"Rows deleted for query '{description}': {rows_deleted}")
 
-            # Commit c
-            self.connection.commit()
-            return rows_deleted
+class CleaningEngine:
+    def __init__(self, db_conn, rules=CLEANING_RULES, mode="batch", batch_size=50000):
+        """
+        Set-based cleaning: every rule of a table is evaluated in one scan, the rows to drop are
+        materialized into a temp table, and only then are they removed
+        :param db_conn: connected CleaningConnection
+        :param rules: dict of table -> key column and rules, parents before children
+        :param mode: "batch" deletes the dropped rows in committed batches of batch_size,
+                     "rebuild" copies the surviving rows into a new table and swaps it in
+        :param batch_size: rows per DELETE in batch mode
+        """
+        if mode not in ("batch", "rebuild"):
+            raise ValueError(f"Unknown cleaning mode: {mode}")
+        self.db = db_conn
+        self.rules = rules
+        self.mode = mode
+        self.batch_size = batch_size
+        self.counts = {}
 
-        except psycopg2.Error as e:
-            print(f"Error during data cleaning for query '{description}': {e}")
-            self.connection.rollback()
-            raise e
-
-def main():
-    db_conn = DatabaseConnection(
-        database="project",
-        user="postgres",
-        password="RIT@2023",
-        host="localhost",
-        port="5432"
-    )
-    try:
-        db_conn.connect()
+    def execute(self, query, params=None):
+        self.db.cursor.execute(query, params)
+        return self.db.cursor
 
+    def check_table(self, table):
+        cursor = self.execute("SELECT to_regclass(%s) IS NOT NULL;", (table,))
+        if not cursor.fetchone()[0]:
+            raise ValueError(f"Table {table} does not exist")
 
-        db_conn.drop_constraints()
+    def remap_duplicate_locations(self):
+        """
+        Keep the lowest ID of every duplicated Borough/Zone pair and point trips at it
+        :return: number of trip rows updated
+        """
+        self.execute("DROP TABLE IF EXISTS location_remap;")
+        self.execute("""
+            CREATE TEMP TABLE location_remap AS
+            SELECT id, keep_id
+            FROM (
+                SELECT ID AS id, MIN(ID) OVER (PARTITION BY Borough, Zone) AS keep_id
+                FROM public.Location
+                WHERE Borough IS NOT NULL AND Zone IS NOT NULL
+            ) l
+            WHERE id <> keep_id;
+        """)
+        self.execute("ANALYZE location_remap;")
 
-        cleaning_queries = [
-            {
-                "query": """
-                        DELETE FROM public.Location
-                        WHERE Borough IS NULL OR Zone IS NULL;
-                    """,
-                "description": "Remove rows with NULL Borough or Zone from Location table"
-            },
-            {
-                "query": """
-                        DELETE FROM public.Location
-                        WHERE (Borough, Zone) IN (
-                            SELECT Borough, Zone
-                            FROM public.Location
-                            GROUP BY Borough, Zone
-                            HAVING COUNT(*) > 1
-                        );
-                    """,
-                "description": "Remove duplicate Borough and Zone combinations from Location table"
-            },
-            {
-                "query": """
-                        DELETE FROM public.Time
-                        WHERE DropOffDate < PickUpDate
-                        OR (DropOffDate = PickUpDate AND DropOffTime < PickUpTime);
-                    """,
-                "description": "Remove rows with invalid DropOffDate/DropOffTime from Time table"
-            },
-            {
-                "query": """
-                        DELETE FROM public.Trip
-                        WHERE PassengerCount < 1
-                        OR TripDistance < 0
-                        OR FareAmount < 0;
-                    """,
-                "description": "Remove rows with invalid PassengerCount, TripDistance, or FareAmount from Trip table"
-            }
-        ]
+        updated = 0
+        for column in ["PickUpLocation", "DropOffLocation"]:
+            cursor = self.execute(f"""
+                UPDATE public.Trip tr SET {column} = m.keep_id
+                FROM location_remap m
+                WHERE tr.{column} = m.id;
+            """)
+            updated += cursor.rowcount
+        self.db.connection.commit()
+        print(f"Remapped {updated} trip locations onto the surviving duplicate")
+        return updated
+
+    def collect(self, table):
+        """
+        Evaluate all rules of a table in a single scan into the temp table drop_<table>
+        :param table: key of self.rules
+        :return: dict of rule name -> rows matched
+        """
+        self.check_table(table)
+        spec = self.rules[table]
+        # The first matching rule is recorded, so every row is counted once
+        cases = "\n".join(f"WHEN {rule['predicate']} THEN '{rule['name']}'" for rule in spec["rules"])
+
+        self.execute(f"DROP TABLE IF EXISTS drop_{table};")
+        # ctid is only unique within one partition, so rows are identified by (tableoid, ctid)
+        # and numbered partition by partition
+        self.execute(f"""
+            CREATE TEMP TABLE drop_{table} AS
+            SELECT row_number() OVER (ORDER BY part) AS seq, part, row_id, key, rule
+            FROM (
+                SELECT tableoid AS part, ctid AS row_id, {spec['key']} AS key,
+                       CASE {cases} END AS rule
+                FROM public.{table}
+            ) r
+            WHERE rule IS NOT NULL;
+        """)
+        self.execute(f"CREATE INDEX ON drop_{table} (seq);")
+        self.execute(f"CREATE INDEX ON drop_{table} (key);")
+        self.execute(f"ANALYZE drop_{table};")
+
+        cursor = self.execute(f"SELECT rule, COUNT(*) FROM drop_{table} GROUP BY rule;")
+        counts = dict(cursor.fetchall())
+        self.db.connection.commit()
 
-        total_deleted = 0
+        for rule in spec["rules"]:
+            print(f"{rule['description']}: {counts.get(rule['name'], 0)} rows")
+        return counts
 
+    def delete_batches(self, table):
+        """
+        Delete the collected rows batch by batch, committing after each one. The rows of a
+        partitioned table are deleted from their leaf partitions, one partition at a time
+        :param table: table to clean
+        :return: rows deleted
+        """
+        cursor = self.execute(f"SELECT COALESCE(MAX(seq), 0) FROM drop_{table};")
+        last = cursor.fetchone()[0]
 
-        for item in cleaning_queries:
-            try:
-                rows_deleted = db_conn.clean_data(item["query"],
-                                                  item["description"])
-                total_deleted += rows_deleted
-            except psycopg2.Error:
-                print("An error occurred. Rolling back changes.")
-                break
+        deleted = 0
+        for low in range(0, last, self.batch_size):
+            bounds = (low, low + self.batch_size)
+            cursor = self.execute(f"""
+                SELECT DISTINCT part, part::regclass::text FROM drop_{table} WHERE seq > %s AND seq <= %s;
+            """, bounds)
+            for part, relation in cursor.fetchall():
+                # ctid = ANY(array) is answered with a TID scan, without reading the rest of the table
+                cursor = self.execute(f"""
+                    DELETE FROM {relation}
+                    WHERE ctid = ANY(ARRAY(
+                        SELECT row_id FROM drop_{table} WHERE part = %s AND seq > %s AND seq <= %s
+                    ));
+                """, (part,) + bounds)
+                deleted += cursor.rowcount
+            self.db.connection.commit()
+            print(f"  {table}: {deleted}/{last} rows deleted")
+        return deleted
 
-        print(
-            f"Total rows deleted across all successfully executed queries: {total_deleted}")
+    def can_rebuild(self, table):
+        """
+        A swapped-in copy would leave the partition tree or inheritance hierarchy of the table
+        and the views reading it would block the DROP, so such tables are cleaned in batches
+        :param table: table to clean
+        :return: True if rebuild_table may replace the table
+        """
+        cursor = self.execute("""
+            SELECT NOT EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = c.oid OR inhparent = c.oid)
+               AND NOT EXISTS (SELECT 1 FROM pg_depend d JOIN pg_rewrite r ON r.oid = d.objid
+                               WHERE d.classid = 'pg_rewrite'::regclass AND d.refobjid = c.oid
+                               AND r.ev_class <> c.oid)
+            FROM pg_class c WHERE c.oid = to_regclass(%s);
+        """, (f"public.{table}",))
+        return cursor.fetchone()[0]
+
+    def rebuild_table(self, table):
+        """
+        Copy the surviving rows into a new table and swap it in for the old one
+        :param table: table to clean
+        :return: rows dropped
+        """
+        cursor = self.execute(f"SELECT COUNT(*) FROM public.{table};")
+        before = cursor.fetchone()[0]
+
+        # LIKE ... INCLUDING ALL carries the defaults, NOT NULL and CHECK constraints, indexes,
+        # identity and generated columns, statistics and comments over to the copy
+        cursor = self.execute("""
+            SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) FROM pg_attribute
+            WHERE attrelid = to_regclass(%s) AND attnum > 0 AND NOT attisdropped AND attgenerated = '';
+        """, (f"public.{table}",))
+        columns = cursor.fetchone()[0]
+        self.execute(f"DROP TABLE IF EXISTS public.{table}_clean;")
+        self.execute(f"CREATE TABLE public.{table}_clean (LIKE public.{table} INCLUDING ALL);")
+        self.execute(f"""
+            INSERT INTO public.{table}_clean ({columns}) OVERRIDING SYSTEM VALUE
+            SELECT {columns} FROM public.{table} t
+            WHERE NOT EXISTS (SELECT 1 FROM drop_{table} d WHERE d.row_id = t.ctid);
+        """)
+        self.db.connection.commit()
+
+        # What LIKE leaves out is recreated by definition after the swap: the foreign keys of this
+        # table (those pointing at it were dropped with drop_constraints), its triggers and grants.
+        # The copied indexes get back the names of the old ones, matched by definition
+        cursor = self.execute("""
+            SELECT conname, pg_get_constraintdef(oid)
+            FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'f';
+        """, (f"public.{table}",))
+        foreign_keys = cursor.fetchall()
+        cursor = self.execute("""
+            SELECT pg_get_triggerdef(oid) FROM pg_trigger
+            WHERE tgrelid = to_regclass(%s) AND NOT tgisinternal;
+        """, (f"public.{table}",))
+        triggers = [row[0] for row in cursor.fetchall()]
+        cursor = self.execute("""
+            SELECT a.privilege_type,
+                   CASE WHEN a.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(a.grantee)) END,
+                   a.is_grantable
+            FROM pg_class c, aclexplode(c.relacl) a WHERE c.oid = to_regclass(%s);
+        """, (f"public.{table}",))
+        grants = cursor.fetchall()
+        index_names = """
+            SELECT split_part(pg_get_indexdef(indexrelid), ' USING ', 2), indisunique, indexrelid::regclass::text
+            FROM pg_index WHERE indrelid = to_regclass(%s);
+        """
+        old_indexes = {row[:2]: row[2] for row in self.execute(index_names, (f"public.{table}",)).fetchall()}
+        new_indexes = {row[:2]: row[2] for row in self.execute(index_names, (f"public.{table}_clean",)).fetchall()}
+
+        # The old table is only locked from here to the commit
+        self.execute(f"DROP TABLE public.{table};")
+        self.execute(f"ALTER TABLE public.{table}_clean RENAME TO {table};")
+        for definition, name in new_indexes.items():
+            if definition in old_indexes:
+                self.execute(f"ALTER INDEX {name} RENAME TO {old_indexes[definition].split('.')[-1]};")
+        for name, definition in foreign_keys:
+            self.execute(f"ALTER TABLE public.{table} ADD CONSTRAINT {name} {definition} NOT VALID;")
+        for definition in triggers:
+            self.execute(definition)
+        for privilege, grantee, grantable in grants:
+            self.execute(f"GRANT {privilege} ON public.{table} TO {grantee}"
+                         f"{' WITH GRANT OPTION' if grantable else ''};")
+        self.db.connection.commit()
+
+        for name, _ in foreign_keys:
+            self.execute(f"ALTER TABLE public.{table} VALIDATE CONSTRAINT {name};")
+            self.db.connection.commit()
+
+        cursor = self.execute(f"SELECT COUNT(*) FROM public.{table};")
+        return before - cursor.fetchone()[0]
+
+    def run(self):
+        """
+        Clean every table: drop the foreign keys, collect all tables' drops parents first,
+        remove them children first, then re-add and validate the foreign keys
+        :return: total rows removed
+        """
+        self.db.drop_constraints()
+        try:
+            self.remap_duplicate_locations()
+            for table in self.rules:
+                self.counts[table] = self.collect(table)
+
+            total_deleted = 0
+            for table in reversed(list(self.rules)):
+                print(f"Cleaning {table} ({self.mode})...")
+                if self.mode == "rebuild" and self.can_rebuild(table):
+                    total_deleted += self.rebuild_table(table)
+                elif self.mode == "rebuild":
+                    print(f"  {table} is partitioned, a partition or has dependent views; "
+                          f"deleting in batches instead")
+                    total_deleted += self.delete_batches(table)
+                else:
+                    total_deleted += self.delete_batches(table)
+                self.execute(f"ANALYZE public.{table};")
+                self.db.connection.commit()
+        except (psycopg2.Error, ValueError):
+            self.db.connection.rollback()
+            raise
+        finally:
+            self.db.reapply_constraints(not_valid=True)
+            self.db.validate_constraints()
+
+        return total_deleted
+
+
+def main(mode="batch", batch_size=50000):
+    db_conn = CleaningConnection()
+    try:
+        db_conn.connect()
+
+        engine = CleaningEngine(db_conn, mode=mode, batch_size=batch_size)
+        try:
+            total_deleted = engine.run()
+            print(f"Total rows deleted across all tables: {total_deleted}")
+        except (psycopg2.Error, ValueError) as e:
+            print(f"An error occurred during cleaning: {e}")
 
     finally:
         db_conn.disconnect()
@@ -202,5 +451,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
-
@@ -0,0 +1,317 @@
+"""
+Incremental frequent itemset mining for appended months (FUP).
+
+itemset_mining.py mines the whole items table, so every new month costs a full rebuild of
+L1..Lk. Here the lattice is maintained instead, following the FUP algorithm of Cheung et al.:
+with a relative support s, history D and appended transactions d, an itemset that was not
+frequent in D can only be frequent in D + d if it is frequent in d on its own (count_d >= s |d|).
+
+Class `IncrementalAprioriLattice`:
+    - Keeps a count store K{k} per level with the exact count of every itemset counted so far:
+      all itemsets frequent at the last update, plus the candidates that were checked against
+      the history and turned out infrequent. L{k} is the part of K{k} above the current threshold.
+    - Per level it counts the candidates of the new L{k-1} and the stored itemsets over d only,
+      adds those counts to the store, and scans D only for new candidates frequent in d.
+    - fup_state records the last mined tid, the transaction count and the source trip
+      watermark, so each run appends the source trips above the watermark to items and mines them.
+    - The first run, or a run at a lower support than the store was built with, mines the
+      whole items table with the same code (an empty history), which is plain Apriori.
+
+Only inserts are supported: a deleted or updated source trip is not removed from the counts.
+Rebuild with itemset_mining.py (and drop fup_state) after such a change.
+
+The L{k} tables are written in the layout of itemset_mining.py, so association_rules.py reads
+them unchanged.
+
+Requirements:
+- `psycopg2` and the items table of preprocess.py.
+
+HOW TO RUN:
+1) Run preprocess.py once, then this File to build the count store.
+2) After loading a new month into the source trip table, run this File again.
+"""
+
+import os
+import sys
+
+from itemset_mining import PROFILE, AprioriLattice, level_stage
+from preprocess import BATCH_SIZE, BINS, SOURCE_PROFILE, bin_trip, get_connection, insert_binned_trips, trip_items
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import db  # noqa: E402
+from common.instrumentation import stage, start_run, write_report  # noqa: E402
+
+
+class IncrementalAprioriLattice(AprioriLattice):
+    def __init__(self, db_connection, min_support=0.03, items_table='items', table_prefix='', bins=None):
+        """
+        Maintain the frequent itemsets of an append-only items table
+        :param db_connection: connection object to the mining database
+        :param min_support: minimum support as a fraction of all transactions
+        :param items_table: table holding the (tid, item) transactions
+        :param table_prefix: prefix for the generated C{k}/K{k}/L{k} tables
+        :param bins: bins of the appended trips, defaults to the BINS of preprocess.py
+        """
+        super().__init__(db_connection, min_support, items_table=items_table, table_prefix=table_prefix,
+                         checkpoints=False)
+        self.bins = bins or BINS
+        self.threshold = None
+        self.delta_threshold = None
+        self.delta_range = None
+        self.history_range = None
+
+    def store_table(self, level):
+        return f"{self.table_prefix}K{level}"
+
+    def prepare_state(self):
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS fup_state (
+                table_prefix VARCHAR PRIMARY KEY,
+                min_support DOUBLE PRECISION,
+                source_id BIGINT,
+                last_tid BIGINT,
+                transactions BIGINT,
+                updated_at TIMESTAMP DEFAULT now()
+            );
+        """)
+        self.conn.commit()
+
+    def load_state(self):
+        """
+        :return: (min_support, source_id, last_tid, transactions) of the last update, or None
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT min_support, source_id, last_tid, transactions FROM fup_state WHERE table_prefix = %s;
+        """, (self.table_prefix,))
+        return cursor.fetchone()
+
+    def save_state(self, **values):
+        cursor = self.conn.cursor()
+        columns = ', '.join(values)
+        cursor.execute(f"""
+            INSERT INTO fup_state (table_prefix, {columns}, updated_at)
+            VALUES (%s, {', '.join(['%s'] * len(values))}, now())
+            ON CONFLICT (table_prefix) DO UPDATE
+            SET {', '.join(f'{column} = EXCLUDED.{column}' for column in values)}, updated_at = now();
+        """, (self.table_prefix, *values.values()))
+
+    def reset(self, source_id=None):
+        """
+        Forget the count store and mine the whole items table on the next update
+        :param source_id: last source trip ID already in the items table; on the first run the
+                          items table of preprocess.py is taken as covering every source trip
+        :return: source_id
+        """
+        prefix = self.table_prefix.lower()
+        self.drop_matching_tables(f'^{prefix}[ckl][0-9]+$')
+
+        if source_id is None:
+            with get_connection(SOURCE_PROFILE) as source_conn:
+                source_cursor = source_conn.cursor()
+                source_cursor.execute("SELECT COALESCE(MAX(id), 0) FROM trip;")
+                source_id = source_cursor.fetchone()[0]
+
+        self.save_state(min_support=self.min_support, source_id=source_id, last_tid=0, transactions=0)
+        self.conn.commit()
+        return source_id
+
+    def append_trips(self, source_id):
+        """
+        Bin the source trips above the watermark and append them to the trip and items tables.
+        The watermark commits with each batch, so an interrupted append resumes where it stopped.
+        :param source_id: last source trip ID already appended
+        :return: number of trips appended
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(f"SELECT COALESCE(MAX(tid), 0) FROM {self.items_table};")
+        tid = cursor.fetchone()[0]
+
+        appended = 0
+        with get_connection(SOURCE_PROFILE) as source_conn:
+            for rows in db.stream(source_conn, 'SELECT * FROM trip WHERE id > %s ORDER BY id', (source_id,),
+                                  batch_size=BATCH_SIZE, name='new_source_trips'):
+                binned = [bin_trip(row, self.bins) for row in rows]
+                items = []
+                for row in binned:
+                    tid += 1
+                    items.extend(trip_items(tid, row))
+
+                insert_binned_trips(cursor, binned)
+                cursor.executemany(f"INSERT INTO {self.items_table}(tid, item) VALUES (%s, %s)", items)
+                self.save_state(source_id=rows[-1][0])
+                self.conn.commit()
+                appended += len(rows)
+        return appended
+
+    def item_match(self, left, right, level):
+        return ' AND '.join(f"{left}.item{i} = {right}.item{i}" for i in range(1, level + 1))
+
+    @level_stage
+    def update_level(self, level):
+        """
+        Bring the count store and L{k} of a level up to date with the appended transactions
+        :param level: integer representing the level (k)
+        :return: boolean indicating if any frequent itemsets were found
+        """
+        cursor = self.conn.cursor()
+        item_columns = ', '.join(f'item{i}' for i in range(1, level + 1))
+        candidate_table = self.candidate_table(level)
+        store_table = self.store_table(level)
+        result_table = self.result_table(level)
+
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {store_table} (
+                {', '.join(f'item{i} VARCHAR' for i in range(1, level + 1))},
+                count BIGINT
+            );
+        """)
+
+        # Candidates of the updated L{k-1}; at level 1 every item of the new transactions
+        cursor.execute(f"DROP TABLE IF EXISTS {candidate_table};")
+        if level == 1:
+            cursor.execute(f"""
+                CREATE TABLE {candidate_table} AS
+                SELECT DISTINCT item as item1 FROM {self.items_table}
+                WHERE tid BETWEEN %s AND %s;
+            """, self.delta_range)
+        else:
+            cursor.execute(self.candidate_query(level))
+        self.candidate_counts[level] = cursor.rowcount
+
+        # Temporary tables of the previous level; all levels run in one transaction
+        cursor.execute("DROP TABLE IF EXISTS fup_counted, fup_delta, fup_new, fup_new_items, fup_history;")
+
+        # Count the candidates and the stored itemsets over the new transactions only
+        cursor.execute(f"""
+            CREATE TEMP TABLE fup_counted AS
+            SELECT {item_columns} FROM {candidate_table}
+            UNION
+            SELECT {item_columns} FROM {store_table};
+        """)
+        cursor.execute(f"""
+            CREATE TEMP TABLE fup_delta AS
+            {self.count_query('fup_counted', level, self.delta_range)};
+        """)
+        cursor.execute(f"""
+            UPDATE {store_table} s SET count = s.count + d.count
+            FROM fup_delta d WHERE {self.item_match('s', 'd', level)};
+        """)
+
+        # A candidate missing from the store was infrequent in the history,
+        # so it can only have become frequent if it is frequent in the new transactions
+        cursor.execute(f"""
+            CREATE TEMP TABLE fup_new AS
+            SELECT d.* FROM fup_delta d
+            WHERE d.count >= %s
+              AND NOT EXISTS (SELECT 1 FROM {store_table} s WHERE {self.item_match('s', 'd', level)});
+        """, (self.delta_threshold,))
+
+        if self.history_range is not None:
+            cursor.execute(f"""
+                CREATE TEMP TABLE fup_new_items AS
+                SELECT {item_columns} FROM fup_new;
+            """)
+            cursor.execute(f"""
+                CREATE TEMP TABLE fup_history AS
+                {self.count_query('fup_new_items', level, self.history_range)};
+            """)
+            cursor.execute(f"""
+                INSERT INTO {store_table}
+                SELECT {', '.join(f'n.item{i}' for i in range(1, level + 1))}, n.count + COALESCE(h.count, 0)
+                FROM fup_new n LEFT JOIN fup_history h ON {self.item_match('n', 'h', level)};
+            """)
+        else:
+            cursor.execute(f"INSERT INTO {store_table} SELECT * FROM fup_new;")
+
+        cursor.execute(f"DROP TABLE IF EXISTS {result_table};")
+        cursor.execute(f"""
+            CREATE TABLE {result_table} AS
+            SELECT {item_columns}, count FROM {store_table}
+            WHERE count >= %s;
+        """, (self.threshold,))
+
+        cursor.execute(f"SELECT COUNT(*) FROM {result_table};")
+        count = cursor.fetchone()[0]
+        if count > 0:
+            self.frequent_item_sets[level] = count
+
+        self.drop_candidates(level)
+        return count > 0
+
+    def store_exists(self, level):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (self.store_table(level),))
+        return cursor.fetchone()[0]
+
+    def generate_all_levels(self):
+        """
+        Append the new source trips and update every level with them.
+        All levels are rewritten in one transaction with the new state, so an interrupted
+        update leaves the previous lattice in place and the next run repeats it.
+
+        :return: Number of levels generated
+        """
+        self.prepare_state()
+        state = self.load_state()
+
+        if state is None or state[0] > self.min_support:
+            if state is not None:
+                print(f"Count store was built at support {state[0]}; rebuilding it at {self.min_support}")
+            source_id, last_tid, transactions = self.reset(state[1] if state else None), 0, 0
+        else:
+            _, source_id, last_tid, transactions = state
+
+        with stage("append_trips") as append_stage:
+            append_stage.rows = self.append_trips(source_id)
+
+        cursor = self.conn.cursor()
+        cursor.execute(f"""
+            SELECT COALESCE(MAX(tid), 0), COUNT(DISTINCT tid) FROM {self.items_table} WHERE tid > %s;
+        """, (last_tid,))
+        high, new_transactions = cursor.fetchone()
+        if new_transactions == 0:
+            print("No new transactions since the last update")
+            return 0
+
+        total = transactions + new_transactions
+        self.delta_range = (last_tid + 1, high)
+        self.history_range = (0, last_tid) if last_tid > 0 else None
+        self.threshold = self.min_support * total
+        self.delta_threshold = self.min_support * new_transactions
+
+        level = 1
+        # Stored levels above the last frequent one are still counted, so the store stays exact
+        while self.update_level(level) or self.store_exists(level + 1):
+            print(f"Updated {self.result_table(level)}")
+            level += 1
+
+        # Checkpoints of itemset_mining.py no longer describe the rewritten L{k} tables
+        cursor.execute("SELECT to_regclass('lattice_runs') IS NOT NULL;")
+        if cursor.fetchone()[0]:
+            cursor.execute("DELETE FROM lattice_runs WHERE table_prefix = %s;", (self.table_prefix,))
+
+        self.save_state(min_support=self.min_support, last_tid=high, transactions=total)
+        self.conn.commit()
+        print(f"Mined {new_transactions} new of {total} transactions")
+        return level
+
+
+def main(min_support=0.03):
+    start_run('incremental_mining')
+    conn = db.connect(PROFILE)
+    try:
+        apriori = IncrementalAprioriLattice(conn, min_support=min_support)
+        with stage("generate_all_levels", min_support=min_support) as lattice_stage:
+            apriori.generate_all_levels()
+            lattice_stage.meta["levels"] = dict(apriori.frequent_item_sets)
+        print(f"Updated {len(apriori.frequent_item_sets)} levels of the itemset lattice")
+    finally:
+        conn.close()
+        db.close_pools()
+        write_report()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,56 @@
-import psycopg2 as pg
-
-conn_params = {
-    'dbname': 'project_v3',
-    'user': 'postgres',
-    'password': '1234',
-    'host': 'localhost',
-    'port': '5432'
-}
+import math
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import db  # noqa: E402
+from common.instrumentation import stage, start_run, write_report  # noqa: E402
+
+# Profile of the database holding the items table, see common/db.py
+PROFILE = 'mining'
+
+
+def level_stage(method):
+    """
+    Record a level as an instrumentation stage with its candidate and frequent itemset counts
+    """
+    @wraps(method)
+    def wrapper(self, level, *args):
+        with stage(self.result_table(level), level=level) as level_record:
+            found = method(self, level, *args)
+            level_record.rows = self.candidate_counts.get(level)
+            level_record.meta["candidates"] = self.candidate_counts.get(level)
+            level_record.meta["frequent"] = self.frequent_item_sets.get(level, 0)
+            return found
+    return wrapper
 
 
 class AprioriLattice:
-    def __init__(self, db_connection, min_support=100):
+    def __init__(self, db_connection, min_support=100, items_table='items', table_prefix='', checkpoints=True):
         """
         Initialize the Apriori algorithm implementation
         :param db_connection: connection object to the database
         :param min_support: minimum support threshold for frequent itemsets
+        :param items_table: table (or view) holding the (tid, item) transactions
+        :param table_prefix: prefix for the generated C{k}/L{k} tables
+        :param checkpoints: record completed levels in lattice_runs and resume from them
         """
         self.conn = db_connection
         self.min_support = min_support
+        self.items_table = items_table
+        self.table_prefix = table_prefix
+        self.checkpoints = checkpoints
+        self.fingerprint = None
         self.frequent_item_sets = {}
+        self.candidate_counts = {}
+
+    def candidate_table(self, level):
+        return f"{self.table_prefix}C{level}"
+
+    def result_table(self, level):
+        return f"{self.table_prefix}L{level}"
 
     def generate_l1(self):
         """
@@ -28,30 +60,30 @@ class AprioriLattice:
         cursor = self.conn.cursor()
 
         # Create L1 table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS L1 AS
+        cursor.execute(f"DROP TABLE IF EXISTS {self.result_table(1)};")
+        cursor.execute(f"""
+            CREATE TABLE {self.result_table(1)} AS
             SELECT item as item1, COUNT(*) as count
-            FROM items
+            FROM {self.items_table}
             GROUP BY item
             HAVING COUNT(*) >= %s;
         """, (self.min_support,))
 
         # Check if L1 table is empty
-        cursor.execute("SELECT COUNT(*) FROM L1;")
+        cursor.execute(f"SELECT COUNT(*) FROM {self.result_table(1)};")
         count = cursor.fetchone()[0]
         self.frequent_item_sets[1] = count
 
+        self.save_checkpoint(1, count)
         self.conn.commit()
         return count > 0
 
-    def generate_next_level(self, current_level):
+    def candidate_query(self, current_level):
         """
-        Generate the next level of frequent itemsets
+        Build the query that joins the previous level with itself
         :param current_level: integer representing the current level (k)
-        :return: boolean indicating if any frequent itemsets were found
+        :return: CREATE TABLE statement for the candidate table
         """
-        cursor = self.conn.cursor()
-
         # Generate join condition and column lists for the candidate generation
         join_conditions = []
         select_columns = []
@@ -70,40 +102,70 @@ class AprioriLattice:
             f"p.item{current_level - 1} < q.item{current_level - 1}"
         )
 
-        # Generate the table names
-        candidate_table = f"C{current_level}"
-        result_table = f"L{current_level}"
+        previous_table = self.result_table(current_level - 1)
 
-        # Create the candidate table
-        candidate_query = f"""
-            CREATE TABLE {candidate_table} AS
+        return f"""
+            CREATE TABLE {self.candidate_table(current_level)} AS
             SELECT {','.join(select_columns)}
-            FROM L{current_level - 1} p, L{current_level - 1} q
+            FROM {previous_table} p, {previous_table} q
             WHERE {' AND '.join(join_conditions)};
         """
 
-        cursor.execute(candidate_query)
-
+    def count_query(self, candidate_table, current_level, tid_range=None):
+        """
+        Build the query that counts the support of every candidate
+        :param candidate_table: table holding the candidate itemsets
+        :param current_level: integer representing the current level (k)
+        :param tid_range: optional (low, high) tid bounds to count over
+        :return: SELECT statement producing item1..itemk and count
+        """
         # Generate items joins and conditions for counting
         item_joins = []
         item_conditions = []
         for i in range(1, current_level + 1):
             item_joins.append(
-                f"INNER JOIN items pt{i} ON c.item{i} = pt{i}.item"
+                f"INNER JOIN {self.items_table} pt{i} ON c.item{i} = pt{i}.item"
             )
             if i > 1:
                 item_conditions.append(
                     f"pt1.tid = pt{i}.tid"
                 )
 
-        # Count frequent itemsets
-        count_query = f"""
-        CREATE TABLE IF NOT EXISTS {result_table} AS
+        if tid_range is not None:
+            item_conditions.append(f"pt1.tid BETWEEN {int(tid_range[0])} AND {int(tid_range[1])}")
+
+        where_clause = f"WHERE {' AND '.join(item_conditions)}" if item_conditions else ""
+
+        return f"""
         SELECT c.*, COUNT(*) as count
         FROM {candidate_table} c
         {' '.join(item_joins)}
-        WHERE {' AND '.join(item_conditions)}
+        {where_clause}
         GROUP BY {', '.join(f'c.item{i}' for i in range(1, current_level + 1))}
+        """
+
+    def generate_next_level(self, current_level):
+        """
+        Generate the next level of frequent itemsets
+        :param current_level: integer representing the current level (k)
+        :return: boolean indicating if any frequent itemsets were found
+        """
+        cursor = self.conn.cursor()
+
+        # Generate the table names
+        candidate_table = self.candidate_table(current_level)
+        result_table = self.result_table(current_level)
+
+        # Create the candidate table, replacing any left behind by an interrupted run
+        cursor.execute(f"DROP TABLE IF EXISTS {candidate_table};")
+        cursor.execute(self.candidate_query(current_level))
+        self.candidate_counts[current_level] = cursor.rowcount
+
+        # Count frequent itemsets
+        cursor.execute(f"DROP TABLE IF EXISTS {result_table};")
+        count_query = f"""
+        CREATE TABLE {result_table} AS
+        {self.count_query(candidate_table, current_level)}
         HAVING COUNT(*) >= %s;
         """
         cursor.execute(count_query, (self.min_support,))
@@ -115,46 +177,592 @@ class AprioriLattice:
             self.frequent_item_sets[current_level] = count
 
         # Clean up temporary table
-        cursor.execute(f"DROP TABLE {candidate_table};")
+        self.drop_candidates(current_level)
 
+        self.save_checkpoint(current_level, count)
         self.conn.commit()
         return count > 0
 
+    def drop_candidates(self, current_level):
+        """
+        Drop the candidate table of a level once its support has been counted
+        :param current_level: integer representing the current level (k)
+        :return: None
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(f"DROP TABLE {self.candidate_table(current_level)};")
+
+    def drop_matching_tables(self, pattern):
+        """
+        Drop every table in the current schema whose name matches a regex
+        :param pattern: POSIX regular expression over lower-case table names
+        :return: None
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT table_name FROM information_schema.tables
+            WHERE table_schema = current_schema() AND table_type = 'BASE TABLE' AND table_name ~ %s;
+        """, (pattern,))
+        for (table_name,) in cursor.fetchall():
+            cursor.execute(f"DROP TABLE IF EXISTS {table_name};")
+        self.conn.commit()
+
+    def prepare_checkpoints(self):
+        """
+        Create the run metadata table and fingerprint the input transactions
+        :return: None
+        """
+        if not self.checkpoints:
+            return
+
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS lattice_runs (
+                table_prefix VARCHAR,
+                level INTEGER,
+                min_support BIGINT,
+                fingerprint VARCHAR,
+                frequent_count BIGINT,
+                completed_at TIMESTAMP DEFAULT now(),
+                PRIMARY KEY (table_prefix, level)
+            );
+        """)
+
+        # Order-independent digest of the (tid, item) pairs, so any added,
+        # removed or moved item changes the fingerprint
+        cursor.execute(f"""
+            SELECT md5(%s || ':' || COUNT(*) || ':' || COALESCE(MAX(tid), 0) || ':' ||
+                       COALESCE(SUM(hashtext(tid::text || ':' || item)::bigint), 0))
+            FROM {self.items_table};
+        """, (self.items_table,))
+        self.fingerprint = cursor.fetchone()[0]
+        self.conn.commit()
+
+    def save_checkpoint(self, level, count):
+        """
+        Record a completed level; called inside the level's transaction so the
+        checkpoint commits atomically with the L{k} table
+        :param level: integer representing the completed level (k)
+        :param count: number of frequent itemsets found at this level
+        :return: None
+        """
+        if not self.checkpoints:
+            return
+
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            INSERT INTO lattice_runs (table_prefix, level, min_support, fingerprint, frequent_count, completed_at)
+            VALUES (%s, %s, %s, %s, %s, now())
+            ON CONFLICT (table_prefix, level) DO UPDATE
+            SET min_support = EXCLUDED.min_support,
+                fingerprint = EXCLUDED.fingerprint,
+                frequent_count = EXCLUDED.frequent_count,
+                completed_at = EXCLUDED.completed_at;
+        """, (self.table_prefix, level, self.min_support, self.fingerprint, count))
+
+    def clear_checkpoints(self, from_level):
+        """
+        Forget the checkpoints of a level and every level above it
+        :param from_level: lowest level to invalidate
+        :return: None
+        """
+        if not self.checkpoints:
+            return
+
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM lattice_runs WHERE table_prefix = %s AND level >= %s;",
+                       (self.table_prefix, from_level))
+
+    def resume_level(self, level):
+        """
+        Reuse a level completed by an earlier run over the same input.
+        A checkpoint at the same support is reused as is; one at a lower
+        support still holds every itemset frequent at the current threshold
+        with its exact count, so it is filtered in place instead of rebuilt.
+        :param level: integer representing the level (k)
+        :return: True/False like generate_next_level, or None if the level must be rebuilt
+        """
+        if not self.checkpoints:
+            return None
+
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT min_support, fingerprint, frequent_count FROM lattice_runs
+            WHERE table_prefix = %s AND level = %s;
+        """, (self.table_prefix, level))
+        checkpoint = cursor.fetchone()
+
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (self.result_table(level),))
+        table_exists = cursor.fetchone()[0]
+
+        if checkpoint is None or not table_exists:
+            return None
+
+        min_support, fingerprint, count = checkpoint
+        if fingerprint != self.fingerprint or min_support > self.min_support:
+            return None
+
+        if min_support < self.min_support:
+            cursor.execute(f"DELETE FROM {self.result_table(level)} WHERE count < %s;", (self.min_support,))
+            cursor.execute(f"SELECT COUNT(*) FROM {self.result_table(level)};")
+            count = cursor.fetchone()[0]
+            self.save_checkpoint(level, count)
+            self.conn.commit()
+            print(f"Filtered {self.result_table(level)} from support {min_support} to {self.min_support}")
+        else:
+            print(f"Reusing {self.result_table(level)} from a completed run")
+
+        if count > 0 or level == 1:
+            self.frequent_item_sets[level] = count
+        return count > 0
+
+    @level_stage
+    def run_level(self, level):
+        """
+        Resume a level from its checkpoint or generate it from scratch
+        :param level: integer representing the level (k)
+        :return: boolean indicating if any frequent itemsets were found
+        """
+        resumed = self.resume_level(level)
+        if resumed is not None:
+            return resumed
+
+        self.clear_checkpoints(level)
+        if level == 1:
+            return self.generate_l1()
+        return self.generate_next_level(level)
+
     def generate_all_levels(self):
         """
-        Generate all levels of the intemset lattice until no more frequent itemsets are found
+        Generate all levels of the intemset lattice until no more frequent itemsets are found.
+        Levels completed by an earlier run with the same input and a compatible
+        support threshold are reused, so an interrupted run resumes at the
+        first incomplete level.
 
         :return: Number of levels generated
         """
+        self.prepare_checkpoints()
+
         # Generate L1
-        if not self.generate_l1():
+        if not self.run_level(1):
             return 0
 
-        print("Generated L1")
+        print(f"Generated {self.result_table(1)}")
 
         current_level = 2
 
         # Keep generating levels until we find no more frequent itemsets
-        while self.generate_next_level(current_level):
+        while self.run_level(current_level):
+            current_level += 1
+            print(f"Generated {self.result_table(current_level - 1)}")
+
+        return current_level
+
+
+class PartitionedAprioriLattice(AprioriLattice):
+    """
+    Partition-based (SON) Apriori over tid ranges of the items table.
+
+    Phase 1 mines each partition concurrently, on its own connection, at a
+    support threshold scaled to the partition size. Any globally frequent
+    itemset is locally frequent in at least one partition, so the union of
+    the local results is a complete candidate set. Phase 2 counts those
+    candidates per partition concurrently and merges the partial counts
+    before applying the global threshold, which keeps the result exact.
+    """
+    def __init__(self, db_connection, min_support=100, num_partitions=4, connection_factory=None):
+        """
+        :param db_connection: connection object to the database
+        :param min_support: minimum support threshold for frequent itemsets
+        :param num_partitions: number of tid-range partitions mined concurrently
+        :param connection_factory: callable returning a context manager that lends a worker a connection;
+            defaults to the pool of the mining profile
+        """
+        super().__init__(db_connection, min_support)
+        self.num_partitions = num_partitions
+        self.connection_factory = connection_factory or (lambda: db.connection(PROFILE))
+        self.partitions = []
+
+    def get_partitions(self):
+        """
+        Split the tid domain of the items table into equal-width ranges
+        :return: list of (low, high) inclusive tid bounds
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(f"SELECT MIN(tid), MAX(tid) FROM {self.items_table};")
+        low, high = cursor.fetchone()
+        if low is None:
+            return []
+
+        width = math.ceil((high - low + 1) / self.num_partitions)
+        return [
+            (start, min(start + width - 1, high))
+            for start in range(low, high + 1, width)
+        ]
+
+    def drop_partition_tables(self):
+        self.drop_matching_tables('^(p[0-9]+_[cl][0-9]+|c[0-9]+_p[0-9]+)$')
+        cursor = self.conn.cursor()
+        for i in range(len(self.partitions)):
+            cursor.execute(f"DROP VIEW IF EXISTS items_p{i};")
+        self.conn.commit()
+
+    def mine_partition(self, partition_idx, total_transactions):
+        """
+        Phase 1: mine the locally frequent itemsets of one partition
+        :param partition_idx: index into self.partitions
+        :param total_transactions: number of transactions in the whole items table
+        :return: number of local levels generated
+        """
+        with self.connection_factory() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT COUNT(DISTINCT tid) FROM items_p{partition_idx};")
+            partition_transactions = cursor.fetchone()[0]
+
+            # Scaling the threshold down (never up) keeps phase 1 complete
+            local_support = max(1, math.floor(self.min_support * partition_transactions / total_transactions))
+
+            local = AprioriLattice(conn, local_support,
+                                   items_table=f"items_p{partition_idx}",
+                                   table_prefix=f"p{partition_idx}_",
+                                   checkpoints=False)
+            local.generate_all_levels()
+            return len(local.frequent_item_sets)
+
+    def count_partition(self, partition_idx, current_level):
+        """
+        Phase 2: count the global candidates over one partition
+        :param partition_idx: index into self.partitions
+        :param current_level: integer representing the current level (k)
+        :return: None
+        """
+        with self.connection_factory() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                CREATE TABLE C{current_level}_p{partition_idx} AS
+                {self.count_query(self.candidate_table(current_level), current_level,
+                                  self.partitions[partition_idx])};
+            """)
+            conn.commit()
+
+    @level_stage
+    def generate_level(self, current_level, local_levels):
+        """
+        Merge the local candidates of a level and count them exactly
+        :param current_level: integer representing the current level (k)
+        :param local_levels: number of local levels found by each partition
+        :return: boolean indicating if any frequent itemsets were found
+        """
+        resumed = self.resume_level(current_level)
+        if resumed is not None:
+            return resumed
+
+        self.clear_checkpoints(current_level)
+        cursor = self.conn.cursor()
+        item_columns = ', '.join(f'item{i}' for i in range(1, current_level + 1))
+        candidate_table = self.candidate_table(current_level)
+        result_table = self.result_table(current_level)
+
+        sources = [
+            f"SELECT {item_columns} FROM p{i}_L{current_level}"
+            for i, levels in enumerate(local_levels) if levels >= current_level
+        ]
+        if not sources:
+            return False
+
+        cursor.execute(f"DROP TABLE IF EXISTS {candidate_table};")
+        cursor.execute(f"CREATE TABLE {candidate_table} AS {' UNION '.join(sources)};")
+        self.candidate_counts[current_level] = cursor.rowcount
+        self.conn.commit()
+
+        with ThreadPoolExecutor(max_workers=self.num_partitions) as executor:
+            list(executor.map(lambda i: self.count_partition(i, current_level),
+                              range(len(self.partitions))))
+
+        partial_counts = ' UNION ALL '.join(
+            f"SELECT * FROM C{current_level}_p{i}" for i in range(len(self.partitions))
+        )
+        cursor.execute(f"DROP TABLE IF EXISTS {result_table};")
+        cursor.execute(f"""
+            CREATE TABLE {result_table} AS
+            SELECT {item_columns}, SUM(count)::bigint as count
+            FROM ({partial_counts}) partial
+            GROUP BY {item_columns}
+            HAVING SUM(count) >= %s;
+        """, (self.min_support,))
+
+        cursor.execute(f"SELECT COUNT(*) FROM {result_table};")
+        count = cursor.fetchone()[0]
+        if count > 0:
+            self.frequent_item_sets[current_level] = count
+
+        # Clean up temporary tables
+        cursor.execute(f"DROP TABLE {candidate_table};")
+        for i in range(len(self.partitions)):
+            cursor.execute(f"DROP TABLE C{current_level}_p{i};")
+
+        self.save_checkpoint(current_level, count)
+        self.conn.commit()
+        return count > 0
+
+    def generate_all_levels(self):
+        """
+        Generate all levels of the itemset lattice with the SON algorithm
+
+        :return: Number of levels generated
+        """
+        self.partitions = self.get_partitions()
+        if not self.partitions:
+            return 0
+
+        self.drop_partition_tables()
+        self.prepare_checkpoints()
+
+        cursor = self.conn.cursor()
+        cursor.execute(f"SELECT COUNT(DISTINCT tid) FROM {self.items_table};")
+        total_transactions = cursor.fetchone()[0]
+
+        for i, (low, high) in enumerate(self.partitions):
+            cursor.execute(f"""
+                CREATE VIEW items_p{i} AS
+                SELECT tid, item FROM {self.items_table}
+                WHERE tid BETWEEN {int(low)} AND {int(high)};
+            """)
+        self.conn.commit()
+
+        with ThreadPoolExecutor(max_workers=self.num_partitions) as executor:
+            with stage("local mining", partitions=len(self.partitions)):
+                local_levels = list(executor.map(lambda i: self.mine_partition(i, total_transactions),
+                                                 range(len(self.partitions))))
+
+        print(f"Mined {len(self.partitions)} partitions locally")
+
+        current_level = 1
+
+        # Keep counting levels until no candidate turns out globally frequent
+        while self.generate_level(current_level, local_levels):
+            print(f"Generated {self.result_table(current_level)}")
             current_level += 1
-            print(f"Generated L{current_level - 1}")
+
+        self.drop_partition_tables()
 
         return current_level
 
 
-def main():
+class SampledAprioriLattice(AprioriLattice):
+    """
+    Toivonen-style sample-then-verify mining for fast threshold exploration.
+
+    A random sample of n transactions is mined at the relative threshold
+    lowered by the Hoeffding bound eps = sqrt(ln(1 / delta) / (2 n)), so an
+    itemset that is frequent in the full data is missed by the sample with
+    probability at most delta. The sample tables (s_L{k}) hold sample counts
+    whose relative supports are within +/- eps of the true ones with the same
+    confidence. With verification, the sample-frequent itemsets and their
+    negative border (s_B{k}) are counted exactly over the full items table
+    into L{k}; the result is exact unless a border itemset turns out to be
+    frequent, which is reported in border_failures.
+    """
+    def __init__(self, db_connection, min_support=100, sample_fraction=0.05, delta=0.01, seed=0.5,
+                 verify=True):
+        """
+        :param db_connection: connection object to the database
+        :param min_support: minimum support threshold over the full items table
+        :param sample_fraction: fraction of transactions drawn into the sample
+        :param delta: probability of missing a frequent itemset in the sample
+        :param seed: seed in [-1, 1] passed to setseed() for a reproducible sample
+        :param verify: count the sample result and negative border over the full data
+        """
+        super().__init__(db_connection, min_support, items_table='items_sample', table_prefix='s_',
+                         checkpoints=False)
+        self.source_table = 'items'
+        self.global_min_support = min_support
+        self.sample_fraction = sample_fraction
+        self.delta = delta
+        self.seed = seed
+        self.verify = verify
+        self.total_transactions = 0
+        self.sample_transactions = 0
+        self.error_bound = None
+        self.border_failures = {}
+        self.verified_item_sets = {}
+
+    def border_table(self, level):
+        return f"{self.table_prefix}B{level}"
+
+    def draw_sample(self):
+        """
+        Copy a random subset of whole transactions into the sample table
+        :return: None
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("DROP TABLE IF EXISTS items_sample;")
+        cursor.execute("SELECT setseed(%s);", (self.seed,))
+        cursor.execute(f"""
+            CREATE TABLE items_sample AS
+            SELECT i.tid, i.item
+            FROM {self.source_table} i
+            JOIN (
+                SELECT tid FROM (SELECT DISTINCT tid FROM {self.source_table}) t
+                WHERE random() < %s
+            ) s ON s.tid = i.tid;
+        """, (self.sample_fraction,))
+
+        cursor.execute(f"SELECT COUNT(DISTINCT tid) FROM {self.source_table};")
+        self.total_transactions = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(DISTINCT tid) FROM items_sample;")
+        self.sample_transactions = cursor.fetchone()[0]
+        self.conn.commit()
+
+    def lower_threshold(self):
+        """
+        Lower the relative support by the Hoeffding bound of the sample size
+        :return: absolute support threshold to mine the sample at
+        """
+        relative_support = self.global_min_support / self.total_transactions
+        self.error_bound = math.sqrt(math.log(1 / self.delta) / (2 * self.sample_transactions))
+
+        lowered = relative_support - self.error_bound
+        if lowered <= 0:
+            print(f"Sample of {self.sample_transactions} transactions is too small for "
+                  f"support {relative_support:.4f} (eps={self.error_bound:.4f}); mining every itemset")
+        return max(1, math.floor(lowered * self.sample_transactions))
+
+    def drop_candidates(self, current_level):
+        """
+        Keep the candidates that were not frequent in the sample as the negative border
+        :param current_level: integer representing the current level (k)
+        :return: None
+        """
+        cursor = self.conn.cursor()
+        item_columns = ', '.join(f'item{i}' for i in range(1, current_level + 1))
+        cursor.execute(f"""
+            CREATE TABLE {self.border_table(current_level)} AS
+            SELECT {item_columns} FROM {self.candidate_table(current_level)}
+            EXCEPT
+            SELECT {item_columns} FROM {self.result_table(current_level)};
+        """)
+        super().drop_candidates(current_level)
+
+    def verify_levels(self, sample_levels):
+        """
+        Count the sample-frequent itemsets and the negative border over the full data
+        :param sample_levels: first level at which the sample had no frequent itemsets
+        :return: None
+        """
+        cursor = self.conn.cursor()
+        full = AprioriLattice(self.conn, self.global_min_support, items_table=self.source_table)
+
+        # The L{k} tables are rewritten below, so checkpoints of an exact run no longer describe them
+        cursor.execute("SELECT to_regclass('lattice_runs') IS NOT NULL;")
+        if cursor.fetchone()[0]:
+            cursor.execute("DELETE FROM lattice_runs WHERE table_prefix = '';")
+
+        # Level 1: counting every item covers the sample result and its border
+        cursor.execute("DROP TABLE IF EXISTS L1;")
+        cursor.execute(f"""
+            CREATE TABLE L1 AS
+            SELECT item as item1, COUNT(*) as count
+            FROM {self.source_table}
+            GROUP BY item
+            HAVING COUNT(*) >= %s;
+        """, (self.global_min_support,))
+        cursor.execute(f"""
+            SELECT item1 FROM L1 EXCEPT SELECT item1 FROM {self.result_table(1)};
+        """)
+        self.record_level(1, cursor)
+
+        for level in range(2, sample_levels + 1):
+            item_columns = ', '.join(f'item{i}' for i in range(1, level + 1))
+            verify_table = f"{self.table_prefix}V{level}"
+
+            cursor.execute(f"DROP TABLE IF EXISTS {verify_table};")
+            cursor.execute(f"""
+                CREATE TABLE {verify_table} AS
+                SELECT {item_columns} FROM {self.result_table(level)}
+                UNION
+                SELECT {item_columns} FROM {self.border_table(level)};
+            """)
+
+            cursor.execute(f"DROP TABLE IF EXISTS L{level};")
+            cursor.execute(f"""
+                CREATE TABLE L{level} AS
+                {full.count_query(verify_table, level)}
+                HAVING COUNT(*) >= %s;
+            """, (self.global_min_support,))
+            cursor.execute(f"""
+                SELECT {item_columns} FROM L{level}
+                INTERSECT
+                SELECT {item_columns} FROM {self.border_table(level)};
+            """)
+            self.record_level(level, cursor)
+            cursor.execute(f"DROP TABLE {verify_table};")
+
+        self.conn.commit()
+
+    def record_level(self, level, cursor):
+        failures = cursor.fetchall()
+        if failures:
+            self.border_failures[level] = [tuple(row) for row in failures]
+
+        cursor.execute(f"SELECT COUNT(*) FROM L{level};")
+        count = cursor.fetchone()[0]
+        if count > 0:
+            self.verified_item_sets[level] = count
+
+    def generate_all_levels(self):
+        """
+        Mine the sample at the lowered threshold and optionally verify the result
+
+        :return: Number of levels generated
+        """
+        self.drop_matching_tables('^s_[clbv][0-9]+$')
+        self.draw_sample()
+        if self.sample_transactions == 0:
+            return 0
+
+        self.min_support = self.lower_threshold()
+        sample_levels = super().generate_all_levels()
+
+        print(f"Sampled {self.sample_transactions} of {self.total_transactions} transactions; "
+              f"supports in {self.result_table(1)}.. are within +/-{self.error_bound:.4f} "
+              f"with probability {1 - self.delta:.2f}")
+
+        if self.verify:
+            self.verify_levels(sample_levels)
+            if self.border_failures:
+                print(f"Negative border itemsets were frequent at levels {sorted(self.border_failures)}; "
+                      f"L{{k}} may be incomplete, rerun without sampling for exact output")
+            else:
+                print("Verified: L{k} tables are exact")
+
+        return sample_levels
+
+
+def main(min_support=1000, num_partitions=1, sample_fraction=None):
+    start_run('itemset_mining')
+
     # Connect to the database
-    conn = pg.connect(**conn_params)
+    conn = db.connect(PROFILE)
 
     # Create the AprioriLattice object
-    apriori = AprioriLattice(conn, min_support=1000)
+    if sample_fraction:
+        apriori = SampledAprioriLattice(conn, min_support=min_support, sample_fraction=sample_fraction)
+    elif num_partitions > 1:
+        apriori = PartitionedAprioriLattice(conn, min_support=min_support, num_partitions=num_partitions)
+    else:
+        apriori = AprioriLattice(conn, min_support=min_support)
 
     # Generate all levels of the itemset lattice
-    apriori.generate_all_levels()
+    with stage("generate_all_levels", min_support=min_support) as lattice_stage:
+        apriori.generate_all_levels()
+        lattice_stage.meta["levels"] = dict(apriori.frequent_item_sets)
     num_levels = len(apriori.frequent_item_sets)
     print(f"Generated {num_levels} levels of the itemset lattice")
 
     conn.close()
+    db.close_pools()
+    write_report()
 
 
 if __name__ == '__main__':
@@ -1,46 +1,41 @@
+import os
+import sys
+
 import psycopg2 as pg
 from contextlib import contextmanager
 
-conn_params1 = {
-    'dbname': 'project_v1',
-    'user': 'postgres',
-    'password': '1234',
-    'host': 'localhost',
-    'port': '5432'
-}
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import db, trip_cache  # noqa: E402
+from common.instrumentation import stage, start_run, write_report  # noqa: E402
 
-conn_params2 = {
-    'dbname': 'project_v3',
-    'user': 'postgres',
-    'password': '1234',
-    'host': 'localhost',
-    'port': '5432'
-}
+# Profiles in db.ini (see common/db.py): trips are read from the source database
+# and the binned trip and items tables are written to the mining database
+SOURCE_PROFILE = 'mining_source'
+MINING_PROFILE = 'mining'
+
+# Rows fetched per round trip; the source trips are never held in memory at once
+BATCH_SIZE = 100000
 
 
 @contextmanager
-def get_connection(conn_params):
-    """Context manager for database connections"""
-    conn = None
+def get_connection(profile):
+    """Context manager for pooled database connections with bulk-load session settings"""
     try:
-        conn = pg.connect(**conn_params)
-        yield conn
+        with db.connection(profile, tuning=db.BULK) as conn:
+            yield conn
     except pg.Error as e:
         print(f"Database connection error: {e}")
-        if conn:
-            conn.rollback()
         raise
-    finally:
-        if conn:
-            conn.close()
 
 
 def create_table():
     try:
-        with get_connection(conn_params2) as conn:
+        with get_connection(MINING_PROFILE) as conn:
             with conn.cursor() as cur:
+                # A rerun (e.g. with other bins) replaces the binned trips instead of appending to them
+                cur.execute('DROP TABLE IF EXISTS trip, items')
                 cur.execute('''
-                    CREATE TABLE IF NOT EXISTS trip(
+                    CREATE TABLE trip(
                         passengercount VARCHAR(10),
                         tripdistance VARCHAR(10),
                         ratecodeid INTEGER,
@@ -60,6 +55,44 @@ def create_table():
         raise
 
 
+# Bins of the numeric trip columns; each bin is a half-open [lower, upper) range
+BINS = {
+    'passengercount': {
+        '<6': (0, 6),
+        '6+': (6, float('inf'))
+    },
+    'tripdistance': {
+        '<1': (0, 1),
+        '1-5': (1, 5),
+        '5-10': (5, 10),
+        '10+': (10, float('inf'))
+    },
+    'fareamount': {
+        '<100': (0, 100),
+        '100-500': (100, 500),
+        '500-1000': (500, 1000),
+        '1000+': (1000, float('inf'))
+    },
+    'tipamount': {
+        '0': (0, 0),
+        '<50': (0, 50),
+        '50-100': (50, 100),
+        '100+': (100, float('inf'))
+    },
+    'tollsamount': {
+        '<50': (0, 50),
+        '50-100': (50, 100),
+        '100+': (100, float('inf'))
+    },
+    'totalamount': {
+        '<100': (0, 100),
+        '100-500': (100, 500),
+        '500-1000': (500, 1000),
+        '1000+': (1000, float('inf'))
+    }
+}
+
+
 def bin_numeric_value(value, bins):
     """Generic function to bin numeric values"""
     for bin_name, (lower, upper) in bins.items():
@@ -68,91 +101,79 @@ def bin_numeric_value(value, bins):
     return 'other'
 
 
-def insert_data():
+def bin_trip(row, bins):
+    """
+    Bin one source trip into a row of the mining trip table
+    :param row: row of the source trip table, in column order
+    :param bins: bins per column
+    :return: tuple in the column order of the mining trip table
+    """
+    return (
+        str(bin_numeric_value(row[1], bins['passengercount'])),
+        str(bin_numeric_value(row[2], bins['tripdistance'])),
+        int(row[15]),
+        str(row[3]),
+        int(row[14]),
+        str(bin_numeric_value(row[4], bins['fareamount'])),
+        str(bin_numeric_value(row[8], bins['tipamount'])),
+        str(bin_numeric_value(row[9], bins['tollsamount'])),
+        str(bin_numeric_value(row[10], bins['totalamount'])),
+        int(row[16]),
+        int(row[17])
+    )
+
+
+def insert_binned_trips(cur, processed_data):
+    cur.executemany('''
+        INSERT INTO trip(
+         passengercount,
+        tripdistance,
+        ratecodeid,
+        storeandfwdflag,
+        paymenttype,
+        fareamount,
+        tipamount,
+        tollsamount,
+        totalamount,
+        pulocationid,
+        dolocationid) 
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ''', processed_data)
+
+
+def source_batches(source_conn, cache=False):
+    """
+    Batches of source trip rows, from the database or from the columnar trip cache
+    :param source_conn: connection to the source database
+    :param cache: read the memory-mapped cache of common/trip_cache.py instead of the trip table
+    :return: generator of row lists in the column order of the trip table
+    """
+    if cache:
+        return trip_cache.iter_rows(trip_cache.open_trips(SOURCE_PROFILE), batch_size=BATCH_SIZE)
+    return db.stream(source_conn, 'SELECT * FROM trip', batch_size=BATCH_SIZE, name='source_trips')
+
+
+def insert_data(bins=None, cache=False):
+    """
+    Bin the source trips into the trip table of the mining database
+    :param bins: bins per column, defaults to BINS
+    :param cache: read the source trips from the columnar trip cache
+    :return: number of trips inserted
+    """
+    bins = bins or BINS
     try:
-        # Fetch data from source database
-        with get_connection(conn_params1) as source_conn:
-            with source_conn.cursor() as source_cur:
-                source_cur.execute('SELECT * FROM trip')
-                rows = source_cur.fetchall()
-
-        # Prepare binning configurations
-        passenger_bins = {
-            '<6': (0, 6),
-            '6+': (6, float('inf'))
-        }
-
-        trip_distance_bins = {
-            '<1': (0, 1),
-            '1-5': (1, 5),
-            '5-10': (5, 10),
-            '10+': (10, float('inf'))
-        }
-
-        fare_bins = {
-            '<100': (0, 100),
-            '100-500': (100, 500),
-            '500-1000': (500, 1000),
-            '1000+': (1000, float('inf'))
-        }
-
-        tip_bins = {
-            '0': (0, 0),
-            '<50': (0, 50),
-            '50-100': (50, 100),
-            '100+': (100, float('inf'))
-        }
-
-        tolls_bins = {
-            '<50': (0, 50),
-            '50-100': (50, 100),
-            '100+': (100, float('inf'))
-        }
-
-        total_bins = {
-            '<100': (0, 100),
-            '100-500': (100, 500),
-            '500-1000': (500, 1000),
-            '1000+': (1000, float('inf'))
-        }
-
-        # Insert processed data
-        with get_connection(conn_params2) as dest_conn:
+        # Stream the source trips and insert each processed batch
+        inserted = 0
+        with get_connection(SOURCE_PROFILE) as source_conn, get_connection(MINING_PROFILE) as dest_conn:
             with dest_conn.cursor() as dest_cur:
-                processed_data = []
-                for row in rows:
-                    processed_row = (
-                        str(bin_numeric_value(row[1], passenger_bins)),
-                        str(bin_numeric_value(row[2], trip_distance_bins)),
-                        int(row[15]),
-                        str(row[3]),
-                        int(row[14]),
-                        str(bin_numeric_value(row[4], fare_bins)),
-                        str(bin_numeric_value(row[8], tip_bins)),
-                        str(bin_numeric_value(row[9], tolls_bins)),
-                        str(bin_numeric_value(row[10], total_bins)),
-                        int(row[16]),
-                        int(row[17])
-                    )
-                    processed_data.append(processed_row)
-
-                # Batch insert with error handling
-                dest_cur.executemany('''
-                    INSERT INTO trip(
-                     passengercount,
-                    tripdistance,
-                    ratecodeid,
-                    storeandfwdflag,
-                    paymenttype,
-                    fareamount,
-                    tipamount,
-                    tollsamount,
-                    totalamount,
-                    pulocationid,
-                    dolocationid) 
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ''', processed_data)
-                dest_conn.commit()
+                for rows in source_batches(source_conn, cache):
+                    processed_data = [bin_trip(row, bins) for row in rows]
+
+                    # Batch insert with error handling
+                    insert_binned_trips(dest_cur, processed_data)
+                    dest_conn.commit()
+                    inserted += len(processed_data)
+                return inserted
 
     except pg.Error as e:
         print(f"Database insertion error: {e}")
@@ -187,17 +208,22 @@ def prepend_col_tag(data, col_idx):
         return f'dolocationid:{data}'
 
 
+def trip_items(tid, row):
+    """
+    Transaction of one binned trip
+    :param tid: transaction ID
+    :param row: row of the mining trip table
+    :return: list of (tid, item) pairs, one per column
+    """
+    return [(tid, prepend_col_tag(row[i], i)) for i in range(0, len(row))]
+
+
 def prepareItems():
     try:
-        with get_connection(conn_params2) as conn:
+        with get_connection(MINING_PROFILE) as conn:
             with conn.cursor() as cur:
                 cur.execute('''
-                    SELECT * FROM trip
-                ''')
-                rows = cur.fetchall()
-
-                cur.execute('''
-                                    CREATE TABLE IF NOT EXISTS items(
+                                    CREATE TABLE items(
                                         tid INTEGER,    
                                         item varchar
                                     )
@@ -208,20 +234,20 @@ def prepareItems():
 
                 tid = 1
 
-                for row in rows:
-                    current_items = []
-                    for i in range(0, len(row)):
-                        current_items.append((tid, prepend_col_tag(row[i], i)))
-                    processed_data.extend(current_items)
+                # WITH HOLD keeps the trip cursor open across the commits below
+                for rows in db.stream(conn, 'SELECT * FROM trip', batch_size=BATCH_SIZE,
+                                      name='binned_trips', withhold=True):
+                    for row in rows:
+                        processed_data.extend(trip_items(tid, row))
 
-                    tid += 1
+                        tid += 1
 
-                    if tid % 1000000 == 0:
-                        cur.executemany('''
-                            INSERT INTO items(tid, item) VALUES (%s, %s)
-                        ''', processed_data)
-                        conn.commit()
-                        processed_data = []
+                        if tid % 1000000 == 0:
+                            cur.executemany('''
+                                INSERT INTO items(tid, item) VALUES (%s, %s)
+                            ''', processed_data)
+                            conn.commit()
+                            processed_data = []
 
                 if processed_data:
                     cur.executemany('''
@@ -229,15 +255,24 @@ def prepareItems():
                     ''', processed_data)
                     conn.commit()
 
+                return tid - 1
+
     except pg.Error as e:
         print(f"Error preparing items: {e}")
         raise
 
 
-def main():
-    create_table()
-    insert_data()
-    prepareItems()
+def main(bins=None, cache=False):
+    start_run('preprocess')
+    try:
+        with stage('create_table'):
+            create_table()
+        with stage('insert_data') as insert_stage:
+            insert_stage.rows = insert_data(bins, cache)
+        with stage('prepareItems') as items_stage:
+            items_stage.rows = prepareItems()
+    finally:
+        write_report()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,232 @@
+"""
+Inverted-index store of the mined association rules, answering "which rules fire for this trip".
+
+association_rules.py writes every rule with its support, confidence and lift to
+rules_{level}.json. `RuleStore` loads them once and encodes them for matching:
+    - every item ("column:value", as in the items table) gets a bit; each rule's antecedent
+      and consequent become bitmasks of uint64 words;
+    - an inverted index maps each item to the rules whose antecedent contains it, so a
+      trip only looks at the rules that share at least one item with it;
+    - a rule fires if its antecedent is a subset of the trip: antecedent & ~trip == 0.
+Matches are ranked by confidence or lift (the other breaks ties) with precomputed ranks.
+By default only the best rule per consequent is returned, and rules whose consequent the
+trip already holds are skipped, so a partially known trip gets its most likely missing values.
+`match_batch` checks a block of trips against all rules at once with the same bitmask test.
+
+Trips are lists of items or dicts of column -> value; numeric columns are binned with the
+BINS of preprocess.py.
+
+Requirements:
+- `numpy`; `psycopg2` only for the sample trips of main().
+
+HOW TO RUN:
+1) Run association_rules.py to write rules_{level}.json.
+2) Run this File to load the rules and time matching on trips of the mining database,
+   or use RuleStore.from_files() from Python.
+"""
+
+import glob
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from itemset_mining import PROFILE
+from preprocess import BINS, bin_numeric_value, trip_items as binned_trip_items
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import db  # noqa: E402
+
+RULE_FILES = "rules_*.json"
+WORD_BITS = 64
+
+# Upper bound on the uint64 words a match_batch block holds at once (32MB)
+BATCH_WORDS = 1 << 22
+
+
+def trip_items(trip, bins=None):
+    """
+    Items of a trip in the "column:value" form of the items table
+    :param trip: iterable of items, or dict of column -> value of the mining trip table
+    :param bins: bins of the numeric columns, defaults to the BINS of preprocess.py
+    :return: list of items
+    """
+    if not isinstance(trip, dict):
+        return list(trip)
+
+    bins = bins or BINS
+    items = []
+    for column, value in trip.items():
+        if value is None:
+            continue
+        if column in bins and not isinstance(value, str):
+            value = bin_numeric_value(value, bins[column])
+        items.append(f"{column}:{value}")
+    return items
+
+
+class RuleStore:
+    def __init__(self, rules):
+        """
+        Encode rules for subset matching
+        :param rules: list of dicts with antecedent, consequent, support, confidence and lift,
+                      as written by AssociationRules.print_rules
+        """
+        self.rules = list(rules)
+        self.items = {}
+        for rule in self.rules:
+            for item in rule["antecedent"] + rule["consequent"]:
+                self.items.setdefault(item, len(self.items))
+        self.words = max(1, -(-len(self.items) // WORD_BITS))
+
+        n_rules = len(self.rules)
+        self.antecedent_masks = np.zeros((n_rules, self.words), dtype=np.uint64)
+        self.consequent_masks = np.zeros((n_rules, self.words), dtype=np.uint64)
+        postings = {}
+        consequents = {}
+        self.consequent_ids = np.zeros(n_rules, dtype=np.int64)
+        for rule_id, rule in enumerate(self.rules):
+            self.antecedent_masks[rule_id] = self.encode(rule["antecedent"])
+            self.consequent_masks[rule_id] = self.encode(rule["consequent"])
+            for item in rule["antecedent"]:
+                postings.setdefault(self.items[item], []).append(rule_id)
+            self.consequent_ids[rule_id] = consequents.setdefault(tuple(rule["consequent"]), len(consequents))
+        self.postings = {bit: np.array(rule_ids, dtype=np.int64) for bit, rule_ids in postings.items()}
+
+        confidence = np.array([rule["confidence"] for rule in self.rules], dtype=np.float64)
+        lift = np.array([rule.get("lift") or 0.0 for rule in self.rules], dtype=np.float64)
+        self.ranks = {}
+        for rank_by, keys in (("confidence", (-lift, -confidence)), ("lift", (-confidence, -lift))):
+            order = np.lexsort(keys)
+            self.ranks[rank_by] = np.empty(n_rules, dtype=np.int64)
+            self.ranks[rank_by][order] = np.arange(n_rules)
+
+    @classmethod
+    def from_files(cls, directory=".", pattern=RULE_FILES):
+        """
+        Load the rules written by association_rules.py
+        :param directory: folder holding the rule files
+        :param pattern: glob of the rule files
+        :return: RuleStore
+        """
+        rules = []
+        for path in sorted(glob.glob(os.path.join(directory, pattern))):
+            with open(path) as f:
+                rules.extend(json.load(f))
+        return cls(rules)
+
+    def encode(self, items):
+        """
+        Bitmask of a set of items; items no rule mentions are left out
+        :param items: iterable of items
+        :return: array of uint64 words
+        """
+        mask = np.zeros(self.words, dtype=np.uint64)
+        for item in items:
+            bit = self.items.get(item)
+            if bit is not None:
+                mask[bit // WORD_BITS] |= np.uint64(1 << (bit % WORD_BITS))
+        return mask
+
+    def select(self, fired, rank_by, limit, per_consequent):
+        """
+        Rank fired rules and keep the best one per consequent
+        :return: list of rule dicts
+        """
+        fired = fired[np.argsort(self.ranks[rank_by][fired])]
+        if per_consequent:
+            _, first = np.unique(self.consequent_ids[fired], return_index=True)
+            fired = fired[np.sort(first)]
+        if limit is not None:
+            fired = fired[:limit]
+        return [self.rules[rule_id] for rule_id in fired]
+
+    def match(self, trip, rank_by="confidence", limit=None, per_consequent=True, exclude_known=True):
+        """
+        Rules whose antecedent the trip contains
+        :param trip: list of items or dict of column -> value
+        :param rank_by: "confidence" or "lift"
+        :param limit: maximum number of rules returned
+        :param per_consequent: return only the best-ranked rule of each consequent
+        :param exclude_known: skip rules whose consequent the trip already contains
+        :return: list of rule dicts, best first
+        """
+        items = trip_items(trip)
+        bits = [self.items[item] for item in items if item in self.items]
+        candidate_lists = [self.postings[bit] for bit in bits if bit in self.postings]
+        if not candidate_lists:
+            return []
+
+        candidates = np.unique(np.concatenate(candidate_lists))
+        not_in_trip = ~self.encode(items)
+        fired = candidates[~np.any(self.antecedent_masks[candidates] & not_in_trip, axis=1)]
+        if exclude_known:
+            fired = fired[np.any(self.consequent_masks[fired] & not_in_trip, axis=1)]
+        return self.select(fired, rank_by, limit, per_consequent)
+
+    def match_batch(self, trips, rank_by="confidence", limit=None, per_consequent=True, exclude_known=True):
+        """
+        match() for many trips, testing each block of trips against all rules at once
+        :param trips: list of trips, each a list of items or dict of column -> value
+        :return: list with the matched rules of each trip
+        """
+        if not self.rules:
+            return [[] for _ in trips]
+
+        not_in_trips = ~np.array([self.encode(trip_items(trip)) for trip in trips], dtype=np.uint64)
+        block = max(1, BATCH_WORDS // (len(self.rules) * self.words))
+        matches = []
+        for start in range(0, len(trips), block):
+            not_in_block = not_in_trips[start:start + block, None, :]
+            fires = ~np.any(self.antecedent_masks[None, :, :] & not_in_block, axis=2)
+            if exclude_known:
+                fires &= np.any(self.consequent_masks[None, :, :] & not_in_block, axis=2)
+            for row in fires:
+                matches.append(self.select(np.flatnonzero(row), rank_by, limit, per_consequent))
+        return matches
+
+
+def main(directory=".", sample_size=10000, rank_by="confidence",
+         unknown_columns=("fareamount", "tipamount", "totalamount")):
+    """
+    Load the rules and time single and batch matching on binned trips of the mining database
+    :param directory: folder holding rules_{level}.json
+    :param sample_size: number of trips to match
+    :param rank_by: "confidence" or "lift"
+    :param unknown_columns: columns left out of each trip, which the matched rules then predict
+    """
+    store = RuleStore.from_files(directory)
+    print(f"Loaded {len(store.rules)} rules over {len(store.items)} items")
+
+    conn = db.connect(PROFILE)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM trip LIMIT %s;", (sample_size,))
+        trips = [[item for _, item in binned_trip_items(0, row) if item.split(':')[0] not in unknown_columns]
+                 for row in cursor.fetchall()]
+    finally:
+        conn.close()
+    if not trips:
+        return
+
+    started = time.perf_counter()
+    single = [store.match(trip, rank_by) for trip in trips]
+    single_ms = (time.perf_counter() - started) * 1000 / len(trips)
+
+    started = time.perf_counter()
+    batch = store.match_batch(trips, rank_by)
+    batch_ms = (time.perf_counter() - started) * 1000 / len(trips)
+
+    mismatched = [index for index, (one, many) in enumerate(zip(single, batch)) if one != many]
+    if mismatched:
+        raise RuntimeError(f"match_batch differs from match on {len(mismatched)} of {len(trips)} trips "
+                           f"(sample positions {mismatched[:10]})")
+    fired = sum(len(rules) for rules in single)
+    print(f"Matched {len(trips)} trips ({fired} consequents): {single_ms:.3f} ms/trip one at a time, "
+          f"{batch_ms:.3f} ms/trip in a batch")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+"""
+Code shared by the DataReader, phase-2 and Phase-3 scripts.
+
+The scripts are run directly (python3 Phase-3/itemset_mining.py), so they put the
+repository root on sys.path before importing from here.
+"""
@@ -0,0 +1,226 @@
+"""
+Shared PostgreSQL layer: configuration, connection pools, session tuning and
+server-side cursor helpers.
+
+Settings are read per profile. A profile is a named database the scripts talk to:
+    - `default`: the normalized trip database (phase-2, cleaning, loaders).
+    - `mining`: the binned trip and items tables of Phase-3.
+    - `mining_source`: the database preprocess.py reads trips from.
+    - `mongo_source`: the database load_to_mongo.py exports from.
+Each setting (dbname, user, password, host, port) is taken from the first of:
+    1. the environment variable DB_<PROFILE>_<SETTING>, e.g. DB_MINING_PASSWORD;
+    2. the [<profile>] section of the config file (DB_CONFIG, or db.ini at the
+       repository root, see db.example.ini);
+    3. the libpq variable PGDATABASE, PGUSER, PGPASSWORD, PGHOST or PGPORT;
+    4. the built-in DEFAULTS, which are the values the scripts used to hard-code.
+
+Connections:
+    - `connect`: one new connection, for single-threaded scripts.
+    - `connection`: a context manager that borrows from a per-profile
+      ThreadedConnectionPool and returns the connection when done. Parallel stages
+      use it, so workers reuse connections instead of opening their own; once all
+      connections of the pool are out, a borrower waits for one to come back.
+Both accept `tuning`, a dict of session settings such as BULK or ANALYTICS. Both
+return instrumented connections, so their traffic shows up in run reports.
+"""
+
+import configparser
+import os
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+from common.instrumentation import InstrumentedCursor, instrument_connection
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_FILE = os.environ.get("DB_CONFIG", os.path.join(ROOT_DIR, "db.ini"))
+
+DEFAULTS = {
+    "default": {"dbname": "project", "user": "postgres", "password": "RIT@2023",
+                "host": "localhost", "port": "5432"},
+    "mining": {"dbname": "project_v3", "user": "postgres", "password": "1234",
+               "host": "localhost", "port": "5432"},
+    "mining_source": {"dbname": "project_v1", "user": "postgres", "password": "1234",
+                      "host": "localhost", "port": "5432"},
+    "mongo_source": {"dbname": "BigDataGroupProject", "user": "postgres", "password": "postgres",
+                     "host": "localhost", "port": "5432"}
+}
+
+LIBPQ_VARIABLES = {"dbname": "PGDATABASE", "user": "PGUSER", "password": "PGPASSWORD",
+                   "host": "PGHOST", "port": "PGPORT"}
+
+# Session settings for bulk loads and rewrites: a crash can lose the last few commits,
+# which these phases can simply rerun
+BULK = {"synchronous_commit": "off", "work_mem": "256MB", "maintenance_work_mem": "1GB"}
+# Large sorts and hash aggregates of the analytical queries
+ANALYTICS = {"work_mem": "256MB"}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def settings(profile="default"):
+    """
+    Resolve the connection settings of a profile
+    :param profile: profile name
+    :return: dict of psycopg2.connect keyword arguments
+    """
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE)
+    section = config[profile] if config.has_section(profile) else {}
+
+    resolved = {}
+    for key, default in DEFAULTS.get(profile, DEFAULTS["default"]).items():
+        resolved[key] = (os.environ.get(f"DB_{profile.upper()}_{key.upper()}")
+                         or section.get(key)
+                         or os.environ.get(LIBPQ_VARIABLES[key])
+                         or default)
+    return resolved
+
+
+def apply_tuning(conn, tuning):
+    """
+    Apply session settings to a connection
+    :param conn: psycopg2 connection
+    :param tuning: dict of setting -> value, e.g. BULK
+    :return: None
+    """
+    if not tuning:
+        return
+    with conn.cursor() as cursor:
+        for name, value in tuning.items():
+            cursor.execute("SELECT set_config(%s, %s, false);", (name, str(value)))
+    conn.commit()
+
+
+def connect(profile="default", tuning=None):
+    """
+    Open a new instrumented connection
+    :param profile: profile name
+    :param tuning: optional session settings
+    :return: psycopg2 connection
+    """
+    conn = instrument_connection(psycopg2.connect(**settings(profile)))
+    apply_tuning(conn, tuning)
+    return conn
+
+
+class BlockingConnectionPool(ThreadedConnectionPool):
+    """ThreadedConnectionPool whose getconn waits for a free connection instead of raising PoolError"""
+
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self, key=None):
+        self._slots.acquire()
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._slots.release()
+
+
+def get_pool(profile="default", maxconn=8):
+    """
+    The connection pool of a profile, created on first use; borrowers beyond maxconn wait
+    :param profile: profile name
+    :param maxconn: most connections the pool opens
+    :return: BlockingConnectionPool
+    """
+    with _pools_lock:
+        if profile not in _pools:
+            _pools[profile] = BlockingConnectionPool(1, maxconn, cursor_factory=InstrumentedCursor,
+                                                     **settings(profile))
+        return _pools[profile]
+
+
+@contextmanager
+def connection(profile="default", tuning=None):
+    """
+    Borrow a pooled connection; it is rolled back and reset before it goes back to the pool
+    :param profile: profile name
+    :param tuning: optional session settings for this borrower
+    :return: psycopg2 connection
+    """
+    pool = get_pool(profile)
+    conn = pool.getconn()
+    broken = False
+    try:
+        apply_tuning(conn, tuning)
+        yield conn
+    except psycopg2.OperationalError:
+        broken = True
+        raise
+    finally:
+        if not broken and not conn.closed:
+            conn.rollback()
+            if tuning:
+                with conn.cursor() as cursor:
+                    cursor.execute("RESET ALL;")
+                conn.commit()
+        pool.putconn(conn, close=broken or bool(conn.closed))
+
+
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.closeall()
+        _pools.clear()
+
+
+def stream(conn, query, params=None, batch_size=10000, name="stream", withhold=False):
+    """
+    Run a query on a server-side cursor and yield its rows batch by batch
+    :param conn: psycopg2 connection
+    :param query: SELECT statement
+    :param params: query parameters
+    :param batch_size: rows fetched per round trip
+    :param name: cursor name, unique per connection
+    :param withhold: keep the cursor open across commits on the same connection
+    :return: generator of row lists
+    """
+    with conn.cursor(name=name, withhold=withhold) as cursor:
+        cursor.itersize = batch_size
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+
+class DatabaseConnection:
+    def __init__(self, profile="default", tuning=None):
+        """
+        Connection plus a default cursor, for scripts that work on one connection
+        :param profile: profile name, see settings()
+        :param tuning: optional session settings
+        """
+        self.profile = profile
+        self.tuning = tuning
+        self.connection = None
+        self.cursor = None
+
+    def connect(self):
+        try:
+            self.connection = connect(self.profile, self.tuning)
+            self.cursor = self.connection.cursor()
+            print("Connected to the database")
+        except psycopg2.Error as e:
+            print(f"Error connecting to the database: {e}")
+
+    def disconnect(self):
+        if self.cursor:
+            self.cursor.close()
+        if self.connection:
+            self.connection.close()
+        print("Disconnected from the database")
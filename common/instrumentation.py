@@ -0,0 +1,294 @@
+"""
+Stage timing and resource instrumentation shared by the pipeline scripts.
+
+Wrap a stage in `with stage("name") as s:` or decorate a function with `@timed()`.
+Each stage records its wall time, the rows it reports through `s.rows`, its rows per
+second, the process peak RSS and the database round trips it made. It also records
+the bytes it sent to the database: query text and COPY payloads. Nested stages
+become sub-steps named "parent/child", and a parent's counters include its children.
+
+Database traffic is counted for connections passed to `instrument_connection` (as
+every connection of common/db.py is). Every cursor of such a connection counts its execute,
+executemany, copy and fetch calls. Stages nest per thread. A worker thread's stages,
+and any traffic it makes outside them, are attributed under the stage that is open
+in the main thread.
+
+`write_report` saves the run as JSON: one record per stage, in start order.
+`compare_reports` prints the stages that slowed down between two saved runs.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+import psycopg2.extensions
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process so far
+    :return: megabytes, or None where the platform does not report it
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+    except ImportError:
+        return None
+
+
+class Stage:
+    def __init__(self, name, meta, parent=None):
+        self.name = name
+        self.parent = parent
+        self.meta = dict(meta)
+        self.rows = None
+        self.round_trips = 0
+        self.bytes_sent = 0
+        self.rows_fetched = 0
+        self.started = time.perf_counter()
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self.rss_start_mb = peak_rss_mb()
+
+    def record(self, status):
+        wall = time.perf_counter() - self.started
+        peak = peak_rss_mb()
+        return {
+            "stage": self.name,
+            "started_at": self.started_at,
+            "status": status,
+            "wall_s": round(wall, 3),
+            "rows": self.rows,
+            "rows_per_s": round(self.rows / wall, 1) if self.rows is not None and wall > 0 else None,
+            "peak_rss_mb": round(peak, 1) if peak is not None else None,
+            "peak_rss_growth_mb": round(peak - self.rss_start_mb, 1) if peak is not None else None,
+            "db_round_trips": self.round_trips,
+            "db_bytes_sent": self.bytes_sent,
+            "db_rows_fetched": self.rows_fetched,
+            **self.meta
+        }
+
+
+class RunReport:
+    def __init__(self, name):
+        """
+        Collects the stage records of one run
+        :param name: run name, used for the default report file name
+        """
+        self.name = name
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self.records = []
+        self.open_stages = {}
+        self.stages_started = 0
+        self.lock = threading.Lock()
+
+    def innermost(self):
+        """
+        :return: the calling thread's innermost open stage, else the main thread's, else None
+        """
+        for thread_id in (threading.get_ident(), threading.main_thread().ident):
+            if self.open_stages.get(thread_id):
+                return self.open_stages[thread_id][-1]
+        return None
+
+    def count(self, round_trips=0, bytes_sent=0, rows_fetched=0):
+        with self.lock:
+            open_stage = self.innermost()
+            while open_stage is not None:
+                open_stage.round_trips += round_trips
+                open_stage.bytes_sent += bytes_sent
+                open_stage.rows_fetched += rows_fetched
+                open_stage = open_stage.parent
+
+    def to_dict(self):
+        return {"run": self.name, "started_at": self.started_at, "argv": sys.argv,
+                "stages": [r for _, r in sorted(self.records, key=lambda item: item[0])]}
+
+
+_run = None
+
+
+def current_run():
+    global _run
+    if _run is None:
+        _run = RunReport(os.path.splitext(os.path.basename(sys.argv[0] or "run"))[0] or "run")
+    return _run
+
+
+def start_run(name):
+    """
+    Begin a new report, discarding any stages recorded so far
+    :param name: run name
+    :return: RunReport
+    """
+    global _run
+    _run = RunReport(name)
+    return _run
+
+
+@contextmanager
+def stage(name, **meta):
+    """
+    Record one stage; nested stages are named parent/child
+    :param name: stage name
+    :param meta: extra fields for the record, e.g. level=2; more can be set on s.meta
+    :return: Stage, whose rows and meta can be filled in inside the block
+    """
+    run = current_run()
+    with run.lock:
+        parent = run.innermost()
+        current = Stage(f"{parent.name}/{name}" if parent else name, meta, parent)
+        order = run.stages_started
+        run.stages_started += 1
+        run.open_stages.setdefault(threading.get_ident(), []).append(current)
+
+    status = "error"
+    try:
+        yield current
+        status = "ok"
+    finally:
+        with run.lock:
+            run.open_stages[threading.get_ident()].remove(current)
+            record = current.record(status)
+            run.records.append((order, record))
+        rate = f", {record['rows_per_s']:,.0f} rows/s" if record["rows_per_s"] is not None else ""
+        print(f"[{record['stage']}] {record['wall_s']:.1f}s{rate}, "
+              f"{record['db_round_trips']} round trips, peak RSS {record['peak_rss_mb']} MB")
+
+
+def timed(name=None, **meta):
+    """
+    Decorator form of stage()
+    :param name: stage name, the function name by default
+    :return: decorator
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name or function.__name__, **meta):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Cursor that counts its round trips, sent bytes and fetched rows towards the open stages"""
+
+    def execute(self, query, vars=None):
+        try:
+            return super().execute(query, vars)
+        finally:
+            current_run().count(round_trips=1, bytes_sent=len(self.query or b""))
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            # psycopg2 sends one statement per parameter set
+            current_run().count(round_trips=len(vars_list), bytes_sent=len(self.query or b"") * len(vars_list))
+
+    def copy_expert(self, sql, file, size=8192):
+        counted = CountingFile(file)
+        try:
+            return super().copy_expert(sql, counted, size)
+        finally:
+            current_run().count(round_trips=1, bytes_sent=len(sql) + counted.bytes)
+
+    def fetched(self, rows):
+        # A named cursor goes back to the server for every fetch
+        current_run().count(round_trips=1 if self.name else 0, rows_fetched=len(rows))
+        return rows
+
+    def fetchone(self):
+        row = super().fetchone()
+        self.fetched([row] if row is not None else [])
+        return row
+
+    def fetchmany(self, size=None):
+        return self.fetched(super().fetchmany(size) if size is not None else super().fetchmany())
+
+    def fetchall(self):
+        return self.fetched(super().fetchall())
+
+
+class CountingFile:
+    """File wrapper that counts the bytes COPY reads from (or writes to) it"""
+
+    def __init__(self, file):
+        self.file = file
+        self.bytes = 0
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.bytes += len(data)
+        return data
+
+    def readline(self, size=-1):
+        data = self.file.readline(size)
+        self.bytes += len(data)
+        return data
+
+    def write(self, data):
+        self.bytes += len(data)
+        return self.file.write(data)
+
+
+def instrument_connection(conn):
+    """
+    Count the database traffic of every cursor the connection creates from now on
+    :param conn: psycopg2 connection
+    :return: the same connection
+    """
+    conn.cursor_factory = InstrumentedCursor
+    return conn
+
+
+def write_report(path=None):
+    """
+    Save the current run as JSON
+    :param path: output file, <run name>_report.json by default
+    :return: path written
+    """
+    run = current_run()
+    path = path or os.environ.get("PIPELINE_REPORT") or f"{run.name}_report.json"
+    with open(path, "w") as f:
+        json.dump(run.to_dict(), f, indent=2, default=str)
+    print(f"Run report written to {path}")
+    return path
+
+
+def compare_reports(baseline_path, current_path, threshold=0.2):
+    """
+    Print the stages whose wall time grew by more than threshold between two runs
+    :param baseline_path: earlier report
+    :param current_path: later report
+    :param threshold: relative slowdown to flag, 0.2 = 20%
+    :return: list of (stage, baseline seconds, current seconds)
+    """
+    with open(baseline_path) as f:
+        baseline = {r["stage"]: r for r in json.load(f)["stages"]}
+    with open(current_path) as f:
+        current = {r["stage"]: r for r in json.load(f)["stages"]}
+
+    regressions = []
+    for name, record in current.items():
+        before = baseline.get(name)
+        if before and before["wall_s"] > 0 and record["wall_s"] > before["wall_s"] * (1 + threshold):
+            regressions.append((name, before["wall_s"], record["wall_s"]))
+            print(f"{name}: {before['wall_s']:.1f}s -> {record['wall_s']:.1f}s")
+    return regressions
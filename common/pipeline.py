@@ -0,0 +1,493 @@
+"""
+Pipeline orchestrator: runs the project's stages as a DAG and skips the ones whose
+inputs have not changed.
+
+Every stage declares the scripts it runs, its parameters, the stages it depends on,
+the external files it reads and the outputs it produces. Its cache key is a hash of
+all of these: the code, the parameters, the content of its input files and the keys
+of its upstream stages. Changing `min_conf` therefore changes the key of
+`association_rules` only, and only that stage runs again.
+
+Outputs are of two kinds:
+    - files (`outputs`): hashed after the run and stored once by content under
+      `objects/`, so a previous result is restored by linking it back instead of
+      rerunning the stage.
+    - database state (`state`): tables or collections, which exist in one version
+      only. The cache remembers the key that produced the current state; a stage
+      that rebuilds state forces its stateful dependents to rerun, and a stage that
+      rewrites an upstream stage's tables in place (`mutates`) forces that stage to
+      reload them first.
+
+Stages run in their own Python process, so independent branches (FD discovery, the
+Mongo export, mining) run concurrently and each writes its own run report.
+
+Main features:
+    - `PipelineStage`: declaration of one stage.
+    - `Pipeline.plan`: cache keys and the set of stages to run, without running anything.
+    - `Pipeline.run`: runs the planned stages in dependency order, `max_workers` at a time.
+    - `project_stages`: the DAG of this repository, from the Parquet files to the rules.
+
+HOW TO RUN:
+1) Set the database credentials in db.ini or the environment (see common/db.py), and
+   TLC_RAW_DATA / TLC_PROCESSED_DATA for the loader.
+2) Adjust the stage parameters in `main` and run this File. Set PIPELINE_CACHE to keep
+   the cache somewhere other than .pipeline_cache at the repository root.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import db, trip_cache  # noqa: E402
+from common.instrumentation import stage, start_run, write_report  # noqa: E402
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.environ.get("PIPELINE_CACHE", os.path.join(ROOT_DIR, ".pipeline_cache"))
+
+# Runs one stage in a fresh interpreter: imports the script as a module and calls its
+# entry point with the pickled parameters, or runs it as __main__ if it has none
+RUNNER = """
+import importlib, os, pickle, runpy, sys
+path, function, params_file = sys.argv[1:4]
+sys.path.insert(0, os.path.dirname(path))
+if function:
+    with open(params_file, 'rb') as f:
+        params = pickle.load(f)
+    module = importlib.import_module(os.path.splitext(os.path.basename(path))[0])
+    getattr(module, function)(**params)
+else:
+    runpy.run_path(path, run_name='__main__')
+"""
+
+
+class PipelineStage:
+    def __init__(self, name, script=None, function="main", params=None, deps=(), inputs=(), code=(),
+                 outputs=(), state=(), mutates=(), command=None, env=None):
+        """
+        Declaration of one pipeline stage
+        :param name: unique stage name
+        :param script: path of the script, relative to the repository root
+        :param function: entry point called with `params`; None runs the script as __main__
+        :param params: keyword arguments of the entry point, part of the cache key
+        :param deps: names of the stages this one needs
+        :param inputs: glob patterns of external files read by the stage, hashed by content
+        :param code: extra source files the stage depends on besides `script`
+        :param outputs: glob patterns of the files the stage writes
+        :param state: names of the tables or collections the stage (re)builds; the stage must replace
+                      them on every run (drop first), as a rerun means the old content is stale
+        :param mutates: upstream stages whose state this stage rewrites in place
+        :param command: command line to run instead of a script, e.g. psql
+        :param env: extra environment variables, or a callable returning them
+        """
+        self.name = name
+        self.script = script
+        self.function = function
+        self.params = params or {}
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+        self.code = list(code)
+        self.outputs = list(outputs)
+        self.state = list(state)
+        self.mutates = list(mutates)
+        self.command = command
+        self.env = env
+
+
+class ContentStore:
+    def __init__(self, directory):
+        """
+        Content-addressed file store plus the hash index that avoids rehashing unchanged files
+        :param directory: cache directory
+        """
+        self.directory = directory
+        self.objects = os.path.join(directory, "objects")
+        self.index_path = os.path.join(directory, "index.json")
+        self.lock = threading.Lock()
+        os.makedirs(self.objects, exist_ok=True)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+
+    def hash_file(self, path):
+        """
+        SHA-256 of a file, reused while its size and modification time are unchanged
+        :param path: file path
+        :return: hex digest
+        """
+        info = os.stat(path)
+        fingerprint = [info.st_size, info.st_mtime_ns]
+        key = os.path.abspath(path)
+        with self.lock:
+            cached = self.index.get(key)
+        if cached and cached[0] == fingerprint:
+            return cached[1]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        with self.lock:
+            self.index[key] = [fingerprint, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def object_path(self, digest):
+        return os.path.join(self.objects, digest[:2], digest)
+
+    def put(self, path):
+        """
+        Store a file by content; hard-linked when possible so large outputs are not copied
+        :param path: file path
+        :return: hex digest
+        """
+        digest = self.hash_file(path)
+        target = self.object_path(digest)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.link(path, target)
+            except OSError:
+                shutil.copy2(path, target)
+        return digest
+
+    def restore(self, path, digest):
+        """
+        Put a stored file back at its path
+        :return: True if the object was available
+        """
+        source = self.object_path(digest)
+        if not os.path.exists(source):
+            return False
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(path)
+        try:
+            os.link(source, path)
+        except OSError:
+            shutil.copy2(source, path)
+        return True
+
+    def save_index(self):
+        with self.lock:
+            with open(self.index_path, "w") as f:
+                json.dump(self.index, f)
+
+
+def expand(patterns):
+    """
+    Files matching a list of glob patterns, relative patterns taken from the repository root
+    """
+    paths = set()
+    for pattern in patterns:
+        paths.update(p for p in glob.glob(os.path.join(ROOT_DIR, pattern), recursive=True) if os.path.isfile(p))
+    return sorted(paths)
+
+
+class Pipeline:
+    def __init__(self, stages, cache_dir=CACHE_DIR, max_workers=3):
+        """
+        :param stages: list of PipelineStage
+        :param cache_dir: directory of the manifests, the object store and the stage reports
+        :param max_workers: most stages running at the same time
+        """
+        self.stages = {s.name: s for s in stages}
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.store = ContentStore(cache_dir)
+        self.order = self.topological_order()
+
+    def topological_order(self):
+        order, visiting, done = [], set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Cycle in the pipeline at stage {name}")
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage {name}")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def stage_dir(self, name):
+        path = os.path.join(self.cache_dir, "stages", name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def cache_key(self, pipeline_stage, upstream_keys):
+        """
+        Hash of everything that determines a stage's result
+        :param pipeline_stage: PipelineStage
+        :param upstream_keys: dict of dep name -> cache key
+        :return: hex digest
+        """
+        code = [pipeline_stage.script] if pipeline_stage.script else []
+        description = {
+            "name": pipeline_stage.name,
+            "function": pipeline_stage.function,
+            "command": pipeline_stage.command,
+            "params": pipeline_stage.params,
+            "code": {path: self.store.hash_file(os.path.join(ROOT_DIR, path)) for path in code + pipeline_stage.code},
+            "inputs": {os.path.relpath(path, ROOT_DIR): self.store.hash_file(path)
+                       for path in expand(pipeline_stage.inputs)},
+            "deps": {dep: upstream_keys[dep] for dep in pipeline_stage.deps}
+        }
+        encoded = json.dumps(description, sort_keys=True, default=repr)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def manifest(self, name, key):
+        path = os.path.join(self.stage_dir(name), f"{key}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def current_state(self, name):
+        path = os.path.join(self.stage_dir(name), "state")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return f.read().strip()
+
+    def set_current_state(self, name, key):
+        path = os.path.join(self.stage_dir(name), "state")
+        if key is None:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        with open(path, "w") as f:
+            f.write(key)
+
+    def is_cached(self, name, key):
+        """
+        A stage is cached if it completed with this key, its state is the current one
+        and its output files are present or can be restored from the object store
+        """
+        manifest = self.manifest(name, key)
+        if manifest is None:
+            return False
+        if self.stages[name].state and self.current_state(name) != key:
+            return False
+        for path, digest in manifest["outputs"].items():
+            full_path = os.path.join(ROOT_DIR, path)
+            if os.path.exists(full_path) and self.store.hash_file(full_path) == digest:
+                continue
+            if not self.store.restore(full_path, digest):
+                return False
+        return True
+
+    def plan(self, force=()):
+        """
+        Compute every cache key and decide which stages must run
+        :param force: stage names to run even if cached
+        :return: (dict of name -> key, set of names to run)
+        """
+        keys = {}
+        for name in self.order:
+            keys[name] = self.cache_key(self.stages[name], keys)
+
+        to_run = {name for name in self.order if name in force or not self.is_cached(name, keys[name])}
+        changed = True
+        while changed:
+            changed = False
+            for name in self.order:
+                pipeline_stage = self.stages[name]
+                if name in to_run:
+                    # Rewriting an upstream stage's tables needs a fresh copy of them
+                    additions = set(pipeline_stage.mutates)
+                else:
+                    additions = set()
+                    # Rebuilt upstream state wipes the state derived from it
+                    if pipeline_stage.state and any(dep in to_run for dep in pipeline_stage.deps):
+                        additions.add(name)
+                if not additions <= to_run:
+                    to_run |= additions
+                    changed = True
+        return keys, to_run
+
+    def environment(self, pipeline_stage, key):
+        env = dict(os.environ)
+        env["PIPELINE_REPORT"] = os.path.join(self.stage_dir(pipeline_stage.name), f"{key}.report.json")
+        extra = pipeline_stage.env() if callable(pipeline_stage.env) else pipeline_stage.env
+        env.update(extra or {})
+        return env
+
+    def execute(self, name, key):
+        """
+        Run one stage in its own process and record its outputs
+        :return: manifest dict
+        """
+        pipeline_stage = self.stages[name]
+        # Old outputs are removed, not overwritten, so stored objects linked to them stay intact
+        for path in expand(pipeline_stage.outputs):
+            os.remove(path)
+        if pipeline_stage.state:
+            self.set_current_state(name, None)
+
+        if pipeline_stage.command:
+            command = list(pipeline_stage.command)
+        else:
+            params_file = os.path.join(self.stage_dir(name), f"{key}.params")
+            with open(params_file, "wb") as f:
+                pickle.dump(pipeline_stage.params, f)
+            command = [sys.executable, "-c", RUNNER, os.path.join(ROOT_DIR, pipeline_stage.script),
+                       pipeline_stage.function or "", params_file]
+
+        with stage(name, key=key[:12]) as stage_record:
+            started = time.time()
+            subprocess.run(command, cwd=ROOT_DIR, env=self.environment(pipeline_stage, key), check=True)
+            outputs = {os.path.relpath(path, ROOT_DIR): self.store.put(path)
+                       for path in expand(pipeline_stage.outputs)}
+            stage_record.meta["outputs"] = len(outputs)
+
+        manifest = {"key": key, "params": pipeline_stage.params, "outputs": outputs,
+                    "seconds": round(time.time() - started, 3), "finished": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        with open(os.path.join(self.stage_dir(name), f"{key}.json"), "w") as f:
+            json.dump(manifest, f, indent=2, default=repr)
+        if pipeline_stage.state:
+            self.set_current_state(name, key)
+        return manifest
+
+    def run(self, targets=None, force=()):
+        """
+        Run the stages that are not cached, independent ones concurrently
+        :param targets: stage names to bring up to date, with their dependencies; None for all
+        :param force: stage names to run even if cached
+        :return: dict of stage name -> "cached", "ran", "failed" or "skipped"
+        """
+        keys, to_run = self.plan(force)
+        wanted = set(self.order)
+        if targets:
+            wanted = set()
+            pending = list(targets)
+            while pending:
+                name = pending.pop()
+                if name not in wanted:
+                    wanted.add(name)
+                    pending.extend(self.stages[name].deps)
+
+        status = {name: "cached" for name in self.order if name in wanted and name not in to_run}
+        for name in status:
+            print(f"[{name}] cached ({keys[name][:12]})")
+        remaining = [name for name in self.order if name in wanted and name in to_run]
+
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while remaining or running:
+                for name in list(remaining):
+                    deps = self.stages[name].deps
+                    if any(status.get(dep) in ("failed", "skipped") for dep in deps):
+                        status[name] = "skipped"
+                        remaining.remove(name)
+                        print(f"[{name}] skipped, an upstream stage failed")
+                    elif all(status.get(dep) in ("cached", "ran") for dep in deps):
+                        remaining.remove(name)
+                        print(f"[{name}] running ({keys[name][:12]})")
+                        running[executor.submit(self.execute, name, keys[name])] = name
+                if not running:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        future.result()
+                        status[name] = "ran"
+                    except (subprocess.CalledProcessError, OSError) as e:
+                        status[name] = "failed"
+                        print(f"[{name}] failed: {e}")
+
+        self.store.save_index()
+        return status
+
+
+def project_stages(params=None):
+    """
+    The stages of this repository, from the TLC Parquet files to the association rules
+    :param params: dict of stage name -> parameter overrides
+    :return: list of PipelineStage
+    """
+    params = params or {}
+    raw_data = os.environ.get("TLC_RAW_DATA", "raw_data")
+    processed_data = os.environ.get("TLC_PROCESSED_DATA", "C:\\Sem4\\CSCI620\\Project\\processed_data")
+
+    def stage_params(name, **defaults):
+        return {**defaults, **params.get(name, {})}
+
+    def psql_env():
+        settings = db.settings()
+        return {variable: str(settings[key]) for key, variable in db.LIBPQ_VARIABLES.items()}
+
+    return [
+        PipelineStage("load_csv", "DataReader/load_from_kaggle.py", function=None,
+                      inputs=[os.path.join(raw_data, "yellow_tripdata_*.parquet"),
+                              os.path.join(raw_data, "taxi_zone_lookup.csv")],
+                      code=["DataReader/cleaning_rules.py"],
+                      outputs=[os.path.join(processed_data, "*_info*.csv"),
+                               os.path.join(processed_data, "quarantine", "*")]),
+        # table_creation.sql drops the tables first and reads the CSVs of load_csv
+        PipelineStage("load_postgres", command=["psql", "-v", "ON_ERROR_STOP=1",
+                                                "-v", f"processed_data={processed_data}", "-f",
+                                                os.path.join(ROOT_DIR, "DataReader", "table_creation.sql")],
+                      code=["DataReader/table_creation.sql"], deps=["load_csv"], env=psql_env,
+                      state=["location", "ratecode", "payment", "vendor", "trip", "time"]),
+        PipelineStage("clean", "Phase-3/clean_data.py",
+                      params=stage_params("clean", mode="batch", batch_size=50000),
+                      deps=["load_postgres"], state=["location", "trip", "time"], mutates=["load_postgres"]),
+        PipelineStage("trip_cache", "common/trip_cache.py",
+                      params=stage_params("trip_cache", profiles=("default", "mining_source")),
+                      deps=["clean"], outputs=[os.path.join(trip_cache.CACHE_DIR, "*.arrow")]),
+        PipelineStage("functional_dependencies", "phase-2/get_functional_dependencies.py",
+                      params=stage_params("functional_dependencies", out_of_core=False, cache=True),
+                      deps=["trip_cache"], outputs=["pruned_dependencies.txt", "valid_dependencies.txt"]),
+        PipelineStage("mongo_export", "phase-2/load_to_mongo.py", params=stage_params("mongo_export", reset=True),
+                      deps=["clean"], state=["mongo:trip"]),
+        PipelineStage("preprocess", "Phase-3/preprocess.py",
+                      params=stage_params("preprocess", bins=None, cache=True),
+                      deps=["trip_cache"], state=["mining:trip", "mining:items"]),
+        PipelineStage("itemset_mining", "Phase-3/itemset_mining.py",
+                      params=stage_params("itemset_mining", min_support=1000, num_partitions=1,
+                                          sample_fraction=None),
+                      deps=["preprocess"], state=["mining:l*"]),
+        PipelineStage("association_rules", "Phase-3/association_rules.py", code=["Phase-3/itemset_mining.py"],
+                      params=stage_params("association_rules", min_sup=None, min_conf=None, sample_fraction=None),
+                      deps=["itemset_mining"], outputs=["rules_*.txt", "rules_*.json"])
+    ]
+
+
+def main(params=None, targets=None, force=(), max_workers=3):
+    """
+    :param params: dict of stage name -> parameter overrides, e.g.
+                   {"association_rules": {"min_conf": {2: 0.9, 3: 0.9, 4: 0.9}}}
+    :param targets: stages to bring up to date; None for the whole pipeline
+    :param force: stages to rerun even if cached
+    :param max_workers: stages running concurrently
+    """
+    start_run("pipeline")
+    try:
+        pipeline = Pipeline(project_stages(params), max_workers=max_workers)
+        status = pipeline.run(targets, force)
+        print("Pipeline: " + ", ".join(f"{name} {result}" for name, result in status.items()))
+    finally:
+        write_report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+Columnar on-disk cache of the cleaned trips, shared by the Python stages.
+
+FD discovery and preprocess.py used to pull the trip table through psycopg2 tuples
+one row at a time, each paying a full table transfer. Here the trip table joined with
+its time row is exported once with `COPY ... TO STDOUT`, and the CSV stream is converted
+as it arrives to an uncompressed Arrow IPC (Feather v2) file. Consumers memory-map that file, so opening it is zero-copy
+and takes seconds whatever the table size.
+
+The file carries a version stamp in its schema metadata: the cache format, the export
+query and, per source table, its relfilenode, its insert/update/delete counters and its
+size. Computing the stamp reads only the catalog and the statistics views. A consumer
+compares it with the live stamp and re-exports when they differ, so a reload, a
+cleaning run or a TRUNCATE invalidates the cache. The statistics counters may lag a
+committed write by up to a second.
+
+One file is kept per database (host, port, dbname), so profiles pointing at the same
+database share it. The file is written under a temporary name and renamed, so readers
+never see a partial export.
+
+Functions:
+    - `open_trips`: the cached table of a profile, re-exported first if stale.
+    - `iter_rows`: row tuples in batches, for consumers written against cursor rows.
+    - `trip_columns`: the columns that come from the trip table, in table order.
+
+Requirements:
+- `psycopg2` and `pyarrow`.
+
+HOW TO RUN:
+Run this File to refresh the cache ahead of the stages; they refresh it on their own otherwise.
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+
+import psycopg2
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import db  # noqa: E402
+from common.instrumentation import stage, start_run, write_report  # noqa: E402
+
+CACHE_DIR = os.environ.get("TRIP_CACHE_DIR", os.path.join(db.ROOT_DIR, "trip_cache"))
+
+# Bump when the file layout or the type mapping changes
+FORMAT_VERSION = 1
+METADATA_KEY = b"trip_cache"
+
+SOURCE_TABLES = ("trip", "time")
+TIME_COLUMNS = ["pickupdate", "pickuptime", "dropoffdate", "dropofftime", "dayofweek", "isweekend"]
+TRIP_QUERY = f"""
+    SELECT tr.*, {', '.join(f't.{column}' for column in TIME_COLUMNS)}
+    FROM trip tr
+    LEFT JOIN time t ON t.tripid = tr.id
+    ORDER BY tr.id
+"""
+
+# Postgres type OID -> Arrow type; NUMERIC amounts become float64
+ARROW_TYPES = {
+    16: pa.bool_(),
+    20: pa.int64(),
+    21: pa.int16(),
+    23: pa.int32(),
+    25: pa.string(),
+    700: pa.float32(),
+    701: pa.float64(),
+    1042: pa.string(),
+    1043: pa.string(),
+    1082: pa.date32(),
+    1083: pa.time64("us"),
+    1114: pa.timestamp("us"),
+    1700: pa.float64()
+}
+
+
+def source_stamp(cursor):
+    """
+    Version stamp of the source tables, from the catalog and statistics only
+    :param cursor: cursor on the source database
+    :return: dict of table -> stamp string, None for a missing table
+    """
+    stamps = {}
+    for table in SOURCE_TABLES:
+        # pg_partition_tree also covers a partitioned trip table (partition_loader.py)
+        cursor.execute("""
+            SELECT string_agg(c.relfilenode || ':' || COALESCE(s.n_tup_ins, 0) || ':' ||
+                              COALESCE(s.n_tup_upd, 0) || ':' || COALESCE(s.n_tup_del, 0) || ':' ||
+                              pg_relation_size(c.oid), ',' ORDER BY c.oid)
+            FROM pg_partition_tree(to_regclass(%s)) p
+            JOIN pg_class c ON c.oid = p.relid
+            LEFT JOIN pg_stat_all_tables s ON s.relid = c.oid;
+        """, (table,))
+        stamps[table] = cursor.fetchone()[0]
+    return stamps
+
+
+def cache_path(profile="default", cache_dir=CACHE_DIR):
+    settings = db.settings(profile)
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", f"{settings['dbname']}@{settings['host']}_{settings['port']}")
+    return os.path.join(cache_dir, f"{name}.arrow")
+
+
+def read_metadata(path):
+    """
+    :return: metadata dict stored in the cache file, or None if there is no readable file
+    """
+    try:
+        with pa.memory_map(path, "r") as source:
+            schema = pa.ipc.open_file(source).schema
+    except (OSError, pa.ArrowInvalid):
+        return None
+    metadata = schema.metadata or {}
+    return json.loads(metadata[METADATA_KEY]) if METADATA_KEY in metadata else None
+
+
+def copy_to_pipe(cursor, query, pipe, errors):
+    """
+    Run COPY ... TO STDOUT into the write end of a pipe, then close it
+    :param errors: list that receives the exception if the COPY fails
+    """
+    try:
+        with os.fdopen(pipe, "wb") as sink:
+            cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", sink)
+    except (OSError, psycopg2.Error) as e:
+        errors.append(e)
+
+
+def export(profile="default", cache_dir=CACHE_DIR):
+    """
+    Export the trips of a profile's database into the cache
+    :return: path of the cache file
+    """
+    path = cache_path(profile, cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    arrow_path = f"{path}.tmp"
+
+    conn = db.connect(profile)
+    try:
+        cursor = conn.cursor()
+        # Taken before the export: a write during it leaves a stale stamp and the next open re-exports
+        stamp = source_stamp(cursor)
+
+        cursor.execute(f"SELECT * FROM ({TRIP_QUERY}) q LIMIT 0;")
+        column_types = {desc[0]: ARROW_TYPES.get(desc[1], pa.string()) for desc in cursor.description}
+        cursor.execute("SELECT * FROM trip LIMIT 0;")
+        trip_columns = [desc[0] for desc in cursor.description]
+
+        metadata = {"format": FORMAT_VERSION, "query": TRIP_QUERY, "stamp": stamp, "trip_columns": trip_columns}
+        schema = pa.schema([(name, arrow_type) for name, arrow_type in column_types.items()],
+                           metadata={METADATA_KEY: json.dumps(metadata)})
+
+        with stage("export", profile=profile) as export_stage:
+            # The COPY stream is parsed as it arrives, so no CSV copy of the table is written to disk
+            read_end, write_end = os.pipe()
+            errors = []
+            copier = threading.Thread(target=copy_to_pipe, args=(cursor, TRIP_QUERY, write_end, errors))
+            copier.start()
+            rows = 0
+            try:
+                with os.fdopen(read_end, "rb") as source:
+                    # COPY writes NULL as an empty field and an empty string as ""
+                    reader = pa_csv.open_csv(source,
+                                             read_options=pa_csv.ReadOptions(block_size=64 << 20),
+                                             convert_options=pa_csv.ConvertOptions(
+                                                 column_types=column_types, true_values=["t"], false_values=["f"],
+                                                 strings_can_be_null=True, quoted_strings_can_be_null=False))
+                    with pa.OSFile(arrow_path, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+                        for batch in reader:
+                            writer.write_batch(pa.record_batch(batch.columns, schema=schema))
+                            rows += batch.num_rows
+            finally:
+                # Closing the read end on a failure unblocks the COPY with a broken pipe
+                copier.join()
+            if errors:
+                raise errors[0]
+            conn.commit()
+            export_stage.rows = rows
+    except BaseException:
+        if os.path.exists(arrow_path):
+            os.remove(arrow_path)
+        raise
+    finally:
+        conn.close()
+
+    os.replace(arrow_path, path)
+    print(f"Cached {rows} trips in {path}")
+    return path
+
+
+def is_current(profile="default", cache_dir=CACHE_DIR):
+    metadata = read_metadata(cache_path(profile, cache_dir))
+    if metadata is None or metadata["format"] != FORMAT_VERSION or metadata["query"] != TRIP_QUERY:
+        return False
+    conn = db.connect(profile)
+    try:
+        current = source_stamp(conn.cursor())
+    finally:
+        conn.close()
+    return metadata["stamp"] == current
+
+
+def open_trips(profile="default", cache_dir=CACHE_DIR, refresh=True):
+    """
+    Memory-map the cached trips of a profile's database
+    :param profile: database profile, see common/db.py
+    :param cache_dir: directory holding the cache files
+    :param refresh: re-export a missing or stale cache; otherwise raise
+    :return: pyarrow.Table backed by the mapped file
+    """
+    path = cache_path(profile, cache_dir)
+    if not is_current(profile, cache_dir):
+        if not refresh:
+            raise RuntimeError(f"Trip cache {path} is missing or stale; run common/trip_cache.py")
+        export(profile, cache_dir)
+
+    source = pa.memory_map(path, "r")
+    return pa.ipc.open_file(source).read_all()
+
+
+def trip_columns(table):
+    return json.loads(table.schema.metadata[METADATA_KEY])["trip_columns"]
+
+
+def iter_rows(table, columns=None, batch_size=100000):
+    """
+    Yield the cached rows as tuples, batch by batch
+    :param table: table returned by open_trips
+    :param columns: columns in tuple order, defaults to the trip columns
+    :param batch_size: rows per batch
+    :return: generator of row lists
+    """
+    table = table.select(columns or trip_columns(table))
+    for batch in table.to_batches(max_chunksize=batch_size):
+        yield list(zip(*(column.to_pylist() for column in batch.columns)))
+
+
+def main(profiles=("default",), cache_dir=CACHE_DIR):
+    """
+    :param profiles: profiles whose databases are cached; profiles of one database share a file
+    :param cache_dir: directory holding the cache files
+    """
+    start_run("trip_cache")
+    try:
+        for profile in profiles:
+            if is_current(profile, cache_dir):
+                print(f"Trip cache of {profile} is current")
+            else:
+                export(profile, cache_dir)
+    finally:
+        write_report()
+
+
+if __name__ == "__main__":
+    main()
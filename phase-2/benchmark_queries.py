@@ -0,0 +1,315 @@
+"""
+Benchmark runner for the phase-2 SQL workload.
+
+`indexes.sql` records which indexes "Worked" without any timings. This
+script measures them. For every query in the workload files it runs
+warm-up passes, then repeated timed runs, and captures one
+`EXPLAIN (ANALYZE, BUFFERS)` plan. It reruns each query with every
+candidate index from `indexes.sql` applied and writes a comparison report.
+
+Main features of the script include:
+
+Function `load_workload`:
+    - Splits a .sql file into named statements, using the comment above each query as its label.
+Function `load_index_sets`:
+    - Reads the "Tried" indexes of each numbered section of `indexes.sql`.
+Function `create_sample_schema`:
+    - Copies a TABLESAMPLE of trip, the matching time rows and the dimension
+      tables into a separate schema, so the workload can run on a laptop-sized dataset.
+Class `QueryBenchmark`:
+    - `measure`: warm-up, timed runs, latency percentiles and the EXPLAIN plan summary.
+    - `run`: baseline plus one variant per candidate index set. Each variant
+      builds its indexes inside a transaction that is rolled back afterwards,
+      so no experiment leaves an index behind.
+    - `write_report`: JSON report plus a printed comparison table.
+
+Requirements:
+- `psycopg2` library for PostgreSQL connection handling.
+
+HOW TO RUN:
+1) Set the database credentials in db.ini or the environment (see common/db.py).
+2) Optionally set a sample fraction in main() to benchmark a sampled copy.
+3) Run this File; the report is written to benchmark_report.json.
+"""
+
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import db  # noqa: E402
+
+PHASE2_DIR = os.path.dirname(os.path.abspath(__file__))
+WORKLOAD_FILES = [
+    os.path.join(PHASE2_DIR, "final_queries.sql"),
+    os.path.join(PHASE2_DIR, "..", "Queries.sql")
+]
+INDEX_FILE = os.path.join(PHASE2_DIR, "indexes.sql")
+
+
+def load_workload(path):
+    """
+    Split a SQL file into its statements
+    :param path: path to the .sql file
+    :return: list of dicts with name, number (from a '--N.' label, else None) and sql
+    """
+    statements = []
+    comment, lines = None, []
+    prefix = os.path.splitext(os.path.basename(path))[0]
+
+    with open(path) as f:
+        for line in f:
+            stripped = line.strip()
+            if not lines and stripped.startswith("--"):
+                comment = stripped.lstrip("-").strip()
+                continue
+            if not lines and not stripped:
+                continue
+
+            lines.append(line.rstrip())
+            if stripped.split("--")[0].rstrip().endswith(";"):
+                match = re.match(r"(\d+)\.", comment or "")
+                statements.append({
+                    "name": f"{prefix}:{len(statements) + 1}",
+                    "number": int(match.group(1)) if match else None,
+                    "description": comment,
+                    "sql": "\n".join(lines)
+                })
+                comment, lines = None, []
+
+    return statements
+
+
+def load_index_sets(path=INDEX_FILE):
+    """
+    Collect the candidate indexes tried for each numbered query
+    :param path: path to indexes.sql
+    :return: dict of query number -> list of CREATE INDEX statements
+    """
+    index_sets = {}
+    number, tried = None, False
+
+    with open(path) as f:
+        for line in f:
+            stripped = line.strip()
+            section = re.match(r"--\s*(\d+)\.", stripped)
+            if section:
+                number, tried = int(section.group(1)), False
+            elif stripped.lower().startswith("--"):
+                tried = "tried" in stripped.lower()
+            elif tried and number is not None and stripped.lower().startswith("create index"):
+                statements = index_sets.setdefault(number, [])
+                if stripped not in statements:
+                    statements.append(stripped)
+
+    return index_sets
+
+
+def create_sample_schema(conn, fraction, schema="bench", seed=42):
+    """
+    Build a sampled copy of the schema for benchmarking
+    :param conn: psycopg2 connection
+    :param fraction: fraction of trips to keep, e.g. 0.01
+    :param schema: name of the schema to (re)create
+    :param seed: REPEATABLE seed for TABLESAMPLE
+    :return: None
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE;")
+    cursor.execute(f"CREATE SCHEMA {schema};")
+    cursor.execute(f"""
+        CREATE TABLE {schema}.trip AS
+        SELECT * FROM public.trip TABLESAMPLE BERNOULLI (%s) REPEATABLE (%s);
+    """, (fraction * 100, seed))
+    cursor.execute(f"ALTER TABLE {schema}.trip ADD PRIMARY KEY (id);")
+    cursor.execute(f"""
+        CREATE TABLE {schema}.time AS
+        SELECT t.* FROM public.time t JOIN {schema}.trip tr ON tr.id = t.tripid;
+    """)
+    for table in ["location", "payment", "ratecode", "vendor"]:
+        cursor.execute(f"CREATE TABLE {schema}.{table} AS SELECT * FROM public.{table};")
+        cursor.execute(f"ALTER TABLE {schema}.{table} ADD PRIMARY KEY (id);")
+    cursor.execute(f"ANALYZE {schema}.trip; ANALYZE {schema}.time;")
+    conn.commit()
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def summarize_plan(plan):
+    """
+    Pull the headline numbers out of an EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) result
+    :param plan: parsed JSON plan
+    :return: dict of planning/execution time, buffer counts and the root node type
+    """
+    root = plan[0]
+    node = root["Plan"]
+    return {
+        "planning_ms": root.get("Planning Time"),
+        "execution_ms": root.get("Execution Time"),
+        "shared_hit_blocks": node.get("Shared Hit Blocks"),
+        "shared_read_blocks": node.get("Shared Read Blocks"),
+        "temp_written_blocks": node.get("Temp Written Blocks"),
+        "root_node": node.get("Node Type")
+    }
+
+
+class QueryBenchmark:
+    def __init__(self, db_connection, runs=5, warmup=1, statement_timeout_ms=None, search_path=None):
+        """
+        Time the workload with and without candidate indexes
+        :param db_connection: psycopg2 connection
+        :param runs: timed executions per query and variant
+        :param warmup: untimed executions before the timed ones
+        :param statement_timeout_ms: optional cap on each execution
+        :param search_path: schema to run in, e.g. the sampled 'bench' schema
+        """
+        self.conn = db_connection
+        self.runs = runs
+        self.warmup = warmup
+        self.statement_timeout_ms = statement_timeout_ms
+        self.search_path = search_path
+        self.results = []
+
+    def prepare_session(self, cursor):
+        if self.search_path:
+            cursor.execute(f"SET search_path TO {self.search_path};")
+        if self.statement_timeout_ms:
+            cursor.execute("SET statement_timeout = %s;", (self.statement_timeout_ms,))
+
+    def measure(self, cursor, sql):
+        """
+        Warm up, time and explain one statement on an open cursor
+        :param cursor: cursor inside the variant's transaction
+        :param sql: statement to measure
+        :return: dict of latency statistics and the plan summary
+        """
+        for _ in range(self.warmup):
+            cursor.execute(sql)
+            cursor.fetchall()
+
+        latencies = []
+        for _ in range(self.runs):
+            start = time.perf_counter()
+            cursor.execute(sql)
+            cursor.fetchall()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql.rstrip().rstrip(';')}")
+        plan = cursor.fetchone()[0]
+
+        return {
+            "runs": self.runs,
+            "min_ms": min(latencies),
+            "mean_ms": statistics.mean(latencies),
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "plan": summarize_plan(plan)
+        }
+
+    def run_variant(self, query, variant, indexes):
+        """
+        Measure a query with a set of indexes built inside a transaction that is then rolled back
+        :param query: statement dict from load_workload
+        :param variant: label of the variant
+        :param indexes: CREATE INDEX statements to apply first
+        :return: result dict
+        """
+        result = {"query": query["name"], "description": query["description"], "variant": variant,
+                  "indexes": indexes}
+        cursor = self.conn.cursor()
+        try:
+            self.prepare_session(cursor)
+            start = time.perf_counter()
+            for statement in indexes:
+                cursor.execute(statement)
+            if indexes:
+                cursor.execute("ANALYZE trip; ANALYZE time; ANALYZE location;")
+            result["index_build_ms"] = (time.perf_counter() - start) * 1000
+            result.update(self.measure(cursor, query["sql"]))
+        except psycopg2.Error as e:
+            result["error"] = str(e).strip()
+        finally:
+            self.conn.rollback()
+
+        self.results.append(result)
+        return result
+
+    def run(self, workload, index_sets=None):
+        """
+        Benchmark every query: baseline first, then each candidate index on its own
+        :param workload: list of statement dicts from load_workload
+        :param index_sets: dict of query number -> CREATE INDEX statements
+        :return: list of result dicts
+        """
+        index_sets = index_sets or {}
+        for query in workload:
+            print(f"Benchmarking {query['name']}: {query['description']}")
+            baseline = self.run_variant(query, "baseline", [])
+            if "error" in baseline:
+                print(f"  failed: {baseline['error']}")
+                continue
+
+            candidates = index_sets.get(query["number"], [])
+            for statement in candidates:
+                name = re.search(r"create index (\w+)", statement, re.IGNORECASE).group(1)
+                self.run_variant(query, name, [statement])
+            if len(candidates) > 1:
+                self.run_variant(query, "all tried", candidates)
+
+        return self.results
+
+    def write_report(self, path="benchmark_report.json"):
+        """
+        Write the results as JSON and print a comparison against each baseline
+        :param path: output file
+        :return: None
+        """
+        with open(path, "w") as f:
+            json.dump(self.results, f, indent=2, default=str)
+
+        baselines = {r["query"]: r for r in self.results if r["variant"] == "baseline" and "error" not in r}
+        print(f"{'query':<20} {'variant':<36} {'p50 ms':>10} {'p95 ms':>10} {'speedup':>8}")
+        for r in self.results:
+            if "error" in r:
+                print(f"{r['query']:<20} {r['variant']:<36} {'error':>10}")
+                continue
+            baseline = baselines.get(r["query"])
+            speedup = baseline["p50_ms"] / r["p50_ms"] if baseline and r["p50_ms"] else 0
+            print(f"{r['query']:<20} {r['variant']:<36} {r['p50_ms']:>10.1f} {r['p95_ms']:>10.1f} "
+                  f"{speedup:>7.2f}x")
+        print(f"Report written to {path}")
+
+
+def main(sample_fraction=None, runs=5, warmup=1, report_path="benchmark_report.json"):
+    conn = db.connect()
+    try:
+        search_path = None
+        if sample_fraction:
+            create_sample_schema(conn, sample_fraction)
+            search_path = "bench"
+
+        workload = []
+        for path in WORKLOAD_FILES:
+            workload.extend(load_workload(path))
+
+        # Only final_queries.sql numbers its queries, matching the sections of indexes.sql
+        benchmark = QueryBenchmark(conn, runs=runs, warmup=warmup, search_path=search_path)
+        benchmark.run(workload, load_index_sets())
+        benchmark.write_report(report_path)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
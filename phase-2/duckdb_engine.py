@@ -0,0 +1,317 @@
+"""
+Embedded columnar engine for the phase-2 queries.
+
+Runs `final_queries.sql` and `Queries.sql` unchanged with DuckDB, directly over the
+monthly TLC Parquet files that load_from_kaggle.py reads. No database server is needed.
+Views named trip, time, location, payment, ratecode and vendor present the same columns
+as the PostgreSQL schema. DuckDB scans the Parquet files on all cores and reads only the
+columns each query uses.
+
+The views reproduce what the loader stores:
+    - the cleaning rules of DataReader/cleaning_rules.py, with duplicate zones remapped
+      onto their lowest ID and 'N/A'-style zone values treated as NULL like pandas does;
+    - the loader writes trip amounts with float_format='%.0f', so Postgres holds them
+      rounded half-to-even to whole numbers. `round_amounts=True` does the same for the
+      parity check; set it to False for the exact amounts.
+Trip IDs are (file number << 32) + row number. They are not the Postgres IDs, but trip
+and time agree on them, which is all the queries need.
+
+Class `DuckDBEngine`:
+    - `create_views`: registers the schema over the Parquet files and the zone lookup.
+    - `run`: executes a statement and returns its rows and wall time.
+Function `parity_check`:
+    - Runs every workload statement on DuckDB and on Postgres and compares the results
+      as multisets, with a relative tolerance for numeric values.
+
+Requirements:
+- `duckdb` library.
+- `psycopg2` for the parity check.
+
+HOW TO RUN:
+1) Point TLC_RAW_DATA (default raw_data) at the folder with the yellow_tripdata_*.parquet files and the zone lookup.
+2) Run this File to time the workload; call main(parity=True) to compare with Postgres.
+"""
+
+import datetime
+import decimal
+import glob
+import math
+import os
+import sys
+import time
+
+import duckdb
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmark_queries import WORKLOAD_FILES, load_workload  # noqa: E402
+from common import db  # noqa: E402
+
+# Raw TLC files, as read by load_from_kaggle.py; TLC_RAW_DATA points at the output of synthetic_tlc.py
+RAW_DATA = os.environ.get("TLC_RAW_DATA", "raw_data")
+# The months load_from_kaggle.py loads
+PARQUET_PATTERN = "yellow_tripdata_2023-*.parquet"
+ZONE_LOOKUP = "taxi_zone_lookup.csv"
+
+# pandas' default NA strings, so the zone lookup reads the way the loader sees it
+PANDAS_NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+                    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+# Lookup tables as load_from_kaggle.py and table_creation.sql create them
+LOOKUPS = {
+    "ratecode": [(1, 'Standard rate'), (2, 'JFK'), (3, 'Newark'), (4, 'Nassau or Westchester'),
+                 (5, 'Negotiated fare'), (6, 'Group ride'), (99, 'unknown')],
+    "payment": [(1, 'Credit card'), (2, 'Cash'), (3, 'No charge'), (4, 'Dispute'), (5, 'Unknown'),
+                (6, 'Voided trip')],
+    "vendor": [(1, 'Creative Mobile Technologies, LLC'), (2, 'VeriFone Inc.')]
+}
+
+# Trip columns in the order of table_creation.sql; "amount" columns go through the loader's rounding
+TRIP_COLUMNS = [
+    ("passengercount", "passenger_count::INT"),
+    ("tripdistance", "amount:trip_distance"),
+    ("storeandfwdflag", "store_and_fwd_flag"),
+    ("fareamount", "amount:fare_amount"),
+    ("extra", "amount:extra"),
+    ("mtatax", "amount:mta_tax"),
+    ("improvementsurcharge", "trunc(improvement_surcharge)::INT"),
+    ("tipamount", "amount:tip_amount"),
+    ("tollsamount", "amount:tolls_amount"),
+    ("totalamount", "amount:total_amount"),
+    ("congestionsurcharge", "amount:congestion_surcharge"),
+    ("airportfee", "amount:airport_fee"),
+    ("vendor", "VendorID::INT"),
+    ("paymenttype", "payment_type::INT"),
+    ("ratecode", "RatecodeID::INT"),
+    ("pickuplocation", "pickuplocation::INT"),
+    ("dropofflocation", "dropofflocation::INT")
+]
+
+
+def sql_literal(value):
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+
+class DuckDBEngine:
+    def __init__(self, parquet_files, zone_lookup, database=":memory:", threads=None, round_amounts=True,
+                 materialize=False):
+        """
+        Query the Parquet files through the phase-2 schema
+        :param parquet_files: monthly yellow_tripdata Parquet files
+        :param zone_lookup: taxi_zone_lookup.csv
+        :param database: DuckDB database file, in memory by default
+        :param threads: scan threads, all cores by default
+        :param round_amounts: round amounts to whole numbers as the loader's CSVs do
+        :param materialize: store trip and time as DuckDB tables instead of views over the files
+        """
+        self.parquet_files = sorted(parquet_files)
+        self.zone_lookup = zone_lookup
+        self.round_amounts = round_amounts
+        self.materialize = materialize
+        self.conn = duckdb.connect(database)
+        if threads:
+            self.conn.execute(f"SET threads TO {int(threads)};")
+
+    def trip_source(self):
+        """
+        One SELECT over all files with a file-qualified row ID and the cleaning rules applied
+        :return: SQL text
+        """
+        scans = [
+            f"SELECT ({i}::BIGINT << 32) + file_row_number AS id, * "
+            f"FROM read_parquet({sql_literal(path)}, file_row_number = true)"
+            for i, path in enumerate(self.parquet_files)
+        ]
+        # Mirrors TRIP_RULES; the NOT COALESCE(...) keeps NULLs the way pandas comparisons do
+        return f"""
+            SELECT r.*,
+                   COALESCE(pu.keep_id, r.PULocationID) AS pickuplocation,
+                   COALESCE(dl.keep_id, r.DOLocationID) AS dropofflocation
+            FROM ({' UNION ALL BY NAME '.join(scans)}) r
+            LEFT JOIN location_remap pu ON pu.id = r.PULocationID
+            LEFT JOIN location_remap dl ON dl.id = r.DOLocationID
+            WHERE r.tpep_pickup_datetime IS NOT NULL AND r.tpep_dropoff_datetime IS NOT NULL
+              AND r.passenger_count IS NOT NULL AND r.improvement_surcharge IS NOT NULL
+              AND r.VendorID IS NOT NULL AND r.payment_type IS NOT NULL AND r.RatecodeID IS NOT NULL
+              AND r.PULocationID IS NOT NULL AND r.DOLocationID IS NOT NULL
+              AND NOT COALESCE(r.tpep_dropoff_datetime < r.tpep_pickup_datetime, false)
+              AND NOT COALESCE(r.passenger_count < 1, false)
+              AND NOT COALESCE(r.trip_distance < 0 OR r.fare_amount < 0, false)
+              AND COALESCE(pu.keep_id, r.PULocationID) IN (SELECT id FROM location)
+              AND COALESCE(dl.keep_id, r.DOLocationID) IN (SELECT id FROM location)
+        """
+
+    def create_views(self):
+        """
+        Register location, the lookups, trip and time
+        :return: None
+        """
+        na_values = ", ".join(sql_literal(v) for v in PANDAS_NA_VALUES)
+        self.conn.execute(f"""
+            CREATE OR REPLACE TABLE zone_lookup AS
+            SELECT LocationID AS id, Borough AS borough, Zone AS zone
+            FROM read_csv({sql_literal(self.zone_lookup)}, header = true, nullstr = [{na_values}]);
+        """)
+        self.conn.execute("""
+            CREATE OR REPLACE TABLE location_remap AS
+            SELECT id, keep_id FROM (
+                SELECT id, MIN(id) OVER (PARTITION BY borough, zone) AS keep_id
+                FROM zone_lookup WHERE borough IS NOT NULL AND zone IS NOT NULL
+            ) WHERE id <> keep_id;
+        """)
+        self.conn.execute("""
+            CREATE OR REPLACE TABLE location AS
+            SELECT id, borough, zone FROM zone_lookup
+            WHERE borough IS NOT NULL AND zone IS NOT NULL
+            AND id NOT IN (SELECT id FROM location_remap);
+        """)
+        for table, rows in LOOKUPS.items():
+            name = "name" if table == "vendor" else "description"
+            values = ", ".join(f"({key}, {sql_literal(text)})" for key, text in rows)
+            self.conn.execute(f"CREATE OR REPLACE TABLE {table} AS "
+                              f"SELECT * FROM (VALUES {values}) v(id, {name});")
+
+        amount = "round_even({0}, 0)::DOUBLE" if self.round_amounts else "{0}::DOUBLE"
+        columns = ",\n".join(
+            f"{amount.format(source[len('amount:'):]) if source.startswith('amount:') else source} AS {name}"
+            for name, source in TRIP_COLUMNS)
+        kind = "TABLE" if self.materialize else "VIEW"
+        self.conn.execute(f"CREATE OR REPLACE {kind} trip_source AS {self.trip_source()};")
+        self.conn.execute(f"""
+            CREATE OR REPLACE {kind} trip AS
+            SELECT id,
+                   {columns}
+            FROM trip_source;
+        """)
+        # pandas dayofweek counts from Monday = 0
+        self.conn.execute(f"""
+            CREATE OR REPLACE {kind} time AS
+            SELECT id AS tripid,
+                   tpep_pickup_datetime::DATE AS pickupdate,
+                   tpep_pickup_datetime::TIME AS pickuptime,
+                   tpep_dropoff_datetime::DATE AS dropoffdate,
+                   tpep_dropoff_datetime::TIME AS dropofftime,
+                   isodow(tpep_pickup_datetime) - 1 AS dayofweek,
+                   isodow(tpep_pickup_datetime) >= 6 AS isweekend
+            FROM trip_source;
+        """)
+
+    def run(self, sql):
+        """
+        Execute one statement
+        :param sql: statement text
+        :return: (rows, elapsed milliseconds)
+        """
+        start = time.perf_counter()
+        rows = self.conn.execute(sql).fetchall()
+        return rows, (time.perf_counter() - start) * 1000
+
+
+def normalize(value):
+    """
+    Bring a value from either engine to a comparable form
+    :param value: column value
+    :return: float for numbers, ISO date for date_trunc results, the value otherwise
+    """
+    if isinstance(value, (decimal.Decimal, float, int)) and not isinstance(value, bool):
+        return float(value)
+    # Postgres' date_trunc on a date returns a timestamptz, DuckDB's a timestamp
+    if isinstance(value, datetime.datetime):
+        return value.date().isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+
+def rows_match(left, right, rel_tol=1e-6):
+    """
+    Compare two result sets as multisets, ignoring order between tied rows
+    :param left: rows from one engine
+    :param right: rows from the other
+    :param rel_tol: relative tolerance for numeric values
+    :return: True when every row has a matching counterpart
+    """
+    if len(left) != len(right):
+        return False
+
+    def key(row):
+        return tuple((0, round(v, 2), "") if isinstance(v, float) else (1, 0, str(v)) for v in row)
+
+    left = sorted((tuple(normalize(v) for v in row) for row in left), key=key)
+    right = sorted((tuple(normalize(v) for v in row) for row in right), key=key)
+    for a, b in zip(left, right):
+        for x, y in zip(a, b):
+            if isinstance(x, float) and isinstance(y, float):
+                if not math.isclose(x, y, rel_tol=rel_tol, abs_tol=1e-6):
+                    return False
+            elif x != y:
+                return False
+    return True
+
+
+def parity_check(engine, pg_conn, workload):
+    """
+    Run each statement on both engines and compare the answers
+    :param engine: DuckDBEngine with its views created
+    :param pg_conn: psycopg2 connection to the loaded database
+    :param workload: statement dicts from load_workload
+    :return: list of result dicts
+    """
+    results = []
+    cursor = pg_conn.cursor()
+    for query in workload:
+        result = {"query": query["name"], "description": query["description"]}
+        try:
+            duck_rows, result["duckdb_ms"] = engine.run(query["sql"])
+        except duckdb.Error as e:
+            result["duckdb_error"] = str(e).strip()
+            duck_rows = None
+
+        start = time.perf_counter()
+        try:
+            cursor.execute(query["sql"])
+            pg_rows = cursor.fetchall()
+            result["postgres_ms"] = (time.perf_counter() - start) * 1000
+        except Exception as e:
+            pg_conn.rollback()
+            result["postgres_error"] = str(e).strip()
+            pg_rows = None
+
+        if duck_rows is not None and pg_rows is not None:
+            result["match"] = rows_match(duck_rows, pg_rows)
+        results.append(result)
+
+        status = "match" if result.get("match") else "MISMATCH" if "match" in result else "error"
+        print(f"{query['name']:<20} duckdb {result.get('duckdb_ms', float('nan')):>10.1f} ms   "
+              f"postgres {result.get('postgres_ms', float('nan')):>10.1f} ms   {status}")
+    return results
+
+
+def main(parity=False, threads=None):
+    engine = DuckDBEngine(glob.glob(os.path.join(RAW_DATA, PARQUET_PATTERN)),
+                          os.path.join(RAW_DATA, ZONE_LOOKUP), threads=threads)
+    engine.create_views()
+
+    workload = []
+    for path in WORKLOAD_FILES:
+        workload.extend(load_workload(path))
+
+    if parity:
+        pg_conn = db.connect()
+        try:
+            parity_check(engine, pg_conn, workload)
+        finally:
+            pg_conn.close()
+        return
+
+    for query in workload:
+        try:
+            rows, elapsed = engine.run(query["sql"])
+            print(f"{query['name']:<20} {elapsed:>10.1f} ms  {len(rows)} rows  {query['description']}")
+        except duckdb.Error as e:
+            print(f"{query['name']:<20} failed: {str(e).strip()}")
+
+
+if __name__ == "__main__":
+    main()
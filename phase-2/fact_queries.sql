@@ -0,0 +1,84 @@
+-- The queries of final_queries.sql rewritten against the denormalized trip_fact table
+-- (DataReader/trip_fact.sql). Each aggregates trip_fact alone; zone and borough names
+-- are joined onto the few hundred aggregated rows, never onto the trips.
+
+--1. This query finds the zone in each borough that earned the highest total TotalAmount on each day of the week.
+WITH EarningsPerZone AS (
+    SELECT
+        l.borough,
+        l.zone,
+        ez.dayofweek,
+        ez.totalearnings
+    FROM (
+        SELECT pickupzone, dayofweek, SUM(totalamount) AS totalearnings
+        FROM trip_fact
+        WHERE pickupdate IS NOT NULL
+        GROUP BY pickupzone, dayofweek
+    ) ez
+    JOIN location l ON ez.pickupzone = l.id
+)
+
+SELECT
+    epz.borough,
+    epz.zone,
+    epz.dayofweek,
+    epz.totalearnings
+FROM EarningsPerZone epz
+WHERE epz.totalearnings = (
+    SELECT MAX(totalearnings)
+    FROM EarningsPerZone epz2
+    WHERE epz2.dayofweek = epz.dayofweek
+    AND epz2.borough = epz.borough
+)
+ORDER BY epz.dayofweek, epz.totalearnings DESC;
+
+--2. This query calculates the average TripDistance and FareAmount grouped by both PaymentType and Ratecode.
+select p.description as paymenttype, r.description as ratecode,
+	sum(f.sumdistance) / sum(f.ndistance) as avgtripdistance,
+	sum(f.sumfare) / sum(f.nfare) as avgfareamount
+from (
+	select paymenttype, ratecode,
+		sum(tripdistance) as sumdistance, count(tripdistance) as ndistance,
+		sum(fareamount) as sumfare, count(fareamount) as nfare
+	from trip_fact
+	group by paymenttype, ratecode
+) f
+join payment p on f.paymenttype = p.id
+join ratecode r on f.ratecode = r.id
+group by p.description, r.description
+order by avgfareamount;
+
+--3. Identify the top 10 most profitable trip routes by total revenue.
+select originlocation.zone as originzone,
+	destlocation.zone as destzone,
+	sum(f.totalrevenue) as totalrevenue
+from (
+	select pickupzone, dropoffzone, sum(totalamount) as totalrevenue
+	from trip_fact
+	group by pickupzone, dropoffzone
+) f
+join location as originlocation on f.pickupzone = originlocation.id
+join location as destlocation on f.dropoffzone = destlocation.id
+group by originzone, destzone
+order by totalrevenue desc
+limit 10;
+
+--4. Analyze trip volume and revenue trends over time.
+select date_trunc('month', pickupdate) as monthyear,
+	count(*) as tripcount,
+	sum(totalamount) as totalrevenue,
+	avg(tipamount) as avgtipamount
+from trip_fact
+where pickupdate is not null
+group by monthyear
+order by monthyear;
+
+--5. Analyze the impact of congestion surcharges on trip revenue.
+select
+	case when congestionsurcharge > 0 then 'with surcharge' else 'no surcharge' end as surchargestatus,
+	count(*) as tripcount,
+	sum(totalamount) as totalrevenue,
+	avg(totalamount) as avgtriprevenue
+from trip_fact
+group by surchargestatus
+order by tripcount desc;
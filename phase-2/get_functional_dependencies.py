@@ -8,27 +8,65 @@ Class `FunctionalDependencyDiscovery`:
         - `compute_single_attribute_partitions`: Precomputes partitions for efficiency.
         - `check_dependency`: Validates if LHS determines RHS.
         - `discover_dependencies`: Implements the lattice traversal and FD discovery algorithm. -- Several helper functions added to modularize code.
+          Timed as an instrumentation stage; the run report is written at the end.
         - `report_dependencies`: Outputs results and prints a summary.
-Class `DatabaseConnection`:
-    - Manages database connections and cursors.
+Class `OutOfCoreFunctionalDependencyDiscovery`:
+    - Same search over the whole table instead of the first rows, for tables larger than memory.
+    - `fetch_data` streams the table once and writes every column dictionary-encoded to an
+      `np.memmap` file; the primary key is coded by row number.
+    - X -> A holds iff |pi_X| == |pi_{X u A}|, so only group counts are needed. The partition
+      of an LHS pair is a file of group IDs; products are computed chunk by chunk. When few
+      keys are possible, a dense key -> group ID lookup numbers them; otherwise the keys are
+      spilled to hash buckets, and a bucket still over the budget is merged chunk by chunk
+      (few distinct keys) or split again on further hash bits.
+    - Only the dictionaries (one entry per distinct value) stay in memory; tables are limited to 2^31 rows.
+    - With `cache`, the trip table is encoded from the memory-mapped Arrow cache of
+      common/trip_cache.py instead of being fetched from Postgres.
+Class `DatabaseConnection` (common/db.py):
+    - Manages database connections and cursors; credentials come from db.ini or the environment.
 Main Method:
     - Hardcodes table names and primary keys.
     - Iterates over tables, performing FD discovery for each.
 
 Requirements:
 - `psycopg2` library for PostgreSQL connection handling.
+- `numpy` for the out-of-core mode, `pyarrow` for the trip cache.
 
 HOW TO RUN:
-1) EDIT the database credentials in the main method.
+1) Set the database credentials in db.ini or the environment (see common/db.py).
 2) Modify the hardcoded values for tables as required.
-3) Run this File.
+3) Run this File, or main(out_of_core=True) for tables that do not fit in memory.
 4) Get the output in 2 txt files generated.
 """
 
-import psycopg2
+import math
+import os
+import shutil
+import sys
+
 from itertools import combinations
 from collections import defaultdict
 
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import db, trip_cache  # noqa: E402
+from common.db import DatabaseConnection  # noqa: E402
+from common.instrumentation import stage, write_report  # noqa: E402
+
+# Column codes and spilled partitions of the out-of-core mode
+FD_WORK_DIR = "fd_work"
+
+# Bytes per row held while a partition product is computed: both inputs, the key and its sort
+PRODUCT_ROW_BYTES = 32
+
+# Bytes per possible key of the dense key -> group ID lookup of a low-cardinality product
+DENSE_ENTRY_BYTES = 4
+
+# Fibonacci hashing spreads the product keys over the spill buckets
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
 class FunctionalDependencyDiscovery:
     def __init__(self, db_connection, table_name, primary_key):
         self.db_connection = db_connection
@@ -86,6 +124,16 @@ class FunctionalDependencyDiscovery:
         return True
 
     def discover_dependencies(self):
+        with stage(f"discover_dependencies {self.table_name}") as fd_stage:
+            self.search_dependencies()
+            fd_stage.rows = self.row_count()
+            fd_stage.meta["tested"] = len(self.tested_dependencies)
+            fd_stage.meta["valid"] = len(self.valid_dependencies)
+
+    def row_count(self):
+        return len(self.rows)
+
+    def search_dependencies(self):
         lhs_combinations = self.generate_lhs_combinations()
         rhs_attributes = self.get_rhs_candidates()
 
@@ -165,47 +213,311 @@ class FunctionalDependencyDiscovery:
         print(f"Pruned dependencies updated in  {self.pruned_output_file}.")
         print(f"Valid dependencies updated in {self.valid_output_file}.")
 
-# Connect to PostgreSQL
-class DatabaseConnection:
-    def __init__(self, database, user, password, host, port):
-        self.database = database
-        self.user = user
-        self.password = password
-        self.host = host
-        self.port = port
-        self.connection = None
-        self.cursor = None
-
-    def connect(self):
+class OutOfCoreFunctionalDependencyDiscovery(FunctionalDependencyDiscovery):
+    def __init__(self, db_connection, table_name, primary_key, work_dir=FD_WORK_DIR, memory_budget=2**30,
+                 batch_size=100000, cache=False):
+        """
+        FD discovery over memory-mapped column codes
+        :param db_connection: DatabaseConnection
+        :param table_name: table to analyse
+        :param primary_key: primary key column, coded by row number instead of a dictionary
+        :param work_dir: directory for the column codes and spilled partitions
+        :param memory_budget: bytes a partition product may hold in memory before it spills
+        :param batch_size: rows fetched per round trip while encoding
+        :param cache: encode the trip table from the columnar trip cache
+        """
+        super().__init__(db_connection, table_name, primary_key)
+        self.work_dir = os.path.join(work_dir, table_name.lower())
+        self.memory_budget = memory_budget
+        self.batch_size = batch_size
+        self.cache = cache and table_name.lower() == "trip"
+        self.n_rows = 0
+        self.codes = {}
+        self.cardinalities = {}
+        self.spilled_buckets = 0
+        self.partition_files = 0
+
+    def column_path(self, attr):
+        return os.path.join(self.work_dir, f"{attr}.codes")
+
+    def fetch_data(self):
+        """
+        Stream the whole table and write each column as dictionary codes
+        :return: False if the table is empty or cannot be read
+        """
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        os.makedirs(self.work_dir)
+        if self.cache:
+            return self.fetch_cached()
         try:
-            self.connection = psycopg2.connect(
-                database=self.database,
-                user=self.user,
-                password=self.password,
-                host=self.host,
-                port=self.port
-            )
-            self.cursor = self.connection.cursor()
-            print("Connected to the database")
-        except psycopg2.Error as e:
-            print(f"Error connecting to the database: {e}")
-
-    def disconnect(self):
-        if self.cursor:
-            self.cursor.close()
-        if self.connection:
-            self.connection.close()
-        print("Disconnected from the database")
+            cursor = self.db_connection.cursor
+            cursor.execute(f"SELECT * FROM {self.table_name} LIMIT 0")
+            self.attributes = [desc[0] for desc in cursor.description]
+            key_index = [attr.lower() for attr in self.attributes].index(self.primary_key.lower())
+
+            dictionaries = [{} for _ in self.attributes]
+            files = [open(self.column_path(attr), "wb") for attr in self.attributes]
+            try:
+                for rows in db.stream(self.db_connection.connection, f"SELECT * FROM {self.table_name}",
+                                      batch_size=self.batch_size, name="fd_rows"):
+                    for idx, column_file in enumerate(files):
+                        if idx == key_index:
+                            codes = np.arange(self.n_rows, self.n_rows + len(rows), dtype=np.int32)
+                        else:
+                            dictionary = dictionaries[idx]
+                            codes = np.fromiter((dictionary.setdefault(row[idx], len(dictionary)) for row in rows),
+                                                dtype=np.int32, count=len(rows))
+                        codes.tofile(column_file)
+                    self.n_rows += len(rows)
+            finally:
+                for column_file in files:
+                    column_file.close()
+            self.db_connection.connection.commit()
+        except Exception as e:
+            print(f"Error fetching data: {e}")
+            self.attributes = []
+            return False
 
-# Main Execution
-if __name__ == "__main__":
-    db_conn = DatabaseConnection(
-        database="project",
-        user="postgres",
-        password="RIT@2023",
-        host="localhost",
-        port="5432"
-    )
+        if self.n_rows == 0:
+            self.attributes = []
+            return False
+
+        for idx, attr in enumerate(self.attributes):
+            self.codes[attr] = np.memmap(self.column_path(attr), dtype=np.int32, mode="r", shape=(self.n_rows,))
+            self.cardinalities[(attr,)] = self.n_rows if idx == key_index else len(dictionaries[idx])
+        return True
+
+    def fetch_cached(self):
+        """
+        Encode the trip columns of the Arrow trip cache; the dictionary is shared by all chunks of a column
+        :return: False if the table is empty
+        """
+        table = trip_cache.open_trips(self.db_connection.profile)
+        self.attributes = trip_cache.trip_columns(table)
+        self.n_rows = table.num_rows
+        if self.n_rows == 0:
+            self.attributes = []
+            return False
+
+        for attr in self.attributes:
+            path = self.column_path(attr)
+            if attr.lower() == self.primary_key.lower():
+                np.arange(self.n_rows, dtype=np.int32).tofile(path)
+                self.cardinalities[(attr,)] = self.n_rows
+            else:
+                encoded = table.column(attr).dictionary_encode(null_encoding="encode")
+                with open(path, "wb") as column_file:
+                    for chunk in encoded.chunks:
+                        chunk.indices.to_numpy(zero_copy_only=False).astype(np.int32).tofile(column_file)
+                self.cardinalities[(attr,)] = max(len(chunk.dictionary) for chunk in encoded.chunks)
+            self.codes[attr] = np.memmap(path, dtype=np.int32, mode="r", shape=(self.n_rows,))
+        return True
+
+    def compute_single_attribute_partitions(self):
+        # The column codes are the single-attribute partitions
+        pass
+
+    def row_count(self):
+        return self.n_rows
+
+    def product(self, left, left_count, right, right_count, output=None):
+        """
+        Partition of the union of two attribute sets, from their group IDs
+        :param left: group IDs of the first partition, one per row
+        :param left_count: number of groups of the first partition
+        :param right: group IDs of the second partition
+        :param right_count: number of groups of the second partition
+        :param output: file to write the group IDs of the product to; None to count the groups only
+        :return: (number of groups, memmap of group IDs or None)
+        """
+        chunk_rows = max(1, self.memory_budget // PRODUCT_ROW_BYTES)
+        ids = None
+        if output is not None:
+            ids = np.memmap(output, dtype=np.int32, mode="w+", shape=(self.n_rows,))
+
+        def keys(start, stop):
+            return left[start:stop].astype(np.int64) * right_count + right[start:stop]
+
+        if self.n_rows <= chunk_rows:
+            if ids is None:
+                return len(np.unique(keys(0, self.n_rows))), None
+            unique, inverse = np.unique(keys(0, self.n_rows), return_inverse=True)
+            ids[:] = inverse
+            ids.flush()
+            return len(unique), ids
+
+        # Few possible keys (most Trip columns have a handful of values): a dense lookup from key
+        # to group ID replaces the spill, since equal keys would all land in one oversized bucket
+        key_space = left_count * right_count
+        if key_space * DENSE_ENTRY_BYTES <= self.memory_budget // 2:
+            chunk_rows = max(1, (self.memory_budget - key_space * DENSE_ENTRY_BYTES) // PRODUCT_ROW_BYTES)
+            lookup = np.full(key_space, -1, dtype=np.int32)
+            groups = 0
+            for start in range(0, self.n_rows, chunk_rows):
+                stop = min(start + chunk_rows, self.n_rows)
+                chunk = keys(start, stop)
+                new_keys = np.unique(chunk[lookup[chunk] < 0])
+                lookup[new_keys] = np.arange(groups, groups + len(new_keys), dtype=np.int32)
+                groups += len(new_keys)
+                if ids is not None:
+                    ids[start:stop] = lookup[chunk]
+            if ids is not None:
+                ids.flush()
+            return groups, ids
+
+        spill_dir = os.path.join(self.work_dir, "spill")
+        os.makedirs(spill_dir, exist_ok=True)
+
+        def input_chunks():
+            for start in range(0, self.n_rows, chunk_rows):
+                stop = min(start + chunk_rows, self.n_rows)
+                yield keys(start, stop), np.arange(start, stop, dtype=np.int64) if ids is not None else None
+
+        def spill(chunks, rows, used, name):
+            """
+            Split keys and row positions into hash buckets small enough to deduplicate in memory
+            :param chunks: iterable of (keys, positions or None)
+            :param rows: number of keys
+            :param used: hash bits already used by the enclosing buckets
+            :param name: prefix of the bucket files
+            :return: list of (bucket file prefix, hash bits used)
+            """
+            bits = min(max(1, math.ceil(math.log2(math.ceil(rows / chunk_rows)))), 64 - used)
+            n_buckets = 2 ** bits
+            self.spilled_buckets += n_buckets
+            paths = [os.path.join(spill_dir, f"{name}_{b}") for b in range(n_buckets)]
+            key_files = [open(f"{path}.keys", "wb") for path in paths]
+            position_files = [open(f"{path}.rows", "wb") for path in paths] if ids is not None else []
+            try:
+                for chunk, positions in chunks:
+                    # Bits [used, used + bits) of the hash, counted from the top
+                    hashed = chunk.view(np.uint64) * HASH_MULTIPLIER
+                    buckets = (hashed << np.uint64(used)) >> np.uint64(64 - bits)
+                    order = np.argsort(buckets, kind="stable")
+                    bounds = np.searchsorted(buckets[order], np.arange(n_buckets + 1, dtype=np.uint64))
+                    chunk = chunk[order]
+                    if positions is not None:
+                        positions = positions[order]
+                    for b in range(n_buckets):
+                        chunk[bounds[b]:bounds[b + 1]].tofile(key_files[b])
+                        if positions is not None:
+                            positions[bounds[b]:bounds[b + 1]].tofile(position_files[b])
+            finally:
+                for spill_file in key_files + position_files:
+                    spill_file.close()
+            return [(path, used + bits) for path in paths]
+
+        def bucket_chunks(path):
+            rows = os.path.getsize(f"{path}.keys") // 8
+            bucket = np.memmap(f"{path}.keys", dtype=np.int64, mode="r", shape=(rows,))
+            positions = None
+            if ids is not None:
+                positions = np.memmap(f"{path}.rows", dtype=np.int64, mode="r", shape=(rows,))
+            for start in range(0, rows, chunk_rows):
+                yield (np.array(bucket[start:start + chunk_rows]),
+                       np.array(positions[start:start + chunk_rows]) if positions is not None else None)
+
+        def remove(path):
+            os.remove(f"{path}.keys")
+            if ids is not None:
+                os.remove(f"{path}.rows")
+
+        # Equal keys share a bucket, so bucket-local IDs offset by the groups before it are global
+        groups = 0
+        pending = spill(input_chunks(), self.n_rows, 0, "product")
+        while pending:
+            path, used = pending.pop()
+            rows = os.path.getsize(f"{path}.keys") // 8
+            if rows == 0:
+                remove(path)
+                continue
+
+            if rows <= chunk_rows:
+                bucket = np.fromfile(f"{path}.keys", dtype=np.int64)
+                if ids is None:
+                    groups += len(np.unique(bucket))
+                else:
+                    unique, inverse = np.unique(bucket, return_inverse=True)
+                    ids[np.fromfile(f"{path}.rows", dtype=np.int64)] = inverse + groups
+                    groups += len(unique)
+                remove(path)
+                continue
+
+            # An oversized bucket holds either few keys repeated many times, whose distinct keys are
+            # merged chunk by chunk, or many distinct keys, which the next hash bits split further
+            known = np.empty(0, dtype=np.int64)
+            for chunk, _ in bucket_chunks(path):
+                known = np.union1d(known, chunk)
+                if len(known) > chunk_rows:
+                    break
+            if len(known) <= chunk_rows:
+                if ids is not None:
+                    for chunk, positions in bucket_chunks(path):
+                        ids[positions] = np.searchsorted(known, chunk) + groups
+                groups += len(known)
+            else:
+                pending.extend(spill(bucket_chunks(path), rows, used, os.path.basename(path)))
+            remove(path)
+
+        if ids is not None:
+            ids.flush()
+        return groups, ids
+
+    def compute_partition(self, attrs):
+        """
+        Group IDs and group count of an LHS. The search visits each LHS once, so only the
+        current multi-attribute partition is kept on disk.
+        :param attrs: tuple of attributes
+        :return: (number of groups, group IDs)
+        """
+        if attrs in self.partitions:
+            return self.partitions[attrs]
+        if len(attrs) == 1:
+            return self.cardinalities[attrs], self.codes[attrs[0]]
+
+        count, ids = self.compute_partition(attrs[:-1])
+        last = attrs[-1]
+        # Alternate between two files so the partition being replaced is never overwritten while mapped
+        self.partition_files += 1
+        path = os.path.join(self.work_dir, f"partition_{self.partition_files % 2}.ids")
+        self.partitions = {}
+        count, ids = self.product(ids, count, self.codes[last], self.cardinalities[(last,)], output=path)
+        self.partitions[attrs] = (count, ids)
+        self.cardinalities[attrs] = count
+        return count, ids
+
+    def check_dependency(self, lhs_attrs, rhs_attr):
+        lhs_count, lhs_ids = self.compute_partition(lhs_attrs)
+        if lhs_count == self.n_rows or self.cardinalities[(rhs_attr,)] == 1:
+            return True
+
+        # X -> A iff adding A splits no group of X
+        combined = tuple(sorted(lhs_attrs + (rhs_attr,), key=self.attributes.index))
+        combined_count = self.cardinalities.get(combined)
+        if combined_count is None:
+            combined_count, _ = self.product(lhs_ids, lhs_count, self.codes[rhs_attr],
+                                             self.cardinalities[(rhs_attr,)])
+            self.cardinalities[combined] = combined_count
+        return combined_count == lhs_count
+
+    def discover_dependencies(self):
+        super().discover_dependencies()
+        if self.spilled_buckets:
+            print(f"Spilled partition products to {self.spilled_buckets} hash buckets")
+        self.partitions = {}
+        self.codes = {}
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+def main(out_of_core=False, memory_budget=2**30, work_dir=FD_WORK_DIR, cache=False):
+    """
+    :param out_of_core: analyse the whole tables from memory-mapped column codes;
+                        otherwise the first rows of each table in memory
+    :param memory_budget: bytes a partition product may hold in memory in the out-of-core mode
+    :param work_dir: directory for the column codes and spilled partitions
+    :param cache: in the out-of-core mode, read the trip table from the columnar trip cache
+    """
+    db_conn = DatabaseConnection()
 
     # File paths for storing combined dependencies
     pruned_output_file = "pruned_dependencies.txt"
@@ -236,7 +548,12 @@ if __name__ == "__main__":
             print("-" * 40)
 
             # Create an instance for FD discovery
-            fd_discovery = FunctionalDependencyDiscovery(db_conn, table_name, primary_key)
+            if out_of_core:
+                fd_discovery = OutOfCoreFunctionalDependencyDiscovery(db_conn, table_name, primary_key,
+                                                                      work_dir=work_dir, memory_budget=memory_budget,
+                                                                      cache=cache)
+            else:
+                fd_discovery = FunctionalDependencyDiscovery(db_conn, table_name, primary_key)
 
             # Fetch data and compute FDs
             fd_discovery.fetch_data()
@@ -248,4 +565,10 @@ if __name__ == "__main__":
             print("-" * 40)
 
     finally:
-        db_conn.disconnect()
\ No newline at end of file
+        db_conn.disconnect()
+        write_report()
+
+
+# Main Execution
+if __name__ == "__main__":
+    main()
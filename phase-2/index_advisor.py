@@ -0,0 +1,345 @@
+"""
+Workload-driven index advisor for the phase-2 queries.
+
+The indexes in `indexes.sql` were found one query at a time by trial and
+error. This script derives candidates from the workload itself and picks the
+set that minimizes the total estimated cost of all queries within a storage
+budget.
+
+Main features of the script include:
+
+Function `analyze_query`:
+    - Resolves table aliases and collects, per table, the join, filter and
+      group-by columns and the columns read inside aggregates.
+Function `enumerate_candidates`:
+    - Single-column indexes on join/filter/group columns, composite indexes
+      (join column followed by group/filter columns), and covering indexes
+      (join column INCLUDE every other referenced column) that allow
+      index-only scans.
+Class `IndexAdvisor`:
+    - Costs each configuration with EXPLAIN over hypothetical indexes through
+      HypoPG when the extension is available. Otherwise it falls back to a
+      cost model based on pg_class/pg_stats: a covering index saves the heap
+      pages it replaces, and a non-covering index saves nothing for these
+      full-scan aggregates.
+    - `recommend`: greedy selection by cost reduction per byte within the budget.
+    - `verify`: times the recommendation against the baseline with `benchmark_queries.QueryBenchmark`.
+
+Requirements:
+- `psycopg2` library for PostgreSQL connection handling.
+- Optional: the `hypopg` extension for hypothetical indexes.
+
+HOW TO RUN:
+1) Set the database credentials in db.ini or the environment (see common/db.py).
+2) Run this File; the recommended CREATE INDEX statements are printed.
+"""
+
+import os
+import re
+import sys
+from collections import defaultdict
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmark_queries import QueryBenchmark, WORKLOAD_FILES, load_workload  # noqa: E402
+from common import db  # noqa: E402
+
+SQL_KEYWORDS = {"on", "where", "join", "inner", "left", "right", "full", "cross", "group", "order", "limit",
+                "having", "as", "select", "from", "and", "or", "union"}
+AGGREGATES = ("sum", "avg", "count", "min", "max")
+
+
+def analyze_query(sql):
+    """
+    Find the columns a query uses on each table
+    :param sql: query text
+    :return: dict of table -> {'join': set, 'filter': set, 'group': set, 'payload': set}
+    """
+    text = re.sub(r"--[^\n]*", " ", sql).lower()
+
+    # Common table expressions are not indexable relations
+    ctes = set(re.findall(r"(?:\bwith|,)\s*(\w+)\s+as\s*\(", text))
+
+    aliases = {}
+    for table, alias in re.findall(r"\b(?:from|join)\s+(\w+)\b(?!\.)(?:\s+(?:as\s+)?(\w+))?", text):
+        if table in SQL_KEYWORDS or table in ctes:
+            continue
+        aliases[table] = table
+        if alias and alias not in SQL_KEYWORDS:
+            aliases[alias] = table
+
+    usage = defaultdict(lambda: {"join": set(), "filter": set(), "group": set(), "payload": set()})
+
+    def resolve(alias, column):
+        table = aliases.get(alias)
+        return (table, column) if table else None
+
+    for left_alias, left_col, right_alias, right_col in re.findall(r"(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)", text):
+        for ref in (resolve(left_alias, left_col), resolve(right_alias, right_col)):
+            if ref:
+                usage[ref[0]]["join"].add(ref[1])
+
+    for clause in re.findall(r"\bwhere\b(.*?)(?:\bgroup by\b|\border by\b|\blimit\b|\)|;|$)", text, re.S):
+        for alias, column in re.findall(r"(\w+)\.(\w+)\s*(?:[<>!=]|\bis\b|\bin\b|\bbetween\b)", clause):
+            ref = resolve(alias, column)
+            if ref and column not in usage[ref[0]]["join"]:
+                usage[ref[0]]["filter"].add(column)
+
+    for aggregate, argument in re.findall(r"\b(" + "|".join(AGGREGATES) + r")\s*\(([^)]*)\)", text):
+        for alias, column in re.findall(r"(\w+)\.(\w+)", argument):
+            ref = resolve(alias, column)
+            if ref:
+                usage[ref[0]]["payload"].add(ref[1])
+
+    # Group-by columns, including select-list expressions grouped through their output alias
+    for select_list, group_list in re.findall(r"\bselect\b(.*?)\bfrom\b.*?\bgroup by\b(.*?)(?:\border by\b|\bhaving\b|\blimit\b|\)|;|$)",
+                                              text, re.S):
+        grouped = re.findall(r"(\w+)\.(\w+)", group_list)
+        if not grouped:
+            stripped = re.sub(r"\b(?:" + "|".join(AGGREGATES) + r")\s*\([^)]*\)", " ", select_list)
+            grouped = re.findall(r"(\w+)\.(\w+)", stripped)
+        for alias, column in grouped:
+            ref = resolve(alias, column)
+            if ref:
+                usage[ref[0]]["group"].add(ref[1])
+
+    return dict(usage)
+
+
+def enumerate_candidates(workload):
+    """
+    Derive single-column, composite and covering index candidates from the workload
+    :param workload: list of statement dicts from benchmark_queries.load_workload
+    :return: sorted list of (table, key columns tuple, include columns tuple)
+    """
+    candidates = set()
+    for query in workload:
+        for table, cols in analyze_query(query["sql"]).items():
+            keys = cols["join"] | cols["filter"] | cols["group"]
+            for column in keys:
+                candidates.add((table, (column,), ()))
+
+            referenced = keys | cols["payload"]
+            for join_col in sorted(cols["join"]) or [None]:
+                leading = (join_col,) if join_col else ()
+                rest = tuple(sorted((cols["filter"] | cols["group"]) - set(leading)))
+                if leading and rest:
+                    candidates.add((table, leading + rest, ()))
+                if leading or rest:
+                    key = leading + rest
+                    include = tuple(sorted(referenced - set(key)))
+                    if include:
+                        candidates.add((table, key, include))
+
+    return sorted(candidates)
+
+
+def index_ddl(candidate):
+    table, keys, include = candidate
+    name = f"adv_{table}_{'_'.join(keys)}" + (f"_inc_{'_'.join(include)}" if include else "")
+    ddl = f"CREATE INDEX {name[:63]} ON {table} ({', '.join(keys)})"
+    if include:
+        ddl += f" INCLUDE ({', '.join(include)})"
+    return ddl
+
+
+class IndexAdvisor:
+    def __init__(self, db_connection, workload, budget_mb=2048):
+        """
+        Recommend indexes for a workload
+        :param db_connection: psycopg2 connection
+        :param workload: list of statement dicts from benchmark_queries.load_workload
+        :param budget_mb: storage budget for all recommended indexes together
+        """
+        self.conn = db_connection
+        self.budget_bytes = budget_mb * 1024 * 1024
+        self.workload = self.runnable(workload)
+        self.candidates = [candidate for candidate in enumerate_candidates(self.workload)
+                           if self.is_table(candidate[0])]
+        self.use_hypopg = self.enable_hypopg()
+        self.sizes = {}
+        self.table_stats = {}
+        self.baseline_costs = {}
+
+    def runnable(self, workload):
+        """Drop statements that do not even plan, e.g. the broken ones in Queries.sql"""
+        cursor = self.conn.cursor()
+        queries = []
+        for query in workload:
+            try:
+                cursor.execute(f"EXPLAIN {query['sql'].rstrip().rstrip(';')}")
+                queries.append(query)
+            except psycopg2.Error as e:
+                print(f"Skipping {query['name']}: {str(e).strip()}")
+            finally:
+                self.conn.rollback()
+        return queries
+
+    def is_table(self, name):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (name,))
+        return cursor.fetchone()[0]
+
+    def enable_hypopg(self):
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS hypopg;")
+            self.conn.commit()
+            print("Using HypoPG hypothetical indexes")
+            return True
+        except psycopg2.Error:
+            self.conn.rollback()
+            print("HypoPG not available, falling back to the cost model")
+            return False
+
+    def plan_cost(self, sql):
+        cursor = self.conn.cursor()
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql.rstrip().rstrip(';')}")
+        return cursor.fetchone()[0][0]["Plan"]["Total Cost"]
+
+    def workload_cost_hypopg(self, configuration):
+        """
+        Total estimated cost of the workload with a set of hypothetical indexes
+        :param configuration: iterable of candidates
+        :return: summed planner cost
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT hypopg_reset();")
+        for candidate in configuration:
+            cursor.execute("SELECT indexrelid FROM hypopg_create_index(%s);", (index_ddl(candidate),))
+            oid = cursor.fetchone()[0]
+            if candidate not in self.sizes:
+                cursor.execute("SELECT hypopg_relation_size(%s);", (oid,))
+                self.sizes[candidate] = cursor.fetchone()[0]
+
+        total = sum(self.plan_cost(query["sql"]) for query in self.workload)
+        cursor.execute("SELECT hypopg_reset();")
+        return total
+
+    def stats(self, table):
+        """Page count, row estimate and average column widths of a table"""
+        if table not in self.table_stats:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT relpages, reltuples FROM pg_class WHERE oid = to_regclass(%s);", (table,))
+            pages, tuples = cursor.fetchone() or (0, 0)
+            cursor.execute("SELECT attname, avg_width FROM pg_stats WHERE schemaname = current_schema() "
+                           "AND tablename = %s;", (table,))
+            widths = dict(cursor.fetchall())
+            self.table_stats[table] = (pages, max(tuples, 0), widths)
+        return self.table_stats[table]
+
+    def estimated_size(self, candidate):
+        table, keys, include = candidate
+        _, tuples, widths = self.stats(table)
+        # Tuple header plus item pointer, and a 90% leaf fill factor
+        row_width = 16 + sum(widths.get(column, 8) for column in keys + include)
+        return int(tuples * row_width / 0.9)
+
+    def workload_cost_model(self, configuration):
+        """
+        Fallback cost: planner cost without indexes, minus the heap pages each
+        query avoids when one of the indexes covers every column it reads of a table
+        :param configuration: iterable of candidates
+        :return: estimated summed cost
+        """
+        total = 0
+        for query in self.workload:
+            cost = self.baseline_costs[query["name"]]
+            for table, cols in analyze_query(query["sql"]).items():
+                referenced = set().union(*cols.values())
+                pages = self.stats(table)[0]
+                savings = [
+                    pages - self.estimated_size(candidate) / 8192
+                    for candidate in configuration
+                    if candidate[0] == table and referenced <= set(candidate[1] + candidate[2])
+                ]
+                if savings:
+                    cost -= max(max(savings), 0)
+            total += cost
+        return total
+
+    def workload_cost(self, configuration):
+        if self.use_hypopg:
+            return self.workload_cost_hypopg(configuration)
+        return self.workload_cost_model(configuration)
+
+    def size(self, candidate):
+        if candidate not in self.sizes:
+            if self.use_hypopg:
+                self.workload_cost_hypopg([candidate])
+            else:
+                self.sizes[candidate] = self.estimated_size(candidate)
+        return self.sizes[candidate]
+
+    def recommend(self):
+        """
+        Greedily add the candidate with the best cost reduction per byte until nothing fits or helps
+        :return: list of recommended candidates
+        """
+        self.baseline_costs = {query["name"]: self.plan_cost(query["sql"]) for query in self.workload}
+        self.conn.rollback()
+
+        chosen, used = [], 0
+        current = self.workload_cost([])
+        print(f"Baseline workload cost: {current:.0f}")
+
+        while True:
+            best, best_ratio, best_cost = None, 0, current
+            for candidate in self.candidates:
+                if candidate in chosen or used + self.size(candidate) > self.budget_bytes:
+                    continue
+                cost = self.workload_cost(chosen + [candidate])
+                ratio = (current - cost) / max(self.size(candidate), 1)
+                if ratio > best_ratio:
+                    best, best_ratio, best_cost = candidate, ratio, cost
+
+            if best is None:
+                break
+
+            chosen.append(best)
+            used += self.size(best)
+            current = best_cost
+            print(f"Chose {index_ddl(best)} -> cost {current:.0f}, {used / 1024 / 1024:.0f} MB used")
+
+        self.conn.rollback()
+        return chosen
+
+    def verify(self, recommendation, runs=3):
+        """
+        Time the workload with and without the recommended indexes
+        :param recommendation: list of candidates from recommend()
+        :param runs: timed runs per query
+        :return: benchmark results
+        """
+        benchmark = QueryBenchmark(self.conn, runs=runs)
+        statements = [index_ddl(candidate) for candidate in recommendation]
+        for query in self.workload:
+            benchmark.run_variant(query, "baseline", [])
+            benchmark.run_variant(query, "recommended", statements)
+        benchmark.write_report("index_advisor_report.json")
+        return benchmark.results
+
+
+def main(budget_mb=2048, verify=True):
+    conn = db.connect()
+    try:
+        workload = []
+        for path in WORKLOAD_FILES:
+            workload.extend(load_workload(path))
+
+        advisor = IndexAdvisor(conn, workload, budget_mb=budget_mb)
+        recommendation = advisor.recommend()
+
+        print("Recommended indexes:")
+        for candidate in recommendation:
+            print(f"{index_ddl(candidate)};")
+
+        if verify and recommendation:
+            advisor.verify(recommendation)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Loads the trips into MongoDB as (pickup zone x hour) bucket documents.
+
+load_to_mongo.py writes one small document per trip, so 44M trips mean 44M documents,
+44M `_id` index entries and the per-document overhead of repeating every field name.
+Here the trips picked up in the same zone during the same hour share one document,
+in the spirit of the bucket pattern of time-series data:
+
+    {
+      "_id": {"zone": 161, "hour": ISODate("2023-01-05T18:00:00")},
+      "pickup": {"zone_id": 161, "borough": "Manhattan", "zone": "Midtown Center"},
+      "hour": ISODate("2023-01-05T18:00:00"), "hour_of_day": 18, "day_of_week": 3,
+      "count": 412, "sum_total": 9871.5, "sum_fare": ..., "sum_tip": ..., "sum_distance": ...,
+      "min_total": 3.5, "max_total": 182.0, "min_fare": ..., "max_fare": ...,
+      "trips": {"second": [...], "duration_s": [...], "dropoff_zone": [...], "passengers": [...],
+                "distance": [...], "fare": [...], "tip": [...], "total": [...],
+                "payment_type": [...], "ratecode": [...], "congestion_surcharge": [...]}
+    }
+
+Trips are stored column-wise: each field is one array, and position i of every array
+belongs to the same trip. The summary fields answer per-zone and per-hour aggregates
+without touching the arrays; route and payment questions `$zip` and `$unwind` them.
+A busy zone gets a few thousand trips per hour, far below the 16MB document limit.
+
+Class `BucketDocumentLoader`:
+    - Streams the trips in ID order from a server-side cursor.
+    - Groups each batch by bucket and writes one upsert per bucket that `$push`es the
+      batch's trips with `$each` and updates the summaries with `$inc`, `$min` and `$max`.
+    - Each upsert records its batch in `batches` and only matches buckets without it,
+      so a batch that was partly written before an interruption is not counted twice.
+      The last complete batch is the watermark the next run resumes from.
+    - Writes the `zones` lookup used to name drop-off zones in aggregations.
+Function `compare_storage`:
+    - Prints document count, storage and index size of the per-trip and bucket collections.
+
+Requirements:
+- `psycopg2` for reading from PostgreSQL.
+- `pymongo` for writing to MongoDB.
+
+HOW TO RUN:
+1) Set the database credentials in db.ini or the environment (see common/db.py); the Mongo URI
+   is the one of load_to_mongo.py.
+2) Run this File. Rerun it after a load to append the new trips.
+"""
+
+import os
+import sys
+from datetime import datetime
+
+from pymongo import ASCENDING, MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from load_to_mongo import mongo_database, mongo_uri, to_number
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import db  # noqa: E402
+
+BUCKET_COLLECTION = "trip_buckets"
+ZONE_COLLECTION = "zones"
+STATE_COLLECTION = "bucket_loader_state"
+
+BUCKET_TRIP_QUERY = """
+    SELECT tr.id, tr.pickuplocation,
+           t.pickupdate, t.pickuptime, t.dropoffdate, t.dropofftime, t.dayofweek,
+           tr.dropofflocation, tr.passengercount, tr.tripdistance,
+           tr.fareamount, tr.tipamount, tr.totalamount,
+           tr.paymenttype, tr.ratecode, tr.congestionsurcharge
+    FROM trip tr
+    JOIN time t ON t.tripid = tr.id
+    WHERE tr.id > %s AND t.pickupdate IS NOT NULL AND t.pickuptime IS NOT NULL
+    ORDER BY tr.id
+"""
+
+TRIP_ARRAYS = ["second", "duration_s", "dropoff_zone", "passengers", "distance", "fare", "tip", "total",
+               "payment_type", "ratecode", "congestion_surcharge"]
+
+
+class BucketDocumentLoader:
+    def __init__(self, pg_connection, mongo_client, database=mongo_database, collection=BUCKET_COLLECTION,
+                 batch_size=50000):
+        """
+        Stream the relational trips into (pickup zone, hour) bucket documents
+        :param pg_connection: psycopg2 connection to the source database
+        :param mongo_client: pymongo client
+        :param database: name of the target Mongo database
+        :param collection: name of the bucket collection
+        :param batch_size: trips fetched per round trip; each batch is one bulk write
+        """
+        self.pg_connection = pg_connection
+        self.database = mongo_client[database]
+        self.collection = self.database[collection]
+        self.state = self.database[STATE_COLLECTION]
+        self.batch_size = batch_size
+        self.zones = {}
+
+    def load_zones(self):
+        """
+        Copy the location table into the zones collection and keep it for the bucket headers
+        """
+        cursor = self.pg_connection.cursor()
+        cursor.execute("SELECT id, borough, zone FROM location;")
+        self.zones = {zone_id: {"zone_id": zone_id, "borough": borough, "zone": zone}
+                      for zone_id, borough, zone in cursor.fetchall()}
+        self.database[ZONE_COLLECTION].delete_many({})
+        if self.zones:
+            self.database[ZONE_COLLECTION].insert_many(
+                [{"_id": zone_id, "borough": z["borough"], "zone": z["zone"]} for zone_id, z in self.zones.items()])
+
+    def create_indexes(self):
+        self.collection.create_index([("hour", ASCENDING), ("pickup.zone", ASCENDING)])
+        self.collection.create_index([("pickup.zone_id", ASCENDING), ("hour", ASCENDING)])
+
+    def watermark(self):
+        state = self.state.find_one({"_id": self.collection.name})
+        return state["last_trip_id"] if state else -1
+
+    def bucket_updates(self, rows, batch_id):
+        """
+        One upsert per bucket touched by a batch
+        :param rows: rows in the column order of BUCKET_TRIP_QUERY
+        :param batch_id: ID of the first trip of the batch, recorded in the buckets it updates
+        :return: list of UpdateOne
+        """
+        buckets = {}
+        for (trip_id, pickup_zone, pickup_date, pickup_time, dropoff_date, dropoff_time, day_of_week,
+             dropoff_zone, passengers, distance, fare, tip, total, payment_type, ratecode, congestion) in rows:
+            pickup = datetime.combine(pickup_date, pickup_time)
+            hour = pickup.replace(minute=0, second=0, microsecond=0)
+            bucket = buckets.get((pickup_zone, hour))
+            if bucket is None:
+                bucket = buckets[(pickup_zone, hour)] = {"day_of_week": day_of_week,
+                                                         "trips": {name: [] for name in TRIP_ARRAYS}}
+            duration = None
+            if dropoff_date is not None and dropoff_time is not None:
+                duration = int((datetime.combine(dropoff_date, dropoff_time) - pickup).total_seconds())
+
+            values = (int((pickup - hour).total_seconds()), duration, dropoff_zone, passengers, to_number(distance),
+                      to_number(fare), to_number(tip), to_number(total), payment_type, ratecode,
+                      to_number(congestion))
+            for name, value in zip(TRIP_ARRAYS, values):
+                bucket["trips"][name].append(value)
+
+        updates = []
+        for (pickup_zone, hour), bucket in buckets.items():
+            trips = bucket["trips"]
+            totals = [v for v in trips["total"] if v is not None]
+            fares = [v for v in trips["fare"] if v is not None]
+            bucket_filter = {"_id": {"zone": pickup_zone, "hour": hour}, "batches": {"$ne": batch_id}}
+            update = {
+                "$setOnInsert": {
+                    "pickup": self.zones.get(pickup_zone, {"zone_id": pickup_zone}),
+                    "hour": hour,
+                    "hour_of_day": hour.hour,
+                    "day_of_week": bucket["day_of_week"]
+                },
+                "$push": {**{f"trips.{name}": {"$each": values} for name, values in trips.items()},
+                          "batches": batch_id},
+                "$inc": {
+                    "count": len(trips["total"]),
+                    "sum_total": sum(totals),
+                    "sum_fare": sum(fares),
+                    "sum_tip": sum(v for v in trips["tip"] if v is not None),
+                    "sum_distance": sum(v for v in trips["distance"] if v is not None)
+                }
+            }
+            if totals:
+                update["$min"] = {"min_total": min(totals), **({"min_fare": min(fares)} if fares else {})}
+                update["$max"] = {"max_total": max(totals), **({"max_fare": max(fares)} if fares else {})}
+            updates.append(UpdateOne(bucket_filter, update, upsert=True))
+        return updates
+
+    def write_batch(self, updates):
+        try:
+            self.collection.bulk_write(updates, ordered=False)
+        except BulkWriteError as e:
+            # A duplicate _id means the bucket already holds this batch: it was written before an interruption
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+
+    def load(self):
+        """
+        Append every trip above the watermark to its bucket
+        :return: number of trips written
+        """
+        self.load_zones()
+        self.create_indexes()
+        last_trip_id = self.watermark()
+        written = 0
+
+        with self.pg_connection.cursor(name="bucket_trips") as cursor:
+            cursor.itersize = self.batch_size
+            cursor.execute(BUCKET_TRIP_QUERY, (last_trip_id,))
+            while True:
+                rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                self.write_batch(self.bucket_updates(rows, batch_id=rows[0][0]))
+                last_trip_id = rows[-1][0]
+                self.state.update_one({"_id": self.collection.name}, {"$set": {"last_trip_id": last_trip_id}},
+                                      upsert=True)
+                written += len(rows)
+                print(f"Bucketed {written} trips")
+        self.pg_connection.commit()
+
+        print(f"Wrote {written} trips into {self.collection.estimated_document_count()} buckets")
+        return written
+
+
+def compare_storage(mongo_client, database=mongo_database, collections=("trip", BUCKET_COLLECTION)):
+    """
+    Print the document count, data, storage and index sizes of the per-trip and bucket collections
+    :return: dict of collection -> collStats summary
+    """
+    summary = {}
+    for name in collections:
+        stats = mongo_client[database].command("collStats", name)
+        summary[name] = {key: stats.get(key) for key in ("count", "size", "storageSize", "totalIndexSize")}
+        print(f"{name:<14} {summary[name]['count']:>12,} docs  {summary[name]['storageSize'] / 2**20:>10.1f} MB storage"
+              f"  {summary[name]['totalIndexSize'] / 2**20:>10.1f} MB indexes")
+    return summary
+
+
+def main():
+    pg_connection = db.connect('mongo_source')
+    mongo_client = MongoClient(mongo_uri)
+    try:
+        loader = BucketDocumentLoader(pg_connection, mongo_client)
+        loader.load()
+        compare_storage(mongo_client)
+    finally:
+        mongo_client.close()
+        pg_connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,460 @@
+"""
+MongoDB version of the phase-2 workload, with an index benchmark.
+
+The queries of `final_queries.sql` are written as aggregation pipelines over two
+document layouts:
+    - embedded: the `trip` collection of load_to_mongo.py, one document per trip with
+      the pickup/dropoff location, payment and ratecode descriptions inside it.
+    - flat: one collection per table, as the relational schema (`load_flat_layout`).
+      Joins become `$lookup` stages; each pipeline groups on IDs first and looks up
+      the names afterwards, so only the groups are joined.
+    - bucketed: the (pickup zone x hour) buckets of load_buckets_to_mongo.py. Zone and
+      time aggregates read the bucket summaries; the others `$zip` and `$unwind` the trip arrays.
+
+For every query and layout the benchmark runs a baseline, then each candidate index
+on its own and all of them together. A variant creates its indexes, warms up, times
+repeated runs, captures `explain` with executionStats (time, keys and documents
+examined, plan stages), then drops the indexes again so no experiment leaves one behind.
+Flat-layout baselines have no index on the `$lookup` keys and may hit `max_time_ms`.
+
+The report is written to mongo_benchmark_report.json. The printed table puts the best
+Mongo latencies next to the Postgres numbers of benchmark_report.json (benchmark_queries.py).
+
+Requirements:
+- `pymongo` and a local `mongod` (4.4+ for explain of $lookup, 5.0+ for $dateTrunc).
+- `psycopg2` to copy the tables for the flat layout.
+
+HOW TO RUN:
+1) Load the embedded layout with load_to_mongo.py. Set the database credentials in db.ini
+   or the environment (see common/db.py) and call main(load_flat=True) once for the flat layout.
+2) Run benchmark_queries.py for the Postgres numbers, then this File.
+"""
+
+import json
+import os
+import sys
+import time
+from datetime import date, datetime, time as time_of_day
+from decimal import Decimal
+
+from pymongo import ASCENDING, MongoClient
+from pymongo.errors import ExecutionTimeout, OperationFailure
+
+from benchmark_queries import percentile
+from load_to_mongo import mongo_database, mongo_uri
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import db  # noqa: E402
+
+FLAT_DATABASE = "taxi_flat"
+FLAT_TABLES = ["location", "payment", "ratecode", "vendor", "time", "trip"]
+
+LOCATION_LOOKUP = [
+    {"$lookup": {"from": "location", "localField": "_id.location", "foreignField": "id", "as": "location"}},
+    {"$unwind": "$location"}
+]
+
+# Query number in final_queries.sql -> pipeline per layout, as (collection, pipeline)
+WORKLOAD = {
+    1: {
+        "description": "Zone of each borough with the highest total amount per day of week",
+        "embedded": ("trip", [
+            {"$group": {"_id": {"borough": "$pickup.location.borough", "zone": "$pickup.location.zone",
+                                "dayofweek": "$day_of_week"},
+                        "totalearnings": {"$sum": "$total"}}},
+            {"$sort": {"totalearnings": -1}},
+            {"$group": {"_id": {"borough": "$_id.borough", "dayofweek": "$_id.dayofweek"},
+                        "zone": {"$first": "$_id.zone"}, "totalearnings": {"$first": "$totalearnings"}}},
+            {"$sort": {"_id.dayofweek": 1, "totalearnings": -1}}
+        ]),
+        "flat": ("trip", [
+            {"$lookup": {"from": "time", "localField": "id", "foreignField": "tripid", "as": "time"}},
+            {"$unwind": "$time"},
+            {"$group": {"_id": {"location": "$pickuplocation", "dayofweek": "$time.dayofweek"},
+                        "totalearnings": {"$sum": "$totalamount"}}},
+            *LOCATION_LOOKUP,
+            {"$group": {"_id": {"borough": "$location.borough", "zone": "$location.zone",
+                                "dayofweek": "$_id.dayofweek"},
+                        "totalearnings": {"$sum": "$totalearnings"}}},
+            {"$sort": {"totalearnings": -1}},
+            {"$group": {"_id": {"borough": "$_id.borough", "dayofweek": "$_id.dayofweek"},
+                        "zone": {"$first": "$_id.zone"}, "totalearnings": {"$first": "$totalearnings"}}},
+            {"$sort": {"_id.dayofweek": 1, "totalearnings": -1}}
+        ]),
+        "bucketed": ("trip_buckets", [
+            {"$group": {"_id": {"borough": "$pickup.borough", "zone": "$pickup.zone", "dayofweek": "$day_of_week"},
+                        "totalearnings": {"$sum": "$sum_total"}}},
+            {"$sort": {"totalearnings": -1}},
+            {"$group": {"_id": {"borough": "$_id.borough", "dayofweek": "$_id.dayofweek"},
+                        "zone": {"$first": "$_id.zone"}, "totalearnings": {"$first": "$totalearnings"}}},
+            {"$sort": {"_id.dayofweek": 1, "totalearnings": -1}}
+        ])
+    },
+    2: {
+        "description": "Average distance and fare by payment type and ratecode",
+        "embedded": ("trip", [
+            {"$group": {"_id": {"paymenttype": "$payment_type", "ratecode": "$ratecode"},
+                        "avgtripdistance": {"$avg": "$distance"}, "avgfareamount": {"$avg": "$fare"}}},
+            {"$sort": {"avgfareamount": 1}}
+        ]),
+        "flat": ("trip", [
+            {"$group": {"_id": {"paymenttype": "$paymenttype", "ratecode": "$ratecode"},
+                        "avgtripdistance": {"$avg": "$tripdistance"}, "avgfareamount": {"$avg": "$fareamount"}}},
+            {"$lookup": {"from": "payment", "localField": "_id.paymenttype", "foreignField": "id",
+                         "as": "payment"}},
+            {"$lookup": {"from": "ratecode", "localField": "_id.ratecode", "foreignField": "id",
+                         "as": "ratecode"}},
+            {"$unwind": "$payment"},
+            {"$unwind": "$ratecode"},
+            {"$project": {"paymenttype": "$payment.description", "ratecode": "$ratecode.description",
+                          "avgtripdistance": 1, "avgfareamount": 1}},
+            {"$sort": {"avgfareamount": 1}}
+        ]),
+        "bucketed": ("trip_buckets", [
+            {"$project": {"trip": {"$zip": {"inputs": ["$trips.payment_type", "$trips.ratecode",
+                                                       "$trips.distance", "$trips.fare"]}}}},
+            {"$unwind": "$trip"},
+            {"$group": {"_id": {"paymenttype": {"$arrayElemAt": ["$trip", 0]},
+                                "ratecode": {"$arrayElemAt": ["$trip", 1]}},
+                        "avgtripdistance": {"$avg": {"$arrayElemAt": ["$trip", 2]}},
+                        "avgfareamount": {"$avg": {"$arrayElemAt": ["$trip", 3]}}}},
+            {"$sort": {"avgfareamount": 1}}
+        ])
+    },
+    3: {
+        "description": "Top 10 routes by total revenue",
+        "embedded": ("trip", [
+            {"$group": {"_id": {"originzone": "$pickup.location.zone", "destzone": "$dropoff.location.zone"},
+                        "totalrevenue": {"$sum": "$total"}}},
+            {"$sort": {"totalrevenue": -1}},
+            {"$limit": 10}
+        ]),
+        "flat": ("trip", [
+            {"$group": {"_id": {"origin": "$pickuplocation", "dest": "$dropofflocation"},
+                        "totalrevenue": {"$sum": "$totalamount"}}},
+            {"$lookup": {"from": "location", "localField": "_id.origin", "foreignField": "id", "as": "origin"}},
+            {"$lookup": {"from": "location", "localField": "_id.dest", "foreignField": "id", "as": "dest"}},
+            {"$unwind": "$origin"},
+            {"$unwind": "$dest"},
+            # The SQL groups by zone name, which merges duplicate zones
+            {"$group": {"_id": {"originzone": "$origin.zone", "destzone": "$dest.zone"},
+                        "totalrevenue": {"$sum": "$totalrevenue"}}},
+            {"$sort": {"totalrevenue": -1}},
+            {"$limit": 10}
+        ]),
+        "bucketed": ("trip_buckets", [
+            {"$project": {"zone": "$pickup.zone",
+                          "trip": {"$zip": {"inputs": ["$trips.dropoff_zone", "$trips.total"]}}}},
+            {"$unwind": "$trip"},
+            {"$group": {"_id": {"originzone": "$zone", "dest": {"$arrayElemAt": ["$trip", 0]}},
+                        "totalrevenue": {"$sum": {"$arrayElemAt": ["$trip", 1]}}}},
+            {"$lookup": {"from": "zones", "localField": "_id.dest", "foreignField": "_id", "as": "dest"}},
+            {"$unwind": "$dest"},
+            {"$group": {"_id": {"originzone": "$_id.originzone", "destzone": "$dest.zone"},
+                        "totalrevenue": {"$sum": "$totalrevenue"}}},
+            {"$sort": {"totalrevenue": -1}},
+            {"$limit": 10}
+        ])
+    },
+    4: {
+        "description": "Trip volume and revenue by month",
+        "embedded": ("trip", [
+            {"$group": {"_id": {"$dateTrunc": {"date": "$pickup.datetime", "unit": "month"}},
+                        "tripcount": {"$sum": 1}, "totalrevenue": {"$sum": "$total"},
+                        "avgtipamount": {"$avg": "$tip"}}},
+            {"$sort": {"_id": 1}}
+        ]),
+        "flat": ("trip", [
+            {"$lookup": {"from": "time", "localField": "id", "foreignField": "tripid", "as": "time"}},
+            {"$unwind": "$time"},
+            {"$group": {"_id": {"$dateTrunc": {"date": "$time.pickupdate", "unit": "month"}},
+                        "tripcount": {"$sum": 1}, "totalrevenue": {"$sum": "$totalamount"},
+                        "avgtipamount": {"$avg": "$tipamount"}}},
+            {"$sort": {"_id": 1}}
+        ]),
+        "bucketed": ("trip_buckets", [
+            {"$group": {"_id": {"$dateTrunc": {"date": "$hour", "unit": "month"}},
+                        "tripcount": {"$sum": "$count"}, "totalrevenue": {"$sum": "$sum_total"},
+                        "sum_tip": {"$sum": "$sum_tip"}}},
+            {"$project": {"tripcount": 1, "totalrevenue": 1,
+                          "avgtipamount": {"$divide": ["$sum_tip", "$tripcount"]}}},
+            {"$sort": {"_id": 1}}
+        ])
+    },
+    5: {
+        "description": "Revenue with and without congestion surcharge",
+        "embedded": ("trip", [
+            {"$group": {"_id": {"$cond": [{"$gt": ["$congestion_surcharge", 0]}, "with surcharge", "no surcharge"]},
+                        "tripcount": {"$sum": 1}, "totalrevenue": {"$sum": "$total"},
+                        "avgtriprevenue": {"$avg": "$total"}}},
+            {"$sort": {"tripcount": -1}}
+        ]),
+        "flat": ("trip", [
+            {"$group": {"_id": {"$cond": [{"$gt": ["$congestionsurcharge", 0]}, "with surcharge", "no surcharge"]},
+                        "tripcount": {"$sum": 1}, "totalrevenue": {"$sum": "$totalamount"},
+                        "avgtriprevenue": {"$avg": "$totalamount"}}},
+            {"$sort": {"tripcount": -1}}
+        ]),
+        "bucketed": ("trip_buckets", [
+            {"$project": {"trip": {"$zip": {"inputs": ["$trips.congestion_surcharge", "$trips.total"]}}}},
+            {"$unwind": "$trip"},
+            {"$group": {"_id": {"$cond": [{"$gt": [{"$arrayElemAt": ["$trip", 0]}, 0]},
+                                          "with surcharge", "no surcharge"]},
+                        "tripcount": {"$sum": 1}, "totalrevenue": {"$sum": {"$arrayElemAt": ["$trip", 1]}},
+                        "avgtriprevenue": {"$avg": {"$arrayElemAt": ["$trip", 1]}}}},
+            {"$sort": {"tripcount": -1}}
+        ])
+    }
+}
+
+# Candidate indexes per layout, as (collection, keys); the first embedded one is the README's
+CANDIDATE_INDEXES = {
+    "embedded": {
+        "pickup_datetime_zone": ("trip", [("pickup.datetime", ASCENDING), ("pickup.location.zone", ASCENDING)]),
+        "pickup_dropoff_zone_total": ("trip", [("pickup.location.zone", ASCENDING),
+                                               ("dropoff.location.zone", ASCENDING), ("total", ASCENDING)]),
+        "payment_ratecode": ("trip", [("payment_type", ASCENDING), ("ratecode", ASCENDING)])
+    },
+    "flat": {
+        "time_tripid": ("time", [("tripid", ASCENDING)]),
+        "location_id": ("location", [("id", ASCENDING)]),
+        "trip_pickup_dropoff": ("trip", [("pickuplocation", ASCENDING), ("dropofflocation", ASCENDING)])
+    },
+    # load_buckets_to_mongo.py already indexes (hour, pickup.zone) and (pickup.zone_id, hour)
+    "bucketed": {
+        "dayofweek_zone_total": ("trip_buckets", [("day_of_week", ASCENDING), ("pickup.borough", ASCENDING),
+                                                  ("pickup.zone", ASCENDING), ("sum_total", ASCENDING)])
+    }
+}
+
+
+def to_bson(value):
+    """Postgres values BSON cannot encode: NUMERIC, DATE and TIME"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime.combine(value, time_of_day())
+    if isinstance(value, time_of_day):
+        return value.strftime("%H:%M:%S")
+    return value
+
+
+def load_flat_layout(pg_connection, mongo_client, database=FLAT_DATABASE, batch_size=10000):
+    """
+    Copy every table into its own collection, one document per row with the lower-case column names
+    :param pg_connection: psycopg2 connection to the source database
+    :param mongo_client: pymongo client
+    :param database: target Mongo database
+    :param batch_size: rows fetched per round trip and documents per insert_many
+    :return: dict of table -> documents inserted
+    """
+    inserted = {}
+    for table in FLAT_TABLES:
+        collection = mongo_client[database][table]
+        collection.drop()
+        inserted[table] = 0
+        with pg_connection.cursor(name=f"flat_{table}") as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(f"SELECT * FROM {table};")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                columns = [column[0] for column in cursor.description]
+                collection.insert_many([{c: to_bson(v) for c, v in zip(columns, row)} for row in rows], ordered=False)
+                inserted[table] += len(rows)
+        pg_connection.commit()
+        print(f"Copied {inserted[table]} rows of {table}")
+    return inserted
+
+
+def find_values(node, key):
+    """Every value stored under `key` anywhere in a nested explain document"""
+    if isinstance(node, dict):
+        for k, v in node.items():
+            if k == key:
+                yield v
+            yield from find_values(v, key)
+    elif isinstance(node, list):
+        for item in node:
+            yield from find_values(item, key)
+
+
+def summarize_explain(explain):
+    """
+    Pull the headline numbers out of an aggregate explain with executionStats
+    :param explain: explain command result
+    :return: dict of execution time, keys and documents examined and the plan stages used
+    """
+    return {
+        "execution_ms": max(find_values(explain, "executionTimeMillis"), default=None),
+        "keys_examined": sum(v for v in find_values(explain, "totalKeysExamined") if isinstance(v, int)),
+        "docs_examined": sum(v for v in find_values(explain, "totalDocsExamined") if isinstance(v, int)),
+        "stages": sorted({v for v in find_values(explain, "stage") if isinstance(v, str)})
+    }
+
+
+class MongoBenchmark:
+    def __init__(self, mongo_client, databases=None, runs=5, warmup=1, max_time_ms=600000):
+        """
+        Time the aggregation workload with and without candidate indexes
+        :param mongo_client: pymongo client
+        :param databases: dict of layout -> database name
+        :param runs: timed runs per variant
+        :param warmup: untimed runs before timing
+        :param max_time_ms: server-side time limit per aggregation
+        """
+        self.client = mongo_client
+        self.databases = databases or {"embedded": mongo_database, "flat": FLAT_DATABASE,
+                                       "bucketed": mongo_database}
+        self.runs = runs
+        self.warmup = warmup
+        self.max_time_ms = max_time_ms
+        self.results = []
+
+    def aggregate(self, database, collection, pipeline):
+        return list(self.client[database][collection].aggregate(pipeline, allowDiskUse=True,
+                                                                maxTimeMS=self.max_time_ms))
+
+    def measure(self, database, collection, pipeline):
+        """
+        Warm up, time and explain one pipeline
+        :return: dict of latency statistics and the explain summary
+        """
+        for _ in range(self.warmup):
+            self.aggregate(database, collection, pipeline)
+
+        latencies = []
+        for _ in range(self.runs):
+            start = time.perf_counter()
+            self.aggregate(database, collection, pipeline)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        explain = self.client[database].command("explain", {"aggregate": collection, "pipeline": pipeline,
+                                                            "cursor": {}, "allowDiskUse": True,
+                                                            "maxTimeMS": self.max_time_ms},
+                                                verbosity="executionStats")
+        return {
+            "runs": self.runs,
+            "min_ms": min(latencies),
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "explain": summarize_explain(explain)
+        }
+
+    def run_variant(self, number, layout, variant, indexes):
+        """
+        Measure a query with a set of indexes that are created first and dropped afterwards
+        :param number: query number in WORKLOAD
+        :param layout: "embedded", "flat" or "bucketed"
+        :param variant: label of the variant
+        :param indexes: dict of index name -> (collection, keys)
+        :return: result dict
+        """
+        database = self.databases[layout]
+        collection, pipeline = WORKLOAD[number][layout]
+        result = {"query": f"final_queries:{number}", "description": WORKLOAD[number]["description"],
+                  "layout": layout, "variant": variant, "indexes": list(indexes)}
+        try:
+            start = time.perf_counter()
+            for name, (index_collection, keys) in indexes.items():
+                self.client[database][index_collection].create_index(keys, name=name)
+            result["index_build_ms"] = (time.perf_counter() - start) * 1000
+            result.update(self.measure(database, collection, pipeline))
+        except ExecutionTimeout:
+            result["error"] = f"exceeded {self.max_time_ms} ms"
+        except OperationFailure as e:
+            result["error"] = str(e)
+        finally:
+            for name, (index_collection, _) in indexes.items():
+                try:
+                    self.client[database][index_collection].drop_index(name)
+                except OperationFailure:
+                    pass
+
+        self.results.append(result)
+        return result
+
+    def run(self, numbers=None, layouts=("embedded", "flat", "bucketed")):
+        """
+        Benchmark every query and layout: baseline first, then each candidate index, then all of them
+        :param numbers: query numbers to run, all of WORKLOAD if None
+        :param layouts: layouts to run
+        :return: list of result dicts
+        """
+        for number in numbers or sorted(WORKLOAD):
+            for layout in layouts:
+                print(f"Benchmarking query {number} on the {layout} layout: {WORKLOAD[number]['description']}")
+                baseline = self.run_variant(number, layout, "baseline", {})
+                if "error" in baseline:
+                    print(f"  baseline failed: {baseline['error']}")
+
+                candidates = CANDIDATE_INDEXES[layout]
+                for name, index in candidates.items():
+                    self.run_variant(number, layout, name, {name: index})
+                if len(candidates) > 1:
+                    self.run_variant(number, layout, "all candidates", candidates)
+
+        return self.results
+
+    def write_report(self, path="mongo_benchmark_report.json", postgres_report="benchmark_report.json"):
+        """
+        Write the results as JSON and print the best latency per query next to the Postgres numbers
+        :param path: output file
+        :param postgres_report: report of benchmark_queries.py; skipped if missing
+        :return: None
+        """
+        with open(path, "w") as f:
+            json.dump(self.results, f, indent=2, default=str)
+
+        postgres = {}
+        if os.path.exists(postgres_report):
+            with open(postgres_report) as f:
+                for r in json.load(f):
+                    if "error" not in r:
+                        postgres.setdefault(r["query"], {})[r["variant"]] = r["p50_ms"]
+
+        def best(rows):
+            timed = [r for r in rows if "error" not in r]
+            if not timed:
+                return "error", ""
+            fastest = min(timed, key=lambda r: r["p50_ms"])
+            return f"{fastest['p50_ms']:.1f}", fastest["variant"]
+
+        print(f"{'query':<18} {'pg base':>9} {'pg best':>9} {'embedded':>9} {'flat':>9} {'bucketed':>9}"
+              f"  best mongo index")
+        for query in sorted({r["query"] for r in self.results}):
+            pg = postgres.get(query, {})
+            pg_baseline = f"{pg['baseline']:.1f}" if "baseline" in pg else "-"
+            pg_best = f"{min(pg.values()):.1f}" if pg else "-"
+            embedded, embedded_variant = best([r for r in self.results if r["query"] == query
+                                               and r["layout"] == "embedded"])
+            flat, flat_variant = best([r for r in self.results if r["query"] == query and r["layout"] == "flat"])
+            bucketed, bucketed_variant = best([r for r in self.results if r["query"] == query
+                                               and r["layout"] == "bucketed"])
+            print(f"{query:<18} {pg_baseline:>9} {pg_best:>9} {embedded:>9} {flat:>9} {bucketed:>9}  "
+                  f"{embedded_variant} / {flat_variant} / {bucketed_variant}")
+        print(f"Report written to {path}")
+
+
+def main(load_flat=False, runs=5, warmup=1, report_path="mongo_benchmark_report.json"):
+    mongo_client = MongoClient(mongo_uri)
+    try:
+        if load_flat:
+            pg_connection = db.connect('mongo_source')
+            try:
+                load_flat_layout(pg_connection, mongo_client)
+            finally:
+                pg_connection.close()
+
+        benchmark = MongoBenchmark(mongo_client, runs=runs, warmup=warmup)
+        benchmark.run()
+        benchmark.write_report(report_path)
+    finally:
+        mongo_client.close()
+
+
+if __name__ == "__main__":
+    main()
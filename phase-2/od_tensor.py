@@ -0,0 +1,380 @@
+"""
+Dense origin-destination tensors over the taxi zones.
+
+There are only 265 zones, 24 hours and 7 days, so every route question fits in a
+dense array indexed by [pickup zone, dropoff zone, hour, day of week]. The engine keeps
+one such tensor per measure: trip count and the sums of total amount, fare and tip.
+Route, hotspot and temporal queries then become array slices and sums instead of
+grouping 44M trips and joining `location` twice (query 3 of `final_queries.sql`).
+
+Tensors are memory-mapped .npy files, one set per month plus a running total:
+    od_tensor/
+        manifest.json       months built, with their row counts and source
+        2023-01/count.npy   int64 [266, 266, 24, 7]; index 0 is unused, zone IDs index directly
+        2023-01/totalamount.npy, fareamount.npy, tipamount.npy   float64, same shape
+        total/...           sum of all months
+A month is filled in one streaming pass: each batch is reduced with np.unique and
+np.bincount to the cells it touches, and those cells are added to the tensors. Rebuilding
+a month subtracts its old tensors from the total before adding the new ones, so months
+can be loaded one at a time as they arrive.
+
+Class `ZoneLookup`:
+    - Decodes zone IDs to borough and zone names from `taxi_zone_lookup.csv`.
+Class `ODTensorStore`:
+    - `build_month`: streams one month of trips from Postgres or from a TLC Parquet file.
+    - `top_routes`, `hotspots`, `temporal_profile`, `route`, `top_zone_per_borough`:
+      queries over all months or a list of months, optionally restricted to hours and
+      days of the week. Route and zone marginals are cached per selection, so repeated
+      queries are answered from a 266x266 matrix.
+
+Requirements:
+- `numpy` and `pandas`; `pyarrow` for the Parquet source; `psycopg2` for the database source.
+
+HOW TO RUN:
+1) Set the database credentials in db.ini or the environment (see common/db.py), or
+   pass Parquet files to `main`. Point ZONE_LOOKUP at taxi_zone_lookup.csv.
+2) Run this File; months already in the manifest are skipped unless `rebuild` is set.
+"""
+
+import json
+import os
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'DataReader'))
+from common import db  # noqa: E402
+from cleaning_rules import LOCATION_RULES, TRIP_RULES, apply_rules, location_remap  # noqa: E402
+
+TENSOR_DIR = "od_tensor"
+ZONE_LOOKUP = os.path.join("raw_data", "taxi_zone_lookup.csv")
+
+NUM_ZONES = 266
+SHAPE = (NUM_ZONES, NUM_ZONES, 24, 7)
+MEASURES = {"count": np.int64, "totalamount": np.float64, "fareamount": np.float64, "tipamount": np.float64}
+DAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+# One month of trips; dayofweek is Monday = 0 as the loader stores it
+MONTH_QUERY = """
+    SELECT tr.pickuplocation, tr.dropofflocation, EXTRACT(HOUR FROM t.pickuptime)::int, t.dayofweek,
+           tr.totalamount::float8, tr.fareamount::float8, tr.tipamount::float8
+    FROM trip tr
+    JOIN time t ON t.tripid = tr.id
+    WHERE t.pickupdate >= %s AND t.pickupdate < %s
+"""
+BATCH_COLUMNS = ["pickup", "dropoff", "hour", "dayofweek", "totalamount", "fareamount", "tipamount"]
+PARQUET_COLUMNS = ["PULocationID", "DOLocationID", "tpep_pickup_datetime", "tpep_dropoff_datetime",
+                   "passenger_count", "trip_distance", "improvement_surcharge", "VendorID", "payment_type",
+                   "RatecodeID", "total_amount", "fare_amount", "tip_amount"]
+
+
+class ZoneLookup:
+    def __init__(self, path=ZONE_LOOKUP):
+        """
+        Zone names by LocationID
+        :param path: taxi_zone_lookup.csv
+        """
+        lookup = pd.read_csv(path)
+        self.frame = lookup.rename(columns={"LocationID": "ID"})
+        self.borough = dict(zip(self.frame["ID"], self.frame["Borough"]))
+        self.zone = dict(zip(self.frame["ID"], self.frame["Zone"]))
+
+    def name(self, zone_id):
+        return f"{self.zone.get(zone_id)} ({self.borough.get(zone_id)})"
+
+    def zones_in(self, borough):
+        return np.array([zone_id for zone_id, b in self.borough.items() if b == borough], dtype=np.int64)
+
+    def boroughs(self):
+        return sorted(b for b in set(self.borough.values()) if isinstance(b, str))
+
+
+class ODTensorStore:
+    def __init__(self, directory=TENSOR_DIR, lookup=None):
+        """
+        :param directory: folder of the monthly tensors and the manifest
+        :param lookup: ZoneLookup used to decode query results; IDs are returned if None
+        """
+        self.directory = directory
+        self.lookup = lookup
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = {"shape": list(SHAPE), "measures": list(MEASURES), "months": {}}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        self.marginals = {}
+
+    def tensor_path(self, part, measure):
+        return os.path.join(self.directory, part, f"{measure}.npy")
+
+    def open_tensors(self, part, mode="r"):
+        """
+        Memory-map the tensors of a month or of the total
+        :param part: "YYYY-MM" or "total"
+        :param mode: "r" to read, "r+" to update, "w+" to create zeroed tensors
+        :return: dict of measure -> memmap
+        """
+        if mode == "w+":
+            os.makedirs(os.path.join(self.directory, part), exist_ok=True)
+            return {measure: np.lib.format.open_memmap(self.tensor_path(part, measure), mode="w+",
+                                                       dtype=dtype, shape=SHAPE)
+                    for measure, dtype in MEASURES.items()}
+        return {measure: np.load(self.tensor_path(part, measure), mmap_mode=mode) for measure in MEASURES}
+
+    def save_manifest(self):
+        with open(self.manifest_path, "w") as f:
+            json.dump(self.manifest, f, indent=2)
+
+    @staticmethod
+    def add_batch(tensors, batch):
+        """
+        Add a batch of trips to the tensors
+        :param tensors: dict of measure -> writable tensor
+        :param batch: frame with BATCH_COLUMNS
+        :return: rows added
+        """
+        valid = (batch["pickup"].between(1, NUM_ZONES - 1) & batch["dropoff"].between(1, NUM_ZONES - 1) &
+                 batch["hour"].between(0, 23) & batch["dayofweek"].between(0, 6))
+        batch = batch[valid]
+        if batch.empty:
+            return 0
+
+        flat = np.ravel_multi_index((batch["pickup"].to_numpy(np.int64), batch["dropoff"].to_numpy(np.int64),
+                                     batch["hour"].to_numpy(np.int64), batch["dayofweek"].to_numpy(np.int64)),
+                                    SHAPE)
+        # Reduce the batch to the cells it touches, so each update is a small fancy-indexed add
+        cells, slots = np.unique(flat, return_inverse=True)
+        tensors["count"].reshape(-1)[cells] += np.bincount(slots, minlength=len(cells))
+        for measure in ("totalamount", "fareamount", "tipamount"):
+            weights = batch[measure].fillna(0).to_numpy(np.float64)
+            tensors[measure].reshape(-1)[cells] += np.bincount(slots, weights=weights, minlength=len(cells))
+        return len(batch)
+
+    def postgres_batches(self, conn, month_start, batch_size):
+        month_end = month_start + pd.DateOffset(months=1)
+        for rows in db.stream(conn, MONTH_QUERY, (month_start.date(), month_end.date()), batch_size=batch_size,
+                              name="od_tensor_trips"):
+            yield pd.DataFrame(rows, columns=BATCH_COLUMNS)
+        conn.commit()
+
+    @staticmethod
+    def parquet_batches(path, month_start, zone_lookup, batch_size):
+        """
+        Trips of a TLC Parquet file, cleaned with the loader's rules and restricted to the month
+        """
+        import pyarrow.parquet as pq
+
+        locations = zone_lookup.frame
+        remap = location_remap(locations)
+        kept_locations, _, _ = apply_rules(locations, LOCATION_RULES)
+        context = {"location_ids": kept_locations["ID"]}
+        month_end = month_start + pd.DateOffset(months=1)
+
+        parquet_file = pq.ParquetFile(path)
+        columns = [c for c in PARQUET_COLUMNS if c in parquet_file.schema_arrow.names]
+        for record_batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+            df = record_batch.to_pandas()
+            df[["PULocationID", "DOLocationID"]] = df[["PULocationID", "DOLocationID"]].replace(remap)
+            df, _, _ = apply_rules(df, TRIP_RULES, context)
+            pickup = df["tpep_pickup_datetime"]
+            df = df[(pickup >= month_start) & (pickup < month_end)]
+            yield pd.DataFrame({
+                "pickup": df["PULocationID"].astype(np.int64),
+                "dropoff": df["DOLocationID"].astype(np.int64),
+                "hour": df["tpep_pickup_datetime"].dt.hour,
+                "dayofweek": df["tpep_pickup_datetime"].dt.dayofweek,
+                "totalamount": df["total_amount"],
+                "fareamount": df["fare_amount"],
+                "tipamount": df["tip_amount"]
+            })
+
+    def build_month(self, month, conn=None, parquet_file=None, batch_size=500000, rebuild=False):
+        """
+        Build the tensors of one month in a single streaming pass and fold them into the total
+        :param month: "YYYY-MM"
+        :param conn: psycopg2 connection, to read the loaded trips
+        :param parquet_file: TLC Parquet file to read instead of the database
+        :param batch_size: rows per batch
+        :param rebuild: rebuild a month that is already in the manifest
+        :return: number of trips added
+        """
+        if month in self.manifest["months"] and not rebuild:
+            print(f"{month} already built, skipping")
+            return 0
+
+        month_start = pd.Timestamp(month + "-01")
+        if parquet_file:
+            if self.lookup is None:
+                raise ValueError("The Parquet source needs a ZoneLookup for the cleaning rules")
+            batches = self.parquet_batches(parquet_file, month_start, self.lookup, batch_size)
+        else:
+            batches = self.postgres_batches(conn, month_start, batch_size)
+
+        started = time.time()
+        # Built under a temporary name, so a failed build leaves the old month and total intact
+        staging = f"{month}.building"
+        tensors = self.open_tensors(staging, "w+")
+        rows = 0
+        for batch in batches:
+            rows += self.add_batch(tensors, batch)
+        for tensor in tensors.values():
+            tensor.flush()
+
+        total_exists = os.path.exists(self.tensor_path("total", "count"))
+        total = self.open_tensors("total", "r+" if total_exists else "w+")
+        previous = self.open_tensors(month) if month in self.manifest["months"] else None
+        for measure in MEASURES:
+            if previous is not None:
+                total[measure] -= previous[measure]
+            total[measure] += tensors[measure]
+            total[measure].flush()
+        del tensors, previous
+
+        os.makedirs(os.path.join(self.directory, month), exist_ok=True)
+        for measure in MEASURES:
+            os.replace(self.tensor_path(staging, measure), self.tensor_path(month, measure))
+        os.rmdir(os.path.join(self.directory, staging))
+
+        self.manifest["months"][month] = {"rows": rows, "source": parquet_file or "postgres",
+                                          "built": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        self.save_manifest()
+        self.marginals.clear()
+        print(f"Built {month}: {rows} trips in {time.time() - started:.1f}s")
+        return rows
+
+    def select(self, measure, months=None, hours=None, days=None):
+        """
+        The tensor of a measure over the chosen months, sliced to the chosen hours and days
+        :param measure: key of MEASURES
+        :param months: list of "YYYY-MM", None for all months
+        :param hours: list of hours, None for all
+        :param days: list of days of the week (Monday = 0), None for all
+        :return: array [pickup, dropoff, hours, days]
+        """
+        if months is None:
+            tensor = self.open_tensors("total")[measure]
+        else:
+            tensor = sum(np.asarray(self.open_tensors(month)[measure]) for month in months)
+        if hours is not None:
+            tensor = tensor[:, :, hours, :]
+        if days is not None:
+            tensor = tensor[:, :, :, days]
+        return tensor
+
+    def route_matrix(self, measure, months=None, hours=None, days=None):
+        """
+        [pickup, dropoff] totals of a measure, cached per selection
+        """
+        key = ("routes", measure, tuple(months or ()), tuple(hours or ()), tuple(days or ()))
+        if key not in self.marginals:
+            self.marginals[key] = np.asarray(self.select(measure, months, hours, days).sum(axis=(2, 3)))
+        return self.marginals[key]
+
+    def decode(self, zone_id):
+        return self.lookup.name(zone_id) if self.lookup else int(zone_id)
+
+    def top_routes(self, n=10, measure="totalamount", months=None, hours=None, days=None):
+        """
+        :return: list of (pickup, dropoff, value), the n largest routes by measure
+        """
+        matrix = self.route_matrix(measure, months, hours, days)
+        flat = matrix.reshape(-1)
+        top = np.argpartition(flat, -n)[-n:]
+        top = top[np.argsort(flat[top])[::-1]]
+        return [(self.decode(p), self.decode(d), flat[i].item())
+                for i in top for p, d in [np.unravel_index(i, matrix.shape)] if flat[i] > 0]
+
+    def hotspots(self, n=10, measure="count", by="pickup", months=None, hours=None, days=None):
+        """
+        :param by: "pickup" or "dropoff"
+        :return: list of (zone, value), the n busiest zones
+        """
+        totals = self.route_matrix(measure, months, hours, days).sum(axis=1 if by == "pickup" else 0)
+        top = np.argsort(totals)[::-1][:n]
+        return [(self.decode(zone_id), totals[zone_id].item()) for zone_id in top if totals[zone_id] > 0]
+
+    def temporal_profile(self, measure="count", pickup=None, dropoff=None, months=None):
+        """
+        :param pickup: pickup zone IDs, None for all
+        :param dropoff: dropoff zone IDs, None for all
+        :return: array [24, 7] of the measure by hour and day of week
+        """
+        tensor = self.select(measure, months)
+        if pickup is not None:
+            tensor = tensor[np.atleast_1d(pickup)]
+        if dropoff is not None:
+            tensor = tensor[:, np.atleast_1d(dropoff)]
+        return np.asarray(tensor.sum(axis=(0, 1)))
+
+    def route(self, pickup, dropoff, months=None, hours=None, days=None):
+        """
+        :return: dict of measure -> total for one route, plus the average fare and tip
+        """
+        result = {measure: self.select(measure, months, hours, days)[pickup, dropoff].sum().item()
+                  for measure in MEASURES}
+        if result["count"]:
+            result["avg_fareamount"] = result["fareamount"] / result["count"]
+            result["avg_tipamount"] = result["tipamount"] / result["count"]
+        return result
+
+    def top_zone_per_borough(self, measure="totalamount", months=None):
+        """
+        Query 1 of final_queries.sql: the pickup zone of each borough with the highest measure per weekday
+        :return: list of (borough, day name, zone, value)
+        """
+        by_zone_day = np.asarray(self.select(measure, months).sum(axis=(1, 2)))
+        result = []
+        for borough in self.lookup.boroughs():
+            zones = self.lookup.zones_in(borough)
+            zones = zones[zones < NUM_ZONES]
+            for day in range(7):
+                values = by_zone_day[zones, day]
+                best = zones[np.argmax(values)]
+                if values.max() > 0:
+                    result.append((borough, DAY_NAMES[day], self.lookup.zone.get(best), by_zone_day[best, day].item()))
+        return result
+
+
+def main(parquet_files=None, months=None, rebuild=False):
+    """
+    :param parquet_files: TLC Parquet files to build from; the loaded database is used if None
+    :param months: months to build from the database, "YYYY-MM"; all loaded months if None
+    :param rebuild: rebuild months that are already built
+    """
+    store = ODTensorStore(lookup=ZoneLookup())
+    if parquet_files:
+        for path in parquet_files:
+            month = re.search(r'(\d{4}-\d{2})\.parquet$', path).group(1)
+            store.build_month(month, parquet_file=path, rebuild=rebuild)
+    else:
+        conn = db.connect(tuning=db.ANALYTICS)
+        try:
+            if months is None:
+                cursor = conn.cursor()
+                cursor.execute("SELECT DISTINCT to_char(pickupdate, 'YYYY-MM') FROM time ORDER BY 1;")
+                months = [row[0] for row in cursor.fetchall()]
+            for month in months:
+                store.build_month(month, conn=conn, rebuild=rebuild)
+        finally:
+            conn.close()
+
+    started = time.perf_counter()
+    routes = store.top_routes(10)
+    print(f"Top 10 routes by revenue ({(time.perf_counter() - started) * 1000:.1f} ms):")
+    for pickup, dropoff, revenue in routes:
+        print(f"  {pickup} -> {dropoff}: {revenue:,.0f}")
+
+    started = time.perf_counter()
+    hotspots = store.hotspots(10, hours=[17, 18, 19], days=[0, 1, 2, 3, 4])
+    print(f"Busiest weekday evening pickup zones ({(time.perf_counter() - started) * 1000:.1f} ms):")
+    for zone, trips in hotspots:
+        print(f"  {zone}: {trips:,}")
+
+
+if __name__ == "__main__":
+    main()
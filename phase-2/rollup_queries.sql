@@ -0,0 +1,128 @@
+-- The queries of final_queries.sql and Queries.sql rewritten against the rollups built by rollups.py.
+-- Joins to the dimension tables now happen on the aggregated rows instead of on every trip.
+-- Averages are recomputed as sum / n, where n counts the non-null values as AVG does.
+
+--1. This query finds the zone in each borough that earned the highest total TotalAmount on each day of the week.
+WITH EarningsPerZone AS (
+    SELECT
+        l.borough,
+        l.zone,
+        rt.dayofweek,
+        SUM(rt.totalamount_sum) AS totalearnings
+    FROM rollup_time rt
+    JOIN location l ON rt.pickuplocation = l.id
+    GROUP BY l.borough, l.zone, rt.dayofweek
+)
+
+SELECT
+    epz.borough,
+    epz.zone,
+    epz.dayofweek,
+    epz.totalearnings
+FROM EarningsPerZone epz
+WHERE epz.totalearnings = (
+    SELECT MAX(totalearnings)
+    FROM EarningsPerZone epz2
+    WHERE epz2.dayofweek = epz.dayofweek
+    AND epz2.borough = epz.borough
+)
+ORDER BY epz.dayofweek, epz.totalearnings DESC;
+
+--2. This query calculates the average TripDistance and FareAmount grouped by both PaymentType and Ratecode.
+select p.description as paymenttype, r.description as ratecode,
+	sum(rt.tripdistance_sum) / nullif(sum(rt.tripdistance_n), 0) as avgtripdistance,
+	sum(rt.fareamount_sum) / nullif(sum(rt.fareamount_n), 0) as avgfareamount
+from rollup_trip rt
+join payment p on rt.paymenttype = p.id
+join ratecode r on rt.ratecode = r.id
+group by p.description, r.description
+order by avgfareamount;
+
+--3. Identify the top 10 most profitable trip routes by total revenue.
+select originlocation.zone as originzone,
+	destlocation.zone as destzone,
+	sum(rt.totalamount_sum) as totalrevenue
+from rollup_trip rt
+join location as originlocation on rt.pickuplocation = originlocation.id
+join location as destlocation on rt.dropofflocation = destlocation.id
+group by originzone, destzone
+order by totalrevenue desc
+limit 10;
+
+--4. Analyze trip volume and revenue trends over time.
+select date_trunc('month', rt.pickupdate) as monthyear,
+	sum(rt.tripcount) as tripcount,
+	sum(rt.totalamount_sum) as totalrevenue,
+	sum(rt.tipamount_sum) / nullif(sum(rt.tipamount_n), 0) as avgtipamount
+from rollup_time rt
+group by monthyear
+order by monthyear;
+
+--5. Analyze the impact of congestion surcharges on trip revenue.
+select
+	case when rt.hassurcharge then 'with surcharge' else 'no surcharge' end as surchargestatus,
+	sum(rt.tripcount) as tripcount,
+	sum(rt.totalamount_sum) as totalrevenue,
+	sum(rt.totalamount_sum) / nullif(sum(rt.totalamount_n), 0) as avgtriprevenue
+from rollup_trip rt
+group by surchargestatus
+order by tripcount desc;
+
+
+-- Queries.sql
+
+-- This query calculates the total FareAmount for each day of the week across all trips.
+select rt.dayofweek, sum(rt.fareamount_sum) as totalfareamount
+from rollup_time rt
+group by rt.dayofweek
+order by rt.dayofweek;
+
+-- This query finds the average TipAmount for each Borough where passengers were picked up.
+select l.borough, sum(rt.tipamount_sum) / nullif(sum(rt.tipamount_n), 0) as avgtipamount
+from rollup_trip rt
+join location l on rt.pickuplocation = l.id
+group by l.borough
+order by avgtipamount desc;
+
+-- This query shows the count of trips for each PaymentType
+select p.description as paymenttype, sum(rt.tripcount) as tripcount
+from rollup_trip rt
+join payment p on rt.paymenttype = p.id
+group by p.description
+order by tripcount desc;
+
+-- This query counts the number of trips taken on weekends versus weekdays.
+select
+	case
+		when rt.isweekend = 'true' then 'weekend'
+		else 'weekday'
+	end as daytype,
+	sum(rt.tripcount) as tripcount
+from rollup_time rt
+group by daytype
+order by daytype;
+
+-- This query identifies the peak hours in terms of trip count for each borough, differentiating between weekdays and weekends.
+WITH HourlyCounts AS (
+    SELECT
+        l.borough,
+        CASE
+            WHEN rt.isweekend = 'true' THEN 'weekend'
+            ELSE 'weekday'
+        END AS daytype,
+        rt.pickuphour AS hour,
+        SUM(rt.tripcount) AS tripcount
+    FROM rollup_time rt
+    JOIN location l ON rt.pickuplocation = l.id
+    GROUP BY l.borough, daytype, rt.pickuphour
+)
+
+SELECT hc.borough, hc.daytype, hc.hour, hc.tripcount
+FROM HourlyCounts hc
+WHERE hc.tripcount = (
+    SELECT MAX(hc2.tripcount)
+    FROM HourlyCounts hc2
+    WHERE hc2.borough = hc.borough
+    AND hc2.daytype = hc.daytype
+)
+ORDER BY hc.borough, hc.daytype, hc.hour;
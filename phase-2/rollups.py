@@ -0,0 +1,228 @@
+"""
+Pre-aggregated rollup tables for the phase-2 analytical queries.
+
+Every query in `final_queries.sql` and `Queries.sql` aggregates the full trip
+table, and indexes did not help (see `indexes.sql`). The rollups below hold
+the same aggregates at coarser grains, and `rollup_queries.sql` rewrites the
+queries to read from them.
+
+Rollups:
+    - `rollup_trip`: trip-only grain (pickup zone, dropoff zone, payment type,
+      ratecode, has surcharge). Serves the route, payment/ratecode, surcharge
+      and borough tip queries, which never join Time.
+    - `rollup_time`: Trip joined with Time at (pickup zone, pickup date, hour,
+      day of week, weekend). Serves the day-of-week, monthly and peak-hour
+      queries. It keeps the inner join the original queries use.
+
+Each rollup stores counts and sums. Averages are rebuilt as sum / n, where n
+counts the non-null values the way AVG does.
+
+Class `RollupManager`:
+    - `create`: creates the rollup and state tables.
+    - `refresh`: folds trips with an ID above the last watermark into the
+      rollups with INSERT ... ON CONFLICT DO UPDATE. This is cheap after a
+      monthly load.
+    - `rebuild`: truncates and recomputes. Use it after deletes such as
+      `clean_data.py`, which an ID watermark cannot see.
+
+Requirements:
+- `psycopg2` library for PostgreSQL connection handling.
+- PostgreSQL 15+ (unique indexes with NULLS NOT DISTINCT).
+
+HOW TO RUN:
+1) Set the database credentials in db.ini or the environment (see common/db.py).
+2) Run this File once after loading; run it again after each load to refresh.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import db  # noqa: E402
+
+ROLLUPS = {
+    "rollup_trip": {
+        "grain": ["pickuplocation", "dropofflocation", "paymenttype", "ratecode", "hassurcharge"],
+        "ddl": """
+            CREATE TABLE IF NOT EXISTS rollup_trip (
+                pickuplocation INT,
+                dropofflocation INT,
+                paymenttype INT,
+                ratecode INT,
+                hassurcharge BOOLEAN,
+                tripcount BIGINT NOT NULL DEFAULT 0,
+                totalamount_sum NUMERIC NOT NULL DEFAULT 0,
+                totalamount_n BIGINT NOT NULL DEFAULT 0,
+                fareamount_sum NUMERIC NOT NULL DEFAULT 0,
+                fareamount_n BIGINT NOT NULL DEFAULT 0,
+                tipamount_sum NUMERIC NOT NULL DEFAULT 0,
+                tipamount_n BIGINT NOT NULL DEFAULT 0,
+                tripdistance_sum NUMERIC NOT NULL DEFAULT 0,
+                tripdistance_n BIGINT NOT NULL DEFAULT 0
+            );
+        """,
+        "select": """
+            SELECT tr.pickuplocation,
+                   tr.dropofflocation,
+                   tr.paymenttype,
+                   tr.ratecode,
+                   COALESCE(tr.congestionsurcharge > 0, false),
+                   COUNT(*),
+                   COALESCE(SUM(tr.totalamount), 0), COUNT(tr.totalamount),
+                   COALESCE(SUM(tr.fareamount), 0), COUNT(tr.fareamount),
+                   COALESCE(SUM(tr.tipamount), 0), COUNT(tr.tipamount),
+                   COALESCE(SUM(tr.tripdistance), 0), COUNT(tr.tripdistance)
+            FROM trip tr
+            WHERE tr.id > %(low)s AND tr.id <= %(high)s
+            GROUP BY 1, 2, 3, 4, 5
+        """,
+        "measures": ["tripcount", "totalamount_sum", "totalamount_n", "fareamount_sum", "fareamount_n",
+                     "tipamount_sum", "tipamount_n", "tripdistance_sum", "tripdistance_n"]
+    },
+    "rollup_time": {
+        "grain": ["pickuplocation", "pickupdate", "pickuphour", "dayofweek", "isweekend"],
+        "ddl": """
+            CREATE TABLE IF NOT EXISTS rollup_time (
+                pickuplocation INT,
+                pickupdate DATE,
+                pickuphour SMALLINT,
+                dayofweek INT,
+                isweekend BOOLEAN,
+                tripcount BIGINT NOT NULL DEFAULT 0,
+                totalamount_sum NUMERIC NOT NULL DEFAULT 0,
+                fareamount_sum NUMERIC NOT NULL DEFAULT 0,
+                tipamount_sum NUMERIC NOT NULL DEFAULT 0,
+                tipamount_n BIGINT NOT NULL DEFAULT 0
+            );
+        """,
+        "select": """
+            SELECT tr.pickuplocation,
+                   t.pickupdate,
+                   EXTRACT(HOUR FROM t.pickuptime)::smallint,
+                   t.dayofweek,
+                   t.isweekend,
+                   COUNT(*),
+                   COALESCE(SUM(tr.totalamount), 0),
+                   COALESCE(SUM(tr.fareamount), 0),
+                   COALESCE(SUM(tr.tipamount), 0), COUNT(tr.tipamount)
+            FROM trip tr
+            JOIN time t ON tr.id = t.tripid
+            WHERE tr.id > %(low)s AND tr.id <= %(high)s
+            GROUP BY 1, 2, 3, 4, 5
+        """,
+        "measures": ["tripcount", "totalamount_sum", "fareamount_sum", "tipamount_sum", "tipamount_n"]
+    }
+}
+
+
+class RollupManager:
+    def __init__(self, db_connection):
+        """
+        Build and maintain the rollup tables
+        :param db_connection: psycopg2 connection to the trip database
+        """
+        self.conn = db_connection
+
+    def create(self):
+        """
+        Create the rollup tables, their grain indexes and the watermark table
+        :return: None
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS rollup_state (
+                rollup_name VARCHAR PRIMARY KEY,
+                last_trip_id BIGINT NOT NULL,
+                refreshed_at TIMESTAMP DEFAULT now()
+            );
+        """)
+        for name, rollup in ROLLUPS.items():
+            cursor.execute(rollup["ddl"])
+            # The grain index is what ON CONFLICT merges on; NULL keys must merge too
+            cursor.execute(f"""
+                CREATE UNIQUE INDEX IF NOT EXISTS {name}_grain_idx
+                ON {name} ({', '.join(rollup['grain'])}) NULLS NOT DISTINCT;
+            """)
+            cursor.execute("""
+                INSERT INTO rollup_state (rollup_name, last_trip_id) VALUES (%s, -1)
+                ON CONFLICT (rollup_name) DO NOTHING;
+            """, (name,))
+        self.conn.commit()
+
+    def refresh_rollup(self, name, high):
+        """
+        Fold the trips above the rollup's watermark into it
+        :param name: key of ROLLUPS
+        :param high: highest trip ID to include
+        :return: number of rollup rows inserted or updated
+        """
+        rollup = ROLLUPS[name]
+        cursor = self.conn.cursor()
+
+        # Lock the watermark so two refreshes cannot fold the same trips twice
+        cursor.execute("SELECT last_trip_id FROM rollup_state WHERE rollup_name = %s FOR UPDATE;", (name,))
+        low = cursor.fetchone()[0]
+        if high is None or high <= low:
+            self.conn.commit()
+            return 0
+
+        columns = rollup["grain"] + rollup["measures"]
+        updates = ', '.join(f"{m} = r.{m} + EXCLUDED.{m}" for m in rollup["measures"])
+        cursor.execute(f"""
+            INSERT INTO {name} AS r ({', '.join(columns)})
+            {rollup['select']}
+            ON CONFLICT ({', '.join(rollup['grain'])}) DO UPDATE
+            SET {updates};
+        """, {"low": low, "high": high})
+        rows = cursor.rowcount
+
+        cursor.execute("""
+            UPDATE rollup_state SET last_trip_id = %s, refreshed_at = now() WHERE rollup_name = %s;
+        """, (high, name))
+        self.conn.commit()
+        return rows
+
+    def refresh(self):
+        """
+        Incrementally refresh every rollup up to the current highest trip ID
+        :return: None
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT MAX(id) FROM trip;")
+        high = cursor.fetchone()[0]
+
+        for name in ROLLUPS:
+            rows = self.refresh_rollup(name, high)
+            print(f"Refreshed {name}: {rows} rows merged")
+
+        cursor.execute("ANALYZE rollup_trip; ANALYZE rollup_time;")
+        self.conn.commit()
+
+    def rebuild(self):
+        """
+        Recompute every rollup from scratch
+        :return: None
+        """
+        cursor = self.conn.cursor()
+        for name in ROLLUPS:
+            cursor.execute(f"TRUNCATE {name};")
+            cursor.execute("UPDATE rollup_state SET last_trip_id = -1 WHERE rollup_name = %s;", (name,))
+        self.conn.commit()
+        self.refresh()
+
+
+def main(rebuild=False):
+    conn = db.connect(tuning=db.BULK)
+    try:
+        manager = RollupManager(conn)
+        manager.create()
+        if rebuild:
+            manager.rebuild()
+        else:
+            manager.refresh()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
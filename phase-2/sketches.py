@@ -0,0 +1,473 @@
+"""
+Approximate query mode: mergeable sketches for distinct counts, quantiles and heavy hitters.
+
+Exact answers to "how many distinct drop-off zones", "fare percentiles by borough"
+or "top routes by revenue" (query 3 of `final_queries.sql`) need full sorts or large
+hash aggregates over every trip. The sketches here are built once, like the rollups
+in `rollups.py`. They then answer these questions from a few kilobytes per key, and
+every answer carries an error bound.
+
+Sketches:
+    - `HyperLogLog`: distinct counts, relative standard error 1.04 / sqrt(2^precision).
+    - `QuantileSketch`: logarithmic buckets (DDSketch). Any quantile is returned within
+      a relative error `relative_accuracy` of a value from the data.
+    - `CountMinSketch`: per-key weight. It never underestimates, and overestimates by more
+      than epsilon * total weight with probability at most delta.
+    - `HeavyHitters`: mergeable Misra-Gries / Space-Saving summary of the k heaviest
+      keys. Each key has a lower bound and an upper bound that differ by at most
+      total / (k + 1).
+All four are mergeable. Merging HyperLogLog, quantile and Count-Min sketches of two
+partitions gives exactly the sketch of their union; merged heavy hitters keep their bounds.
+
+Class `SketchStore`:
+    - Per (pickup date, pickup zone): HyperLogLog of drop-off zones, and quantile
+      sketches of fare, tip and distance.
+    - Per pickup date: Count-Min and heavy hitters of routes weighted by revenue, with
+      negative totals (refunds) counted as 0.
+    - `build`: folds the trips above the stored trip ID watermark, so it can be rerun
+      after each load. `merge` combines stores built for different months.
+    - `distinct_dropoffs`, `quantile`, `top_routes`, `route_revenue`: merge the keys in
+      range and return (estimate, error bound).
+
+Requirements:
+- `numpy`, `pandas` and `psycopg2`.
+
+HOW TO RUN:
+1) Set the database credentials in db.ini or the environment (see common/db.py).
+2) Run this File to build or refresh sketches.pkl and print a few approximate answers.
+"""
+
+import copy
+import math
+import os
+import pickle
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import db  # noqa: E402
+
+SKETCH_FILE = "sketches.pkl"
+QUANTILE_COLUMNS = ["fareamount", "tipamount", "tripdistance"]
+
+
+def mix64(values):
+    """
+    SplitMix64 finalizer: a fast, well-distributed 64-bit hash of integer keys
+    :param values: array of integers
+    :return: uint64 array
+    """
+    with np.errstate(over="ignore"):
+        x = np.asarray(values).astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def bit_length(values):
+    """
+    Exact bit length of each uint64, by binary search on the shifts
+    :param values: uint64 array
+    :return: int array
+    """
+    x = values.copy()
+    length = np.zeros(len(x), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = x >= (np.uint64(1) << np.uint64(shift))
+        length[high] += shift
+        x[high] >>= np.uint64(shift)
+    return length + (x > 0)
+
+
+class HyperLogLog:
+    def __init__(self, precision=10):
+        """
+        Distinct count sketch with 2^precision one-byte registers
+        :param precision: bits of the hash used to pick a register
+        """
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, values):
+        hashes = mix64(values)
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.intp)
+        # Rank of the first set bit in the remaining 64 - precision bits
+        remainder = hashes << np.uint64(self.precision)
+        rank = np.minimum(64 - bit_length(remainder) + 1, 64 - self.precision + 1)
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        # Linear counting is more accurate while many registers are still empty
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return estimate
+
+    def error_bound(self):
+        """
+        :return: relative standard error of count()
+        """
+        return 1.04 / math.sqrt(len(self.registers))
+
+
+class QuantileSketch:
+    def __init__(self, relative_accuracy=0.01):
+        """
+        Quantiles with relative error guarantees, from logarithmically sized buckets
+        :param relative_accuracy: every returned quantile is within this relative error
+        """
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+
+    def add_to(self, store, magnitudes):
+        buckets, counts = np.unique(np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64),
+                                    return_counts=True)
+        for bucket, count in zip(buckets.tolist(), counts.tolist()):
+            store[bucket] = store.get(bucket, 0) + count
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.add_to(self.positive, values[values > 0])
+        self.add_to(self.negative, -values[values < 0])
+        self.zeros += int(np.count_nonzero(values == 0))
+        self.count += len(values)
+
+    def merge(self, other):
+        for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+            for bucket, count in other_store.items():
+                store[bucket] = store.get(bucket, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        return self
+
+    def bucket_value(self, bucket):
+        return 2 * self.gamma ** bucket / (self.gamma + 1)
+
+    def quantile(self, q):
+        """
+        :param q: quantile in [0, 1]
+        :return: approximate value, or None for an empty sketch
+        """
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        # Ascending value order: large negatives, zeros, then positives
+        for bucket in sorted(self.negative, reverse=True):
+            seen += self.negative[bucket]
+            if seen > rank:
+                return -self.bucket_value(bucket)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for bucket in sorted(self.positive):
+            seen += self.positive[bucket]
+            if seen > rank:
+                return self.bucket_value(bucket)
+        return self.bucket_value(max(self.positive))
+
+
+class CountMinSketch:
+    def __init__(self, epsilon=0.001, delta=0.01):
+        """
+        Point estimates of per-key weight
+        :param epsilon: overestimate bound as a fraction of the total weight
+        :param delta: probability of exceeding that bound
+        """
+        self.width = math.ceil(math.e / epsilon)
+        self.depth = math.ceil(math.log(1 / delta))
+        self.epsilon = epsilon
+        self.delta = delta
+        self.table = np.zeros((self.depth, self.width), dtype=np.float64)
+        self.seeds = mix64(np.arange(self.depth))
+        self.total = 0.0
+
+    def columns(self, keys, row):
+        return (mix64(np.asarray(keys, dtype=np.uint64) ^ self.seeds[row]) % np.uint64(self.width)).astype(np.intp)
+
+    def add(self, keys, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        for row in range(self.depth):
+            np.add.at(self.table[row], self.columns(keys, row), weights)
+        self.total += float(weights.sum())
+
+    def merge(self, other):
+        self.table += other.table
+        self.total += other.total
+        return self
+
+    def estimate(self, key):
+        return min(self.table[row, self.columns([key], row)[0]] for row in range(self.depth))
+
+    def error_bound(self):
+        """
+        :return: overestimate that is exceeded with probability at most delta
+        """
+        return self.epsilon * self.total
+
+
+class HeavyHitters:
+    def __init__(self, k=200):
+        """
+        Mergeable summary of the k heaviest keys
+        :param k: counters kept
+        """
+        self.k = k
+        self.counters = {}
+        # Weight subtracted from every counter so far; bounds the undercount of any key
+        self.error = 0.0
+        self.total = 0.0
+
+    def merge_counters(self, counters, error):
+        for key, weight in counters.items():
+            self.counters[key] = self.counters.get(key, 0.0) + weight
+        self.error += error
+
+        if len(self.counters) > self.k:
+            # Subtract the (k+1)-th largest counter from all and keep the positive ones
+            cut = sorted(self.counters.values(), reverse=True)[self.k]
+            self.counters = {key: weight - cut for key, weight in self.counters.items() if weight > cut}
+            self.error += cut
+
+    def add(self, keys, weights):
+        # Negative weights (refunds) would break the bounds
+        weights = np.clip(np.asarray(weights, dtype=np.float64), 0, None)
+        batch = pd.Series(weights).groupby(np.asarray(keys)).sum()
+        self.total += float(weights.sum())
+        self.merge_counters(dict(zip(batch.index.tolist(), batch.tolist())), 0.0)
+
+    def merge(self, other):
+        self.total += other.total
+        self.merge_counters(other.counters, other.error)
+        return self
+
+    def top(self, n=10):
+        """
+        :param n: keys to return
+        :return: list of (key, lower bound, upper bound), heaviest first
+        """
+        ranked = sorted(self.counters.items(), key=lambda item: item[1], reverse=True)[:n]
+        return [(key, weight, weight + self.error) for key, weight in ranked]
+
+
+def route_key(pickup, dropoff):
+    return np.asarray(pickup, dtype=np.int64) * 1000 + np.asarray(dropoff, dtype=np.int64)
+
+
+class SketchStore:
+    def __init__(self, hll_precision=10, relative_accuracy=0.01, cms_epsilon=0.001, cms_delta=0.01,
+                 heavy_hitters=200):
+        """
+        Sketches keyed by pickup date and zone
+        :param hll_precision: HyperLogLog precision of the distinct drop-off counts
+        :param relative_accuracy: quantile sketch accuracy
+        :param cms_epsilon: Count-Min overestimate bound as a fraction of the day's revenue
+        :param cms_delta: Count-Min failure probability
+        :param heavy_hitters: routes kept per day by the heavy hitter summary
+        """
+        self.hll_precision = hll_precision
+        self.relative_accuracy = relative_accuracy
+        self.cms_epsilon = cms_epsilon
+        self.cms_delta = cms_delta
+        self.heavy_hitters = heavy_hitters
+        self.zone_day = {}
+        self.day = {}
+        self.last_trip_id = -1
+
+    def zone_day_sketches(self, key):
+        if key not in self.zone_day:
+            self.zone_day[key] = {"dropoffs": HyperLogLog(self.hll_precision)}
+            for column in QUANTILE_COLUMNS:
+                self.zone_day[key][column] = QuantileSketch(self.relative_accuracy)
+        return self.zone_day[key]
+
+    def day_sketches(self, day):
+        if day not in self.day:
+            self.day[day] = {"routes": CountMinSketch(self.cms_epsilon, self.cms_delta),
+                             "top_routes": HeavyHitters(self.heavy_hitters)}
+        return self.day[day]
+
+    def add_batch(self, df):
+        """
+        Fold a batch of trips into the sketches
+        :param df: frame with pickupdate, pickuplocation, dropofflocation, totalamount and QUANTILE_COLUMNS
+        :return: None
+        """
+        dropoffs = df["dropofflocation"].to_numpy()
+        values = {column: df[column].to_numpy(dtype=np.float64) for column in QUANTILE_COLUMNS}
+        for key, rows in df.groupby(["pickupdate", "pickuplocation"]).indices.items():
+            sketches = self.zone_day_sketches(key)
+            sketches["dropoffs"].add(dropoffs[rows])
+            for column in QUANTILE_COLUMNS:
+                sketches[column].add(values[column][rows])
+
+        routes = route_key(df["pickuplocation"], df["dropofflocation"])
+        # Refunds (negative totals) are clipped to 0 for both route sketches: a negative weight
+        # would let Count-Min underestimate, and top_routes uses it as an upper bound
+        revenue = np.clip(df["totalamount"].fillna(0).to_numpy(dtype=np.float64), 0, None)
+        for day, rows in df.groupby("pickupdate").indices.items():
+            sketches = self.day_sketches(day)
+            sketches["routes"].add(routes[rows], revenue[rows])
+            sketches["top_routes"].add(routes[rows], revenue[rows])
+
+    def build(self, db_connection, batch_size=100000):
+        """
+        Fold every trip above the watermark into the sketches
+        :param db_connection: psycopg2 connection
+        :param batch_size: rows fetched per round trip
+        :return: number of trips added
+        """
+        added = 0
+        # Named cursor: rows are streamed from the server instead of loaded at once
+        with db_connection.cursor(name="sketch_trips") as cursor:
+            cursor.itersize = batch_size
+            cursor.execute("""
+                SELECT tr.id, t.pickupdate, tr.pickuplocation, tr.dropofflocation,
+                       tr.fareamount::float8, tr.tipamount::float8, tr.tripdistance::float8,
+                       tr.totalamount::float8
+                FROM trip tr
+                JOIN time t ON t.tripid = tr.id
+                WHERE tr.id > %s AND t.pickupdate IS NOT NULL AND tr.pickuplocation IS NOT NULL
+            """, (self.last_trip_id,))
+            columns = ["id", "pickupdate", "pickuplocation", "dropofflocation"] + QUANTILE_COLUMNS + ["totalamount"]
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                batch = pd.DataFrame(rows, columns=columns)
+                self.add_batch(batch)
+                self.last_trip_id = max(self.last_trip_id, int(batch["id"].max()))
+                added += len(batch)
+                print(f"Sketched {added} trips")
+        db_connection.commit()
+        return added
+
+    def merge(self, other):
+        """
+        Combine a store built over other trips, e.g. another month
+        :param other: SketchStore with the same parameters
+        :return: self
+        """
+        for key, sketches in other.zone_day.items():
+            mine = self.zone_day_sketches(key)
+            for name, sketch in sketches.items():
+                mine[name].merge(sketch)
+        for day, sketches in other.day.items():
+            mine = self.day_sketches(day)
+            for name, sketch in sketches.items():
+                mine[name].merge(sketch)
+        self.last_trip_id = max(self.last_trip_id, other.last_trip_id)
+        return self
+
+    def in_range(self, day, start, end):
+        return (start is None or day >= start) and (end is None or day <= end)
+
+    def merged_zone_day(self, name, zones=None, start=None, end=None):
+        merged = None
+        for (day, zone), sketches in self.zone_day.items():
+            if (zones is None or zone in zones) and self.in_range(day, start, end):
+                merged = copy.deepcopy(sketches[name]) if merged is None else merged.merge(sketches[name])
+        return merged
+
+    def merged_day(self, name, start=None, end=None):
+        merged = None
+        for day, sketches in self.day.items():
+            if self.in_range(day, start, end):
+                merged = copy.deepcopy(sketches[name]) if merged is None else merged.merge(sketches[name])
+        return merged
+
+    def distinct_dropoffs(self, zones=None, start=None, end=None):
+        """
+        :return: (estimated distinct drop-off zones, relative standard error)
+        """
+        sketch = self.merged_zone_day("dropoffs", zones, start, end)
+        if sketch is None:
+            return 0.0, 0.0
+        return sketch.count(), sketch.error_bound()
+
+    def quantile(self, column, q, zones=None, start=None, end=None):
+        """
+        :return: (approximate quantile of column, relative error bound)
+        """
+        sketch = self.merged_zone_day(column, zones, start, end)
+        if sketch is None:
+            return None, self.relative_accuracy
+        return sketch.quantile(q), self.relative_accuracy
+
+    def top_routes(self, n=10, start=None, end=None):
+        """
+        :return: list of ((pickup zone, dropoff zone), lower bound, upper bound) by revenue
+        """
+        summary = self.merged_day("top_routes", start, end)
+        if summary is None:
+            return []
+        counts = self.merged_day("routes", start, end)
+        # Count-Min never underestimates, so it can tighten the upper bound
+        return [((key // 1000, key % 1000), lower, min(upper, counts.estimate(key)))
+                for key, lower, upper in summary.top(n)]
+
+    def route_revenue(self, pickup, dropoff, start=None, end=None):
+        """
+        :return: (revenue estimate that never underestimates, overestimate bound)
+        """
+        counts = self.merged_day("routes", start, end)
+        if counts is None:
+            return 0.0, 0.0
+        return counts.estimate(int(route_key(pickup, dropoff))), counts.error_bound()
+
+    def save(self, path=SKETCH_FILE):
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(path=SKETCH_FILE):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+def main(path=SKETCH_FILE):
+    conn = db.connect()
+    try:
+        store = SketchStore.load(path) if os.path.exists(path) else SketchStore()
+        store.build(conn)
+        store.save(path)
+
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, borough, zone FROM location;")
+        locations = cursor.fetchall()
+    finally:
+        conn.close()
+
+    zone_names = {zone_id: zone for zone_id, _, zone in locations}
+    print("Top 10 routes by revenue (lower, upper):")
+    for (pickup, dropoff), lower, upper in store.top_routes(10):
+        print(f"  {zone_names.get(pickup)} -> {zone_names.get(dropoff)}: {lower:,.0f} .. {upper:,.0f}")
+
+    print("Median and p95 fare by borough:")
+    for borough in sorted({b for _, b, _ in locations if b}):
+        zones = {zone_id for zone_id, b, _ in locations if b == borough}
+        median, error = store.quantile("fareamount", 0.5, zones)
+        p95, _ = store.quantile("fareamount", 0.95, zones)
+        if median is not None:
+            print(f"  {borough}: median {median:.2f}, p95 {p95:.2f} (±{error:.0%})")
+
+
+if __name__ == "__main__":
+    main()